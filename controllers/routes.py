@@ -1,14 +1,20 @@
 import os
+import json
 import time
-from flask import render_template, request, redirect, url_for, flash, jsonify, current_app, send_file
+from flask import render_template, request, redirect, url_for, flash, jsonify, current_app, send_file, Response, stream_with_context, session
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from app import app, db
 from models.models import User, Job, Candidate, CandidateComment, UserActivity, BlockedIP, LoginAttempt
-from services.ai_service import analyze_resume
+from services.ai_service import analyze_resume, stream_resume_analysis, get_known_failure, forget_known_failure
 from services.file_processor import process_uploaded_file
-from services.job_suggestion_service import generate_job_suggestions, get_job_title_suggestions
+from services.job_suggestion_service import (generate_job_suggestions, get_job_title_suggestions, title_index,
+                                             stream_job_suggestions, suggestion_streams)
 from services.security_service import security_service
+from services.llm_client import llm_call_context, parse_model_routes
+from services.retry_service import reset_retry_state
+from services.cache_service import cache_policy
+from services.job_digest_service import start_digest_refresh
 from sqlalchemy.exc import SQLAlchemyError
 # Import will be done locally to avoid circular imports
 import logging
@@ -50,6 +56,45 @@ def log_user_activity(user_id, action, details, ip_address=None, user_agent=None
         logging.error(f"Erro ao registrar atividade: {e}")
         return False
 
+def apply_job_processing_settings(job, form):
+    """Aplica as configurações de processamento (triagem local) enviadas no formulário da vaga"""
+    threshold = form.get('prescreen_threshold', '').strip().replace(',', '.')
+    top_k = form.get('prescreen_top_k', '').strip()
+    
+    try:
+        job.prescreen_threshold = min(max(float(threshold), 0.0), 10.0) if threshold else None
+    except ValueError:
+        job.prescreen_threshold = None
+    
+    try:
+        job.prescreen_top_k = int(top_k) if top_k and int(top_k) > 0 else None
+    except ValueError:
+        job.prescreen_top_k = None
+    
+    # Processamento em camadas: score primeiro, relatório completo sob demanda
+    job.tiered_processing = form.get('tiered_processing') == 'on'
+    report_top_n = form.get('report_top_n', '').strip()
+    try:
+        job.report_top_n = int(report_top_n) if report_top_n and int(report_top_n) > 0 else None
+    except ValueError:
+        job.report_top_n = None
+    
+    # Rotas de modelo por finalidade (sobrescrevem as da implantação)
+    model_routes = form.get('model_routes', '').strip()
+    try:
+        routes = parse_model_routes(model_routes)
+        job.model_routes = json.dumps(routes, ensure_ascii=False) if routes else None
+    except ValueError as e:
+        flash(f'Rotas de modelo ignoradas: {str(e)}', 'warning')
+    
+    # Expiração do cache de análises da vaga (vazio = padrão da implantação)
+    for field in ('cache_ttl_hours', 'cache_stale_hours'):
+        hours = form.get(field, '').strip()
+        try:
+            setattr(job, field, int(hours) if hours and int(hours) >= 0 else None)
+        except ValueError:
+            setattr(job, field, None)
+
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -432,6 +477,111 @@ def ai_monitor():
                          failed_candidates=failed_candidates,
                          job_stats=job_stats)
 
+@app.route('/api/ai-monitor/llm-metrics')
+@login_required
+def api_llm_metrics():
+    """Latência, vazão e tokens das chamadas à IA (telemetria)"""
+    from services.telemetry_service import get_llm_metrics
+    
+    try:
+        hours = min(max(int(request.args.get('hours', 24)), 1), 24 * 30)
+    except ValueError:
+        hours = 24
+    
+    # Usuários regulares veem apenas as chamadas das suas vagas
+    job_ids = None if current_user.is_admin() else [job.id for job in Job.query.filter_by(created_by=current_user.id)]
+    
+    try:
+        metrics = get_llm_metrics(hours=hours, job_ids=job_ids)
+        metrics['job_titles'] = {
+            job.id: job.title for job in Job.query.filter(Job.id.in_(list(metrics['by_job'].keys()))).all()
+        } if metrics['by_job'] else {}
+        from services.cache_service import analysis_cache
+        metrics['cache'] = analysis_cache.get_cache_stats()
+        return jsonify(metrics)
+    except Exception as e:
+        logging.error(f"Error loading LLM metrics: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/admin/cache')
+@login_required
+def api_admin_cache():
+    """Cache de análises: estatísticas, taxa de acertos, entradas por vaga e distribuição de idade"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
+    from services.cache_admin import cache_overview
+    overview = cache_overview()
+    
+    job_ids = [int(job['job_id']) for job in overview['by_job'] if (job['job_id'] or '').isdigit()]
+    titles = {str(job.id): job.title for job in Job.query.filter(Job.id.in_(job_ids)).all()} if job_ids else {}
+    for job in overview['by_job']:
+        job['title'] = titles.get(job['job_id'])
+    
+    return jsonify(overview)
+
+@app.route('/api/admin/cache/purge', methods=['POST'])
+@login_required
+def api_admin_cache_purge():
+    """Remove entradas do cache por vaga ({job_id}) ou por versão do prompt ({prompt_version} ou {outdated_prompts: true})"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
+    from services.cache_service import analysis_cache
+    data = request.get_json(silent=True) or {}
+    
+    try:
+        if data.get('job_id'):
+            purged = analysis_cache.purge_job(int(data['job_id']))
+            details = f"vaga {data['job_id']}"
+        elif data.get('outdated_prompts'):
+            purged = analysis_cache.purge_outdated_prompts()
+            details = 'versões antigas do prompt'
+        elif data.get('prompt_version') is not None:
+            purged = analysis_cache.purge_prompt_version(int(data['prompt_version']))
+            details = f"versão {data['prompt_version']} do prompt"
+        else:
+            return jsonify({'success': False, 'message': 'Informe job_id, prompt_version ou outdated_prompts'}), 400
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Parâmetros inválidos'}), 400
+    
+    activity = UserActivity(
+        user_id=current_user.id,
+        action='purge_analysis_cache',
+        details=f'{purged} entradas do cache removidas ({details})'
+    )
+    db.session.add(activity)
+    db.session.commit()
+    
+    return jsonify({'success': True, 'purged': purged, 'message': f'{purged} entradas removidas ({details})'})
+
+@app.route('/api/admin/cache/warm', methods=['POST'])
+@login_required
+def api_admin_cache_warm():
+    """Pré-aquece o cache com as análises salvas dos candidatos ({job_id, limit} opcionais), em segundo plano"""
+    if not current_user.is_admin():
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        job_id = int(data['job_id']) if data.get('job_id') else None
+        limit = int(data['limit']) if data.get('limit') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Parâmetros inválidos'}), 400
+    
+    def warm_worker():
+        from services.cache_admin import warm_cache
+        try:
+            with app.app_context():
+                warm_cache(job_id=job_id, limit=limit)
+        except Exception as e:
+            logging.error(f"Error warming analysis cache: {e}", exc_info=True)
+    
+    import threading
+    threading.Thread(target=warm_worker, name='cache-warm', daemon=True).start()
+    
+    return jsonify({'success': True, 'message': 'Pré-aquecimento do cache iniciado'}), 202
+
 # Job management routes
 @app.route('/jobs')
 @login_required
@@ -457,17 +607,23 @@ def create_job():
             requirements=requirements,
             created_by=current_user.id
         )
+        apply_job_processing_settings(job, request.form)
+        job.render_requirements_html()
         
         db.session.add(job)
         db.session.commit()
+        start_digest_refresh(job.id)
         
         # Registrar atividade de criação de vaga
         log_user_activity(current_user.id, 'create_job', f'Vaga criada: {title}')
         
+        # Novo título disponível no autocompletar deste worker (os demais recarregam do banco)
+        title_index.add(title)
+        
         flash('Vaga criada com sucesso! Agora você pode fazer upload de currículos para análise.', 'success')
         return redirect(url_for('job_detail', job_id=job.id))
     
-    return render_template('jobs/create.html')
+    return render_template('jobs/create.html', default_cache_policy=cache_policy(None))
 
 @app.route('/jobs/<int:job_id>')
 @login_required
@@ -479,6 +635,10 @@ def job_detail(job_id):
         flash('Acesso negado. Você só pode ver suas próprias vagas.', 'error')
         return redirect(url_for('jobs_list'))
     
+    # Backfill do HTML dos requisitos para vagas criadas antes da pré-renderização
+    if job.ensure_rendered_requirements():
+        db.session.commit()
+    
     candidates = Candidate.query.filter_by(job_id=job_id).order_by(
         Candidate.ai_score.desc().nullslast()
     ).all()
@@ -510,8 +670,11 @@ def edit_job(job_id):
         job.title = request.form['title']
         job.description = request.form['description']
         job.requirements = request.form['requirements']
+        apply_job_processing_settings(job, request.form)
+        job.ensure_rendered_requirements()
         
         db.session.commit()
+        start_digest_refresh(job.id)
         
         # Registrar atividade de edição de vaga
         log_user_activity(current_user.id, 'edit_job', f'Vaga editada: {job.title}')
@@ -519,7 +682,7 @@ def edit_job(job_id):
         flash('Vaga atualizada com sucesso!', 'success')
         return redirect(url_for('job_detail', job_id=job.id))
     
-    return render_template('jobs/create.html', job=job)
+    return render_template('jobs/create.html', job=job, default_cache_policy=cache_policy(None))
 
 @app.route('/jobs/<int:job_id>/delete', methods=['POST'])
 @login_required
@@ -788,11 +951,27 @@ def candidate_detail(candidate_id):
     if not current_user.is_admin() and candidate.job.created_by != current_user.id:
         flash('Acesso negado. Você só pode ver candidatos das suas próprias vagas.', 'error')
         return redirect(url_for('candidates_list'))
+
+    # Renderiza o HTML da análise apenas se ainda não existir ou estiver em versão antiga
+    if candidate.ensure_rendered_analysis():
+        db.session.commit()
+    
+    # Processamento em camadas: o relatório completo é gerado quando o recrutador abre o candidato
+    if candidate.analysis_status == 'completed' and candidate.report_status == 'pending':
+        from processors.report_processor import request_full_report
+        request_full_report(candidate.id)
+
+    # Falha registrada no cache negativo: exibe o motivo e a opção de forçar nova tentativa
+    known_failure = None
+    if candidate.analysis_status == 'failed':
+        failure_result = get_known_failure(candidate.file_path)
+        known_failure = failure_result['known_failure'] if failure_result else None
     
     comments = CandidateComment.query.filter_by(candidate_id=candidate_id).order_by(
         CandidateComment.created_at.desc()
     ).all()
-    return render_template('candidates/detail.html', candidate=candidate, comments=comments)
+    return render_template('candidates/detail.html', candidate=candidate, comments=comments,
+                         known_failure=known_failure)
 
 @app.route('/candidates/<int:candidate_id>/update_status', methods=['POST'])
 @login_required
@@ -1014,6 +1193,7 @@ def api_job_processing_status(job_id):
             'processing': 0,
             'completed': 0,
             'failed': 0,
+            'screened_out': 0,
             'deleted': 0,
             'total': len(candidates)
         }
@@ -1032,23 +1212,120 @@ def api_job_processing_status(job_id):
                 'name': candidate.name,
                 'analysis_status': candidate.analysis_status,
                 'ai_score': candidate.ai_score,
+                'prescreen_score': candidate.prescreen_score,
                 'analyzed_at': analyzed_at_brazil
             })
         
         active_total = status_counts['total'] - status_counts['deleted']
-        progress_percentage = round((status_counts['completed'] + status_counts['failed']) / max(active_total, 1) * 100, 1) if active_total > 0 else 0
+        finished_total = status_counts['completed'] + status_counts['failed'] + status_counts['screened_out']
+        progress_percentage = round(finished_total / max(active_total, 1) * 100, 1) if active_total > 0 else 0
         
         return jsonify({
             'status_counts': status_counts,
             'candidates': candidate_details,
             'progress_percentage': progress_percentage,
-            'is_complete': active_total > 0 and (status_counts['completed'] + status_counts['failed']) >= active_total
+            'is_complete': active_total > 0 and finished_total >= active_total
         })
         
     except Exception as e:
         logging.error(f"Error getting processing status: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/candidates/<int:candidate_id>/report_status')
+@login_required
+def api_candidate_report_status(candidate_id):
+    """Status do relatório completo (processamento em camadas)"""
+    candidate = Candidate.query.get_or_404(candidate_id)
+    
+    if not current_user.is_admin() and candidate.job.created_by != current_user.id:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    return jsonify({
+        'candidate_id': candidate.id,
+        'report_status': candidate.report_status,
+        'analysis_refreshing': bool(candidate.analysis_refreshing),
+        'ai_score': candidate.ai_score
+    })
+
+@app.route('/api/candidates/<int:candidate_id>/generate_report', methods=['POST'])
+@login_required
+def api_generate_candidate_report(candidate_id):
+    """Solicita novamente o relatório completo de um candidato pontuado em camadas"""
+    candidate = Candidate.query.get_or_404(candidate_id)
+    
+    if not current_user.is_admin() and candidate.job.created_by != current_user.id:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    if candidate.analysis_status != 'completed' or candidate.report_status not in ('pending', 'generating', 'failed'):
+        return jsonify({'success': False, 'error': 'Candidato não aguarda relatório completo'}), 400
+    
+    candidate.report_status = 'pending'
+    db.session.commit()
+    
+    from processors.report_processor import request_full_report
+    request_full_report(candidate.id)
+    
+    return jsonify({'success': True, 'message': f'Relatório de {candidate.name} em geração'})
+
+def save_streamed_analysis(candidate, result):
+    """Salva o resultado da análise em streaming (mesmo salvamento e novas tentativas do processador otimizado)"""
+    from processors.optimized_processor import optimized_processor
+    optimized_processor.save_analysis_result(candidate, result, tiered=bool(candidate.job.tiered_processing))
+
+@app.route('/api/candidates/<int:candidate_id>/analysis/stream', methods=['POST'])
+@login_required
+def api_stream_candidate_analysis(candidate_id):
+    """
+    Reprocessa a análise enviando o texto do relatório por SSE (text/event-stream) conforme é gerado
+    Eventos: chunk (trecho novo), replace (texto completo após continuação), done e error
+    Ocupa uma thread do worker gthread por até STREAM_ANALYSIS_MAX_SECONDS (abaixo do timeout do gunicorn)
+    """
+    candidate = Candidate.query.get_or_404(candidate_id)
+    
+    if not current_user.is_admin() and candidate.job.created_by != current_user.id:
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    if candidate.analysis_status == 'processing':
+        return jsonify({'error': 'Análise já em andamento'}), 409
+    
+    candidate.analysis_status = 'processing'
+    candidate.report_status = None
+    reset_retry_state(candidate)
+    db.session.commit()
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        try:
+            with llm_call_context(job_id=candidate.job_id, candidate_id=candidate.id):
+                for event, payload in stream_resume_analysis(candidate.file_path, candidate.file_type, candidate.job):
+                    if event == 'result':
+                        save_streamed_analysis(candidate, payload)
+                        yield sse('done', {'status': candidate.analysis_status, 'score': candidate.ai_score,
+                                           'refreshing': bool(candidate.analysis_refreshing)})
+                    else:
+                        yield sse(event, {'text': payload})
+        except Exception as e:
+            logging.error(f"Error streaming analysis for candidate {candidate_id}: {str(e)}", exc_info=True)
+            db.session.rollback()
+            candidate.analysis_status = 'pending'
+            db.session.commit()
+            yield sse('error', {'message': 'Erro ao gerar a análise em tempo real'})
+        finally:
+            # Conexão encerrada antes do fim: a análise segue no processamento em segundo plano
+            if candidate.analysis_status in ('processing', 'pending'):
+                candidate.analysis_status = 'pending'
+                db.session.commit()
+                from processors.optimized_processor import start_optimized_analysis
+                start_optimized_analysis([candidate.id], skip_prescreen=True)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/candidates/<int:candidate_id>/reprocess', methods=['POST'])
 @login_required
 def api_reprocess_candidate(candidate_id):
@@ -1082,20 +1359,27 @@ def api_reprocess_candidate(candidate_id):
         
         logging.info(f"Status atual: {candidate.analysis_status}, Score: {candidate.ai_score}")
         
+        # Forçar nova tentativa: o arquivo sai do cache negativo e é extraído novamente
+        if (request.get_json(silent=True) or {}).get('force'):
+            forget_known_failure(candidate.file_path)
+            print(f"🔓 Falha conhecida do arquivo descartada para candidato {candidate_id}")
+        
         # Reset candidate status
         candidate.analysis_status = 'pending'
         candidate.ai_score = None
         candidate.ai_summary = None
         candidate.ai_analysis = None
         candidate.analyzed_at = None
+        candidate.report_status = None
+        reset_retry_state(candidate)
         db.session.commit()
         
         logging.info(f"Status resetado para 'pending'")
         
-        # Start optimized processing
+        # Start optimized processing (reprocessamento manual ignora a triagem local)
         print(f"🚀 Iniciando processamento otimizado para candidato {candidate_id}")
         from processors.optimized_processor import start_optimized_analysis
-        start_optimized_analysis([candidate_id])
+        start_optimized_analysis([candidate_id], skip_prescreen=True)
         
         print(f"✅ Processamento iniciado com sucesso para candidato {candidate_id}")
         logging.info(f"Processamento iniciado para candidato {candidate_id}")
@@ -1139,6 +1423,11 @@ def api_process_pending():
         
         candidate_ids = [c.id for c in candidates_to_process]
         
+        # ?force=1: arquivos com falha conhecida também são extraídos novamente
+        if request.args.get('force') == '1':
+            for candidate in candidates_to_process:
+                forget_known_failure(candidate.file_path)
+        
         from processors.optimized_processor import start_optimized_analysis
         start_optimized_analysis(candidate_ids)
         
@@ -1179,6 +1468,11 @@ def api_reprocess_all_candidates(job_id):
         
         candidate_ids = [c.id for c in candidates_to_process]
         
+        # ?force=1: arquivos com falha conhecida também são extraídos novamente
+        if request.args.get('force') == '1':
+            for candidate in candidates_to_process:
+                forget_known_failure(candidate.file_path)
+        
         from processors.optimized_processor import start_optimized_analysis
         start_optimized_analysis(candidate_ids)
         
@@ -1575,6 +1869,54 @@ def api_job_suggestions():
             'error': 'Erro interno do servidor'
         }), 500
 
+@app.route('/api/job-suggestions/stream', methods=['POST'])
+@login_required
+def api_stream_job_suggestions():
+    """
+    Sugestões de descrição e requisitos por SSE (text/event-stream), enviadas conforme são geradas
+    Eventos: chunk e replace ({field, text}), done (sugestão completa), cancelled e error
+    Um pedido mais novo da mesma sessão encerra a geração anterior e libera o worker
+    """
+    data = request.get_json(silent=True) or {}
+    job_title = data.get('job_title', '').strip()
+    
+    if len(job_title) < 3:
+        return jsonify({
+            'success': False,
+            'error': 'Título deve ter pelo menos 3 caracteres'
+        }), 400
+    
+    generation = suggestion_streams.start(f"{current_user.id}:{session.get('_id', '')}")
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        try:
+            for event, payload in stream_job_suggestions(job_title, generation):
+                if event == 'result':
+                    if payload['success']:
+                        yield sse('done', {'description': payload['description'],
+                                           'requirements': payload['requirements'],
+                                           'source': payload.get('source')})
+                    else:
+                        yield sse('error', {'message': payload.get('error', 'Erro ao gerar sugestões')})
+                elif event == 'cancelled':
+                    yield sse('cancelled', {})
+                else:
+                    yield sse(event, payload)
+        except Exception as e:
+            logging.error(f"Erro no streaming de sugestões de vaga: {e}")
+            yield sse('error', {'message': 'Erro ao gerar sugestões'})
+        finally:
+            generation.finish()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/job-title-suggestions', methods=['POST'])
 @login_required
 def api_job_title_suggestions():
@@ -1601,7 +1943,8 @@ def api_job_title_suggestions():
         if suggestions['success']:
             return jsonify({
                 'success': True,
-                'suggestions': suggestions['suggestions']
+                'suggestions': suggestions['suggestions'],
+                'source': suggestions.get('source')
             })
         else:
             return jsonify({
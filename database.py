@@ -36,5 +36,32 @@ def init_db(app):
         # Criar todas as tabelas
         db.create_all()
         
+        # Adicionar colunas novas em tabelas já existentes
+        add_missing_columns()
+        
         print(f"✅ Banco de dados inicializado com sucesso!")
         print(f"✅ Schema '{SCHEMA_NAME}' verificado/criado")
+
+def add_missing_columns():
+    """
+    Adiciona colunas novas dos models em tabelas já existentes
+    (db.create_all cria apenas tabelas, não altera as existentes)
+    """
+    inspector = db.inspect(db.engine)
+    preparer = db.engine.dialect.identifier_preparer
+    
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name, schema=table.schema):
+                continue
+            
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name, schema=table.schema)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(db.text(
+                    f'ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.quote(column.name)} {column_type}'
+                ))
+                print(f"✅ Coluna '{column.name}' adicionada à tabela '{table.name}'")
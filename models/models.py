@@ -2,6 +2,7 @@ from datetime import datetime
 import pytz
 from database import db
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
 
 def get_brazil_time():
@@ -99,7 +100,29 @@ class Job(db.Model):
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=False)
     requirements = db.Column(db.Text, nullable=False)
+    requirements_html = db.Column(db.Text)  # Requisitos pré-renderizados em HTML
+    requirements_html_version = db.Column(db.Integer)  # Versão do formato usado na renderização
     status = db.Column(db.String(20), default='active')  # 'active', 'closed', 'draft'
+    
+    # Triagem local antes da IA (None = desativado)
+    prescreen_threshold = db.Column(db.Float)  # Score mínimo de aderência (0.0 a 10.0)
+    prescreen_top_k = db.Column(db.Integer)  # Quantidade máxima de candidatos enviados à IA por lote
+    
+    # Processamento em camadas: score primeiro, relatório completo sob demanda
+    tiered_processing = db.Column(db.Boolean, default=False)
+    report_top_n = db.Column(db.Integer)  # Relatórios gerados em segundo plano para os N maiores scores
+    
+    # Resumo canônico dos requisitos usado nos prompts (ver services/job_digest_service.py)
+    requirements_digest = db.Column(db.Text)
+    digest_hash = db.Column(db.String(64))  # Hash do conteúdo da vaga usado para gerar o digest
+    
+    # Rotas de modelo da vaga em JSON, ex: {"score": {"model": "deepseek-chat", "timeout": 20}}
+    model_routes = db.Column(db.Text)
+    
+    # Expiração do cache de análises da vaga em horas (None = padrão da implantação)
+    cache_ttl_hours = db.Column(db.Integer)  # Entradas usadas sem nova chamada à IA
+    cache_stale_hours = db.Column(db.Integer)  # Depois do TTL: servidas enquanto são atualizadas em segundo plano
+    
     created_at = db.Column(db.DateTime, default=get_brazil_time)
     updated_at = db.Column(db.DateTime, default=get_brazil_time, onupdate=get_brazil_time)
     
@@ -108,6 +131,70 @@ class Job(db.Model):
     
     # Relationships
     candidates = db.relationship('Candidate', backref='job', lazy=True, cascade='all, delete-orphan')
+    
+    @validates('requirements')
+    def _invalidate_requirements_html(self, key, value):
+        # Requisitos alterados: o HTML salvo não corresponde mais ao conteúdo
+        self.requirements_html_version = None
+        return value
+    
+    def render_requirements_html(self):
+        """Renderiza e armazena o HTML dos requisitos da vaga"""
+        from services.render_service import render_requirements_html, REQUIREMENTS_FORMAT_VERSION
+        self.requirements_html = render_requirements_html(self.requirements)
+        self.requirements_html_version = REQUIREMENTS_FORMAT_VERSION
+    
+    def ensure_rendered_requirements(self):
+        """
+        Renderiza novamente os requisitos apenas se o HTML estiver ausente ou com versão antiga
+        Retorna True quando o HTML foi atualizado (e precisa ser salvo)
+        """
+        from services.render_service import REQUIREMENTS_FORMAT_VERSION
+        if self.requirements_html_version == REQUIREMENTS_FORMAT_VERSION:
+            return False
+        self.render_requirements_html()
+        return True
+    
+    def is_digest_current(self):
+        """Verifica se o digest salvo corresponde ao conteúdo atual da vaga"""
+        from services.job_digest_service import compute_job_digest_hash
+        return bool(self.requirements_digest) and self.digest_hash == compute_job_digest_hash(self)
+    
+    def ensure_digest(self):
+        """
+        Gera o digest apenas se estiver ausente ou se o texto da vaga mudou
+        Retorna True quando o digest foi atualizado (e precisa ser salvo)
+        """
+        from services.job_digest_service import build_job_digest, compute_job_digest_hash
+        if self.is_digest_current():
+            return False
+        self.requirements_digest = build_job_digest(self)
+        self.digest_hash = compute_job_digest_hash(self)
+        return True
+    
+    def get_content_version(self):
+        """Hash do conteúdo da vaga que entra nos prompts (usado nas chaves do cache de análises)"""
+        from services.job_digest_service import compute_job_digest_hash
+        return compute_job_digest_hash(self)
+    
+    def get_model_routes(self):
+        """Rotas de modelo configuradas na vaga (ver services/llm_client.py)"""
+        from services.llm_client import parse_model_routes
+        try:
+            return parse_model_routes(self.model_routes)
+        except ValueError:
+            return {}
+    
+    def get_cache_policy(self):
+        """(ttl_hours, stale_hours) do cache de análises da vaga"""
+        from services.cache_service import DEFAULT_CACHE_TTL_HOURS, DEFAULT_CACHE_STALE_HOURS
+        ttl_hours = self.cache_ttl_hours if self.cache_ttl_hours is not None else DEFAULT_CACHE_TTL_HOURS
+        stale_hours = self.cache_stale_hours if self.cache_stale_hours is not None else DEFAULT_CACHE_STALE_HOURS
+        return ttl_hours, stale_hours
+    
+    def has_prescreen_rules(self):
+        """Verifica se a vaga tem triagem local configurada"""
+        return self.prescreen_threshold is not None or bool(self.prescreen_top_k)
 
 class Candidate(db.Model):
     __tablename__ = 'candidate'
@@ -127,12 +214,30 @@ class Candidate(db.Model):
     ai_analysis = db.Column(db.Text)
     extracted_skills = db.Column(db.Text)  # JSON string of skills
     
+    # HTML pré-renderizado da análise (gerado ao salvar o resultado)
+    ai_summary_html = db.Column(db.Text)
+    ai_analysis_html = db.Column(db.Text)
+    ai_render_version = db.Column(db.Integer)  # Versão do formato usado na renderização
+    prescreen_score = db.Column(db.Float)  # Score da triagem local (0.0 to 10.0)
+    
+    # Relatório completo no processamento em camadas (None = gerado junto com o score)
+    report_status = db.Column(db.String(20))  # 'pending', 'generating', 'completed', 'failed'
+    
+    # Novas tentativas automáticas (ver services/retry_service.py)
+    retry_count = db.Column(db.Integer, default=0)
+    retry_state = db.Column(db.String(20))  # 'scheduled', 'dead_letter'
+    next_retry_at = db.Column(db.DateTime, index=True)  # UTC
+    last_error_class = db.Column(db.String(30))  # 'rate_limit', 'timeout', 'extraction', ...
+    
+    # Análise vencida servida do cache enquanto uma nova é gerada em segundo plano
+    analysis_refreshing = db.Column(db.Boolean, default=False)
+    
     # Extracted Information
     extracted_metadata = db.Column(db.Text)  # JSON string with additional extracted info
     
     # Status Management
     status = db.Column(db.String(20), default='pending')  # 'pending', 'analyzing', 'analyzed', 'interested', 'rejected'
-    analysis_status = db.Column(db.String(20), default='pending')  # 'pending', 'processing', 'completed', 'failed'
+    analysis_status = db.Column(db.String(20), default='pending')  # 'pending', 'processing', 'completed', 'failed', 'screened_out'
     
     # Timestamps
     uploaded_at = db.Column(db.DateTime, default=get_brazil_time)
@@ -153,6 +258,39 @@ class Candidate(db.Model):
     def set_skills_list(self, skills_list):
         import json
         self.extracted_skills = json.dumps(skills_list)
+    
+    @validates('ai_summary', 'ai_analysis')
+    def _invalidate_rendered_analysis(self, key, value):
+        # Texto alterado: o HTML salvo não corresponde mais ao conteúdo
+        self.ai_render_version = None
+        return value
+    
+    def render_analysis_html(self):
+        """Renderiza e armazena o HTML do resumo e da análise"""
+        from services.render_service import render_summary_html, render_analysis_html, RENDER_FORMAT_VERSION
+        self.ai_summary_html = render_summary_html(self.ai_summary, self.ai_analysis)
+        self.ai_analysis_html = render_analysis_html(self.ai_analysis)
+        self.ai_render_version = RENDER_FORMAT_VERSION
+    
+    def ensure_rendered_analysis(self):
+        """
+        Renderiza novamente o HTML apenas se estiver ausente ou com versão antiga
+        Retorna True quando o HTML foi atualizado (e precisa ser salvo)
+        """
+        from services.render_service import RENDER_FORMAT_VERSION
+        if self.ai_render_version == RENDER_FORMAT_VERSION:
+            return False
+        self.render_analysis_html()
+        return True
+    
+    def is_report_pending(self):
+        """Verifica se o candidato tem apenas o score e aguarda o relatório completo"""
+        return self.analysis_status == 'completed' and self.report_status in ('pending', 'generating')
+    
+    def is_analysis_outdated(self):
+        """Verifica se a análise é genérica (não baseada no currículo real)"""
+        from services.render_service import is_outdated_analysis
+        return is_outdated_analysis(self.ai_analysis)
 
 class CandidateComment(db.Model):
     __tablename__ = 'candidate_comment'
@@ -225,3 +363,47 @@ class LoginAttempt(db.Model):
     
     def __repr__(self):
         return f'<LoginAttempt {self.ip_address}: {"Success" if self.success else "Failed"}>'
+
+class AnalysisLock(db.Model):
+    """
+    Tabela de locks compartilhada entre os workers do gunicorn (single-flight)
+    Uma linha por análise em andamento; locks de workers que caíram expiram sozinhos
+    """
+    __tablename__ = 'analysis_lock'
+    __table_args__ = {'schema': 'appcurriculos'}
+    
+    lock_key = db.Column(db.String(64), primary_key=True)  # Hash da chave da análise
+    owner = db.Column(db.String(120))  # host:pid:thread do worker que está executando
+    acquired_at = db.Column(db.DateTime)  # UTC
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)  # UTC
+    
+    def __repr__(self):
+        return f'<AnalysisLock {self.lock_key} by {self.owner}>'
+
+class LLMCallLog(db.Model):
+    """Telemetria de cada chamada à IA (gravada em lote por services/telemetry_service.py)"""
+    __tablename__ = 'llm_call_log'
+    __table_args__ = {'schema': 'appcurriculos'}
+    
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, index=True)  # UTC
+    purpose = db.Column(db.String(50), index=True)  # 'score', 'score_batch', 'analysis', 'job_suggestion', ...
+    model = db.Column(db.String(50))
+    
+    # Sem chave estrangeira: o histórico permanece mesmo após excluir vagas ou candidatos
+    job_id = db.Column(db.Integer, index=True)
+    candidate_id = db.Column(db.Integer)
+    
+    prompt_tokens = db.Column(db.Integer)
+    completion_tokens = db.Column(db.Integer)
+    cached_tokens = db.Column(db.Integer)
+    latency_ms = db.Column(db.Integer)
+    retries = db.Column(db.Integer, default=0)
+    outcome = db.Column(db.String(20))  # 'success', 'error', 'timeout', 'cancelled' (cópia descartada pelo hedging)
+    error_type = db.Column(db.String(100))
+    hedged = db.Column(db.Boolean, default=False)  # Chamada duplicada por passar do p95
+    tokens_saved = db.Column(db.Integer)  # Continuação de relatório cortado: tokens de saída não regerados
+    route = db.Column(db.String(60))  # Origem da rota e finalidade, ex: 'job:score' (ver llm_client.resolve_route)
+    
+    def __repr__(self):
+        return f'<LLMCallLog {self.purpose} {self.outcome} {self.latency_ms}ms>'
@@ -95,9 +95,13 @@ def process_candidate_background(candidate_id):
             
             # Generate score using ai_service
             score = generate_score_only(resume_text, candidate.job)
+            if score is None:
+                raise ValueError("A IA não retornou um score válido")
             
             # Generate summary and analysis using ai_service (new format)
             analysis_result = generate_summary_and_analysis(resume_text, candidate.job)
+            if not analysis_result:
+                raise ValueError("A IA retornou uma análise incompleta")
             
             # Update candidate with new format
             candidate.ai_score = score
@@ -107,6 +111,8 @@ def process_candidate_background(candidate_id):
             # Usar timezone do Brasil
             brazil_tz = pytz.timezone('America/Sao_Paulo')
             candidate.analyzed_at = datetime.now(brazil_tz)
+            # Pré-renderiza o HTML exibido na página do candidato
+            candidate.render_analysis_html()
             
             db.session.commit()
             processing_status[candidate_id] = 'completed'
@@ -181,7 +187,8 @@ def get_processing_status(candidate_ids):
                 'pending': 0,
                 'processing': 0,
                 'completed': 0,
-                'failed': 0
+                'failed': 0,
+                'screened_out': 0
             }
             
             for candidate_id in candidate_ids:
@@ -90,8 +90,10 @@ class FastParallelProcessor:
                         candidate.extracted_skills = result.get('skills', '[]')
                         candidate.analysis_status = 'completed'
                         # Usar timezone do Brasil
-                    brazil_tz = pytz.timezone('America/Sao_Paulo')
-                    candidate.analyzed_at = datetime.now(brazil_tz)
+                        brazil_tz = pytz.timezone('America/Sao_Paulo')
+                        candidate.analyzed_at = datetime.now(brazil_tz)
+                        # Pré-renderiza o HTML exibido na página do candidato
+                        candidate.render_analysis_html()
                         
                         db.session.commit()
                         
@@ -16,8 +16,11 @@ os.environ['DATABASE_URL'] = 'postgresql://postgres.dxznqzpnsijpcmigpnfm:vYAeips
 
 from app import app, db
 from models.models import Candidate
-from services.file_processor import extract_text_from_file
-from services.ai_service import analyze_resume
+from services.ai_service import (analyze_resume, score_resume, score_resumes_batch, get_known_failure,
+                                 extract_resume_text, get_file_hash)
+from services.llm_client import llm_call_context
+from services.retry_service import classify_error, schedule_retry_or_dead_letter, reset_retry_state
+from processors.refresh_processor import mark_stale_result, request_analysis_refresh
 
 # Configure logging - enable detailed logging for debugging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -62,8 +65,13 @@ class OptimizedProcessor:
                 logger.info(f"Starting AI analysis for candidate {candidate_id}: {candidate.name}")
                 print(f"🔄 Iniciando análise IA para {candidate.name} (ID: {candidate_id})")
                 
-                # Analyze with AI
-                result = analyze_resume(candidate.file_path, candidate.file_type, candidate.job)
+                # Analyze with AI (processamento em camadas: apenas o score, relatório sob demanda)
+                tiered = bool(candidate.job.tiered_processing)
+                with llm_call_context(job_id=candidate.job_id, candidate_id=candidate_id):
+                    if tiered:
+                        result = score_resume(candidate.file_path, candidate.file_type, candidate.job)
+                    else:
+                        result = analyze_resume(candidate.file_path, candidate.file_type, candidate.job)
                 
                 # Log AI analysis result
                 if result:
@@ -73,66 +81,8 @@ class OptimizedProcessor:
                     logger.warning(f"AI analysis returned None for candidate {candidate_id}")
                     print(f"⚠️ Análise IA retornou None para {candidate.name}")
                 
-                if result and result.get('score') is not None:
-                    score = result.get('score', 0)
-                    summary = result.get('summary', '')
-                    analysis = result.get('analysis', '')
-                    
-                    # Check if analysis is complete
-                    is_complete = (
-                        score > 0 and
-                        summary and len(summary.strip()) > 50 and
-                        analysis and len(analysis.strip()) > 100 and
-                        not summary.startswith('Erro') and
-                        not analysis.startswith('FALHA NA ANÁLISE')
-                    )
-                    
-                    if is_complete:
-                        # Update candidate with results
-                        candidate.ai_score = score
-                        candidate.ai_summary = summary
-                        candidate.ai_analysis = analysis
-                        candidate.extracted_skills = result.get('skills', '[]')
-                        candidate.analysis_status = 'completed'
-                        # Usar timezone do Brasil
-                        brazil_tz = pytz.timezone('America/Sao_Paulo')
-                        candidate.analyzed_at = datetime.now(brazil_tz)
-                        
-                        db.session.commit()
-                        
-                        with self.lock:
-                            self.processing_status[candidate_id] = 'completed'
-                        
-                        # Log apenas scores altos para reduzir poluição
-                        if score >= 7:
-                            print(f"✓ {candidate.name} - Score: {score}")
-                        
-                        return True
-                    else:
-                        # Mark as failed due to incomplete analysis
-                        candidate.analysis_status = 'failed'
-                        candidate.ai_score = 0.0
-                        candidate.ai_summary = 'Análise incompleta'
-                        candidate.ai_analysis = 'FALHA NA ANÁLISE: Análise incompleta'
-                        db.session.commit()
-                        
-                        with self.lock:
-                            self.processing_status[candidate_id] = 'failed'
-                        
-                        return False
-                else:
-                    # Mark as failed
-                    candidate.analysis_status = 'failed'
-                    candidate.ai_score = 0.0
-                    candidate.ai_summary = 'Análise falhou'
-                    candidate.ai_analysis = 'Erro na análise'
-                    db.session.commit()
-                    
-                    with self.lock:
-                        self.processing_status[candidate_id] = 'failed'
-                    
-                    return False
-                    
+                return self.save_analysis_result(candidate, result, tiered)
+        
         except Exception as e:
             # Log detailed error information
             logger.error(f"Error processing candidate {candidate_id}: {str(e)}", exc_info=True)
@@ -148,6 +98,7 @@ class OptimizedProcessor:
                         candidate.ai_score = 0.0
                         candidate.ai_summary = f'FALHA: {error_details}'
                         candidate.ai_analysis = f'ANÁLISE FALHOU: {error_details}'
+                        self.schedule_retry(candidate, classify_error(e))
                         db.session.commit()
                         
                         print(f"✅ Erro salvo no banco para candidato {candidate_id}")
@@ -161,22 +112,304 @@ class OptimizedProcessor:
                 print(f"❌ Erro ao salvar falha no banco: {str(db_error)}")
             return False
     
-    def process_candidates_optimized(self, candidate_ids):
+    def save_analysis_result(self, candidate, result, tiered=False):
+        """
+        Salva o resultado de analyze_resume/score_resume no candidato e faz o commit
+        Falhas agendam nova tentativa ou vão para dead-letter conforme a classe do erro
+        (também usado pela análise em streaming da página do candidato)
+        Retorna True quando o resultado foi salvo como concluído
+        """
+        # Análise vencida servida do cache: salva agora, atualizada em segundo plano
+        stale = mark_stale_result(candidate, result)
+        if self.save_score_only(candidate, result):
+            if stale:
+                request_analysis_refresh(candidate.id)
+            return True
+        
+        if result and result.get('score') is not None:
+            score = result.get('score', 0)
+            summary = result.get('summary', '')
+            analysis = result.get('analysis', '')
+            
+            # Check if analysis is complete
+            is_complete = (
+                not result.get('error_class') and
+                score > 0 and
+                summary and len(summary.strip()) > 50 and
+                analysis and len(analysis.strip()) > 100 and
+                not summary.startswith('Erro') and
+                not analysis.startswith('FALHA NA ANÁLISE')
+            )
+            
+            if is_complete:
+                # Update candidate with results
+                candidate.ai_score = score
+                candidate.ai_summary = summary
+                candidate.ai_analysis = analysis
+                candidate.extracted_skills = result.get('skills', '[]')
+                candidate.analysis_status = 'completed'
+                candidate.report_status = 'completed' if tiered else None
+                reset_retry_state(candidate)
+                # Usar timezone do Brasil
+                brazil_tz = pytz.timezone('America/Sao_Paulo')
+                candidate.analyzed_at = datetime.now(brazil_tz)
+                # Pré-renderiza o HTML exibido na página do candidato
+                candidate.render_analysis_html()
+                
+                db.session.commit()
+                
+                if stale:
+                    request_analysis_refresh(candidate.id)
+                
+                with self.lock:
+                    self.processing_status[candidate.id] = 'completed'
+                
+                # Log apenas scores altos para reduzir poluição
+                if score >= 7:
+                    print(f"✓ {candidate.name} - Score: {score}")
+                
+                return True
+            else:
+                # Mark as failed due to incomplete analysis
+                candidate.analysis_status = 'failed'
+                candidate.ai_score = 0.0
+                candidate.ai_summary = 'Análise incompleta'
+                candidate.ai_analysis = 'FALHA NA ANÁLISE: Análise incompleta'
+                self.schedule_retry(candidate, result.get('error_class') or 'incomplete')
+                db.session.commit()
+                
+                with self.lock:
+                    self.processing_status[candidate.id] = 'failed'
+                
+                return False
+        else:
+            # Mark as failed
+            candidate.analysis_status = 'failed'
+            candidate.ai_score = 0.0
+            candidate.ai_summary = 'Análise falhou'
+            candidate.ai_analysis = 'Erro na análise'
+            self.schedule_retry(candidate, (result or {}).get('error_class') or 'incomplete')
+            db.session.commit()
+            
+            with self.lock:
+                self.processing_status[candidate.id] = 'failed'
+            
+            return False
+    
+    def schedule_retry(self, candidate, error_class):
+        """Agenda nova tentativa automática ou envia para dead-letter conforme a classe do erro"""
+        state = schedule_retry_or_dead_letter(candidate, error_class)
+        if state == 'scheduled':
+            print(f"🔁 {candidate.name}: nova tentativa {candidate.retry_count} agendada ({error_class}) para {candidate.next_retry_at:%H:%M:%S} UTC")
+        else:
+            print(f"🪦 {candidate.name}: sem novas tentativas automáticas ({error_class})")
+        return state
+    
+    def save_score_only(self, candidate, result):
+        """
+        Salva o resultado do processamento em camadas (apenas score, relatório pendente)
+        Retorna False quando o resultado não é um score válido
+        """
+        if not result or not result.get('report_pending') or not (result.get('score') or 0) > 0:
+            return False
+        
+        candidate.ai_score = result['score']
+        candidate.ai_summary = None
+        candidate.ai_analysis = None
+        candidate.extracted_skills = result.get('skills', '[]')
+        candidate.analysis_status = 'completed'
+        candidate.report_status = 'pending'
+        reset_retry_state(candidate)
+        brazil_tz = pytz.timezone('America/Sao_Paulo')
+        candidate.analyzed_at = datetime.now(brazil_tz)
+        candidate.render_analysis_html()
+        db.session.commit()
+        
+        with self.lock:
+            self.processing_status[candidate.id] = 'completed'
+        
+        return True
+    
+    def skip_known_failures(self, candidate_ids):
+        """
+        Cache negativo: candidatos cujo arquivo já falhou na extração são marcados como falha
+        com o motivo registrado, sem ocupar um worker nem extrair o texto novamente
+        Retorna (IDs que seguem para o processamento, quantidade ignorada)
+        """
+        candidates = Candidate.query.filter(Candidate.id.in_(candidate_ids)).all()
+        
+        skipped_ids = set()
+        for candidate in candidates:
+            result = get_known_failure(candidate.file_path)
+            if not result:
+                continue
+            candidate.analysis_status = 'failed'
+            candidate.ai_score = 0.0
+            candidate.ai_summary = result['summary']
+            candidate.ai_analysis = result['analysis']
+            self.schedule_retry(candidate, result['error_class'])
+            skipped_ids.add(candidate.id)
+        
+        if skipped_ids:
+            db.session.commit()
+            with self.lock:
+                for cid in skipped_ids:
+                    self.processing_status[cid] = 'failed'
+            print(f"🚫 {len(skipped_ids)} candidatos ignorados: arquivo com falha conhecida (reprocesse forçando nova tentativa)")
+        
+        return [cid for cid in candidate_ids if cid not in skipped_ids], len(skipped_ids)
+    
+    def score_tiered_candidates(self, candidate_ids):
+        """
+        Processamento em camadas com prompts em lote: pontua de uma vez os candidatos
+        das vagas em camadas (vários currículos por requisição)
+        Falhas do lote são salvas com a classe do erro (nova tentativa ou dead-letter) em vez de
+        repetirem a chamada à IA no processamento individual
+        Retorna (IDs que seguem para o processamento individual, quantidade pontuada, quantidade com falha)
+        """
+        candidates = Candidate.query.filter(Candidate.id.in_(candidate_ids)).all()
+        
+        candidates_by_job = {}
+        for candidate in candidates:
+            if candidate.job and candidate.job.tiered_processing:
+                candidates_by_job.setdefault(candidate.job_id, []).append(candidate)
+        
+        scored_ids = set()
+        handled_ids = set()
+        for job_candidates in candidates_by_job.values():
+            job = job_candidates[0].job
+            
+            for candidate in job_candidates:
+                candidate.analysis_status = 'processing'
+            db.session.commit()
+            with self.lock:
+                for candidate in job_candidates:
+                    self.processing_status[candidate.id] = 'processing'
+            
+            try:
+                with llm_call_context(job_id=job.id):
+                    results = score_resumes_batch([(c.file_path, c.file_type) for c in job_candidates], job)
+            except Exception as e:
+                logger.error(f"Error in batched scoring for job {job.id}: {str(e)}", exc_info=True)
+                continue
+            
+            for candidate, result in zip(job_candidates, results):
+                if self.save_analysis_result(candidate, result, tiered=True):
+                    scored_ids.add(candidate.id)
+                handled_ids.add(candidate.id)
+            
+            print(f"⚡ Score em lote da vaga '{job.title}': {len(scored_ids & {c.id for c in job_candidates})}/{len(job_candidates)} candidatos pontuados")
+        
+        # Só os candidatos de vagas sem camadas (ou de um lote que falhou por inteiro) seguem o fluxo individual
+        return [cid for cid in candidate_ids if cid not in handled_ids], len(scored_ids), len(handled_ids - scored_ids)
+    
+    def prescreen_candidates(self, candidate_ids):
+        """
+        Triagem local antes da IA: para vagas com limite mínimo ou top-K configurado,
+        marca os candidatos com baixa aderência como 'screened_out' e retorna apenas
+        os IDs que seguem para a análise com IA (na ordem original)
+        """
+        from services.prescreen_service import prescore_batch, select_for_analysis, SCREENED_OUT_SUMMARY
+        
+        candidates = Candidate.query.filter(Candidate.id.in_(candidate_ids)).all()
+        
+        # Agrupa por vaga - cada vaga tem seus próprios requisitos e regras
+        candidates_by_job = {}
+        for candidate in candidates:
+            candidates_by_job.setdefault(candidate.job_id, []).append(candidate)
+        
+        screened_out_ids = set()
+        for job_candidates in candidates_by_job.values():
+            job = job_candidates[0].job
+            if not job or not job.has_prescreen_rules():
+                continue
+            
+            # Currículos sem texto extraível seguem o fluxo normal (que registra a falha)
+            # O texto fica em memória pelo hash do arquivo: a análise logo depois não extrai de novo
+            scored_candidates = []
+            resume_texts = []
+            for candidate in job_candidates:
+                try:
+                    resume_texts.append(extract_resume_text(candidate.file_path, candidate.file_type,
+                                                            get_file_hash(candidate.file_path)))
+                    scored_candidates.append(candidate)
+                except Exception as e:
+                    logger.warning(f"Prescreen: could not extract text for candidate {candidate.id}: {str(e)}")
+            
+            scores = prescore_batch(job.requirements, resume_texts)
+            selected = select_for_analysis(scores, job.prescreen_threshold, job.prescreen_top_k)
+            
+            for index, candidate in enumerate(scored_candidates):
+                candidate.prescreen_score = scores[index]
+                if index not in selected:
+                    candidate.analysis_status = 'screened_out'
+                    candidate.ai_summary = f'{SCREENED_OUT_SUMMARY} (aderência {scores[index]:.1f}/10)'
+                    candidate.ai_analysis = None
+                    candidate.ai_score = None
+                    screened_out_ids.add(candidate.id)
+            
+            print(f"🔎 Triagem local da vaga '{job.title}': {len(selected)}/{len(scored_candidates)} candidatos seguem para a IA")
+        
+        db.session.commit()
+        
+        with self.lock:
+            for cid in screened_out_ids:
+                self.processing_status[cid] = 'screened_out'
+        
+        return [cid for cid in candidate_ids if cid not in screened_out_ids]
+    
+    def refresh_job_digests(self, candidate_ids):
+        """Gera o digest das vagas em processamento que ainda não têm um digest atualizado"""
+        from models.models import Job
+        
+        try:
+            job_ids = {job_id for (job_id,) in db.session.query(Candidate.job_id).filter(Candidate.id.in_(candidate_ids)).distinct()}
+            updated = [job for job in Job.query.filter(Job.id.in_(job_ids)).all() if job.ensure_digest()]
+            if updated:
+                db.session.commit()
+                print(f"🧾 Digest gerado para {len(updated)} vaga(s)")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error refreshing job digests: {str(e)}", exc_info=True)
+    
+    def queue_top_reports(self, candidate_ids):
+        """Solicita os relatórios completos dos N maiores scores de cada vaga em processamento em camadas"""
+        from models.models import Job
+        from processors.report_processor import request_top_reports
+        
+        try:
+            job_ids = {job_id for (job_id,) in db.session.query(Candidate.job_id).filter(Candidate.id.in_(candidate_ids)).distinct()}
+            for job in Job.query.filter(Job.id.in_(job_ids)).all():
+                request_top_reports(job)
+        except Exception as e:
+            logger.error(f"Error queueing top-N reports: {str(e)}", exc_info=True)
+    
+    def try_start_processing(self):
+        """Marca o processador como ocupado; False quando já há um processamento em andamento"""
+        with self.lock:
+            if self.is_processing:
+                return False
+            self.is_processing = True
+            return True
+    
+    def process_candidates_optimized(self, candidate_ids, skip_prescreen=False, started=False):
         """
         Process candidates in optimized batches to maintain server responsiveness
+        started=True quando quem chama já reservou o processador com try_start_processing
         """
         print(f"🔍 INICIANDO process_candidates_optimized com {len(candidate_ids) if candidate_ids else 0} candidatos")
         logger.info(f"Starting process_candidates_optimized with {len(candidate_ids) if candidate_ids else 0} candidates")
         
         if not candidate_ids:
             print("❌ Nenhum candidato para processar")
+            if started:
+                self.is_processing = False
             return {'success': 0, 'failed': 0, 'total': 0}
         
-        if self.is_processing:
+        if not started and not self.try_start_processing():
             print("⚠️ Processamento já em andamento, aguardando...")
             return {'success': 0, 'failed': 0, 'total': 0, 'message': 'Processamento já em andamento'}
         
-        self.is_processing = True
         print(f"✅ Flag is_processing definida como True")
         
         try:
@@ -190,6 +423,25 @@ class OptimizedProcessor:
             success_count = 0
             failed_count = 0
             start_time = time.time()
+            total_candidates = len(candidate_ids)
+            requested_ids = list(candidate_ids)
+            
+            # Digest da vaga: gerado uma vez (vagas antigas ou com texto alterado) e reutilizado em todos os prompts
+            self.refresh_job_digests(candidate_ids)
+            
+            # Arquivos que já falharam na extração não são processados de novo
+            candidate_ids, known_failure_count = self.skip_known_failures(candidate_ids)
+            failed_count += known_failure_count
+            
+            # Triagem local: somente candidatos promissores seguem para a IA
+            if not skip_prescreen:
+                candidate_ids = self.prescreen_candidates(candidate_ids)
+            screened_out_count = total_candidates - known_failure_count - len(candidate_ids)
+            
+            # Vagas em camadas: score em lote (vários currículos por requisição)
+            candidate_ids, batch_scored_count, batch_failed_count = self.score_tiered_candidates(candidate_ids)
+            success_count += batch_scored_count
+            failed_count += batch_failed_count
             
             # Process in batches to avoid server overload
             for i in range(0, len(candidate_ids), self.batch_size):
@@ -225,15 +477,19 @@ class OptimizedProcessor:
                     print(f"⏳ Aguardando {self.delay_between_batches}s antes do próximo lote...")
                     time.sleep(self.delay_between_batches)
             
+            # Processamento em camadas: relatórios completos em segundo plano para os maiores scores
+            self.queue_top_reports(requested_ids)
+            
             end_time = time.time()
             duration = end_time - start_time
             
-            print(f"🎉 PROCESSAMENTO CONCLUÍDO em {duration:.1f}s: {success_count} sucessos, {failed_count} falhas")
+            print(f"🎉 PROCESSAMENTO CONCLUÍDO em {duration:.1f}s: {success_count} sucessos, {failed_count} falhas, {screened_out_count} triados localmente")
             
             return {
                 'success': success_count,
                 'failed': failed_count,
-                'total': len(candidate_ids),
+                'screened_out': screened_out_count,
+                'total': total_candidates,
                 'duration': duration
             }
             
@@ -250,6 +506,7 @@ class OptimizedProcessor:
                 'processing': 0,
                 'completed': 0,
                 'failed': 0,
+                'screened_out': 0,
                 'deleted': 0
             }
             
@@ -262,9 +519,11 @@ class OptimizedProcessor:
 # Global processor instance - optimized for server responsiveness
 optimized_processor = OptimizedProcessor(max_workers=2, batch_size=3, delay_between_batches=3)
 
-def start_optimized_analysis(candidate_ids):
+def start_optimized_analysis(candidate_ids, skip_prescreen=False, started=False):
     """
     Start optimized analysis in background thread
+    skip_prescreen=True envia todos os candidatos para a IA (ex: reprocessamento manual)
+    started=True: o processador já foi reservado com try_start_processing (ver retry_scheduler)
     """
     def optimized_worker():
         try:
@@ -277,7 +536,8 @@ def start_optimized_analysis(candidate_ids):
                 print(f"✅ App context ativo na thread")
                 logger.info(f"App context active in thread")
                 
-                result = optimized_processor.process_candidates_optimized(candidate_ids)
+                result = optimized_processor.process_candidates_optimized(candidate_ids, skip_prescreen=skip_prescreen,
+                                                                          started=started)
                 print(f"✅ Worker otimizado concluído: {result}")
                 logger.info(f"Optimized worker completed: {result}")
                 
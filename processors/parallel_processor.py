@@ -68,6 +68,7 @@ class ParallelAIProcessor:
                     candidate.extracted_skills = result.get('skills', '[]')
                     candidate.analysis_status = 'completed'
                     candidate.analyzed_at = datetime.utcnow()
+                    candidate.render_analysis_html()
                     
                     # Auto-reject low scores
                     if candidate.ai_score < 5.0:
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Refresh Processor - atualização em segundo plano das análises vencidas (stale-while-revalidate)
+Quando o cache devolve uma análise que passou do TTL da vaga, o candidato recebe o resultado
+na hora e fica marcado como 'atualizando'; a nova análise é gerada aqui e substitui a antiga
+"""
+import threading
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import pytz
+
+from app import app, db
+from models.models import Candidate
+from services.ai_service import analyze_resume, score_resume
+from services.llm_client import llm_call_context
+
+logger = logging.getLogger(__name__)
+
+class RefreshProcessor:
+    """
+    Gera novamente as análises vencidas, sem duplicar pedidos para o mesmo candidato
+    """
+    def __init__(self, max_workers=1):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='refresh')
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def request_refresh(self, candidate_id):
+        """
+        Coloca a atualização do candidato na fila
+        Retorna False se a atualização já estiver na fila neste processo
+        """
+        with self.lock:
+            if candidate_id in self.in_flight:
+                return False
+            self.in_flight.add(candidate_id)
+
+        self.executor.submit(self.refresh_analysis, candidate_id)
+        return True
+
+    def refresh_analysis(self, candidate_id):
+        """Gera a nova análise e substitui a vencida; em caso de falha a análise vencida é mantida"""
+        try:
+            with app.app_context():
+                candidate = db.session.get(Candidate, candidate_id)
+                if not candidate or not candidate.analysis_refreshing:
+                    return False
+
+                print(f"♻️ Atualizando análise vencida de {candidate.name} (ID: {candidate_id})")
+                # Candidatos em camadas sem relatório completo atualizam apenas o score
+                score_only = candidate.report_status in ('pending', 'failed')
+                with llm_call_context(job_id=candidate.job_id, candidate_id=candidate_id):
+                    if score_only:
+                        result = score_resume(candidate.file_path, candidate.file_type, candidate.job, refresh=True)
+                    else:
+                        result = analyze_resume(candidate.file_path, candidate.file_type, candidate.job, refresh=True)
+
+                refreshed = bool(result) and not result.get('error_class') and (result.get('score') or 0) > 0
+                if refreshed:
+                    candidate.ai_score = result['score']
+                    if not result.get('report_pending'):
+                        candidate.ai_summary = result.get('summary')
+                        candidate.ai_analysis = result.get('analysis')
+                    candidate.extracted_skills = result.get('skills', '[]')
+                    candidate.analyzed_at = datetime.now(pytz.timezone('America/Sao_Paulo'))
+                    # Pré-renderiza o HTML exibido na página do candidato
+                    candidate.render_analysis_html()
+                    print(f"✅ Análise atualizada para {candidate.name}. Score: {result['score']}")
+                else:
+                    print(f"⚠️ Atualização falhou para {candidate.name}, mantendo a análise anterior")
+
+                candidate.analysis_refreshing = False
+                db.session.commit()
+                return refreshed
+
+        except Exception as e:
+            logger.error(f"Error refreshing analysis for candidate {candidate_id}: {str(e)}", exc_info=True)
+            try:
+                with app.app_context():
+                    candidate = db.session.get(Candidate, candidate_id)
+                    if candidate:
+                        candidate.analysis_refreshing = False
+                        db.session.commit()
+            except Exception as db_error:
+                logger.error(f"Error clearing refresh flag for candidate {candidate_id}: {str(db_error)}")
+            return False
+
+        finally:
+            with self.lock:
+                self.in_flight.discard(candidate_id)
+
+# Global refresh processor instance
+refresh_processor = RefreshProcessor(max_workers=1)
+
+def mark_stale_result(candidate, result):
+    """
+    Marca o candidato como 'atualizando' quando o resultado veio vencido do cache
+    Remove a marcação do resultado; retorna True quando uma atualização deve ser pedida
+    """
+    candidate.analysis_refreshing = bool(result and result.pop('cache_stale', False))
+    return candidate.analysis_refreshing
+
+def request_analysis_refresh(candidate_id):
+    """
+    Request the background refresh of a stale cached analysis
+    """
+    return refresh_processor.request_refresh(candidate_id)
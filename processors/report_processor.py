@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Report Processor - relatório completo sob demanda (processamento em camadas)
+Vagas com processamento em camadas recebem apenas o score no processamento em lote;
+o relatório completo é gerado quando o recrutador abre o candidato ou, em segundo plano,
+para os N maiores scores da vaga
+"""
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db
+from models.models import Candidate
+from services.ai_service import generate_full_report
+from services.llm_client import llm_call_context
+
+logger = logging.getLogger(__name__)
+
+class ReportProcessor:
+    """
+    Gera relatórios completos em segundo plano, sem duplicar pedidos para o mesmo candidato
+    """
+    def __init__(self, max_workers=2):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self.in_flight = set()
+        self.lock = threading.Lock()
+
+    def request_report(self, candidate_id):
+        """
+        Coloca o relatório do candidato na fila
+        Retorna False se o relatório já estiver sendo gerado neste processo
+        """
+        with self.lock:
+            if candidate_id in self.in_flight:
+                return False
+            self.in_flight.add(candidate_id)
+
+        self.executor.submit(self.generate_report, candidate_id)
+        return True
+
+    def generate_report(self, candidate_id):
+        """Gera e salva o relatório completo de um candidato já pontuado"""
+        try:
+            with app.app_context():
+                candidate = db.session.get(Candidate, candidate_id)
+                if not candidate or candidate.report_status not in ('pending', 'generating', 'failed'):
+                    return False
+
+                candidate.report_status = 'generating'
+                db.session.commit()
+
+                print(f"📝 Gerando relatório completo para {candidate.name} (ID: {candidate_id})")
+                with llm_call_context(job_id=candidate.job_id, candidate_id=candidate_id):
+                    result = generate_full_report(candidate.file_path, candidate.file_type, candidate.job, candidate.ai_score)
+
+                if not result:
+                    candidate.report_status = 'failed'
+                    db.session.commit()
+                    print(f"⚠️ Relatório completo não gerado para {candidate.name}")
+                    return False
+
+                candidate.ai_summary = result.get('summary')
+                candidate.ai_analysis = result.get('analysis')
+                candidate.report_status = 'completed'
+                # Pré-renderiza o HTML exibido na página do candidato
+                candidate.render_analysis_html()
+                db.session.commit()
+
+                print(f"✅ Relatório completo salvo para {candidate.name}")
+                return True
+
+        except Exception as e:
+            logger.error(f"Error generating full report for candidate {candidate_id}: {str(e)}", exc_info=True)
+            try:
+                with app.app_context():
+                    candidate = db.session.get(Candidate, candidate_id)
+                    if candidate:
+                        candidate.report_status = 'failed'
+                        db.session.commit()
+            except Exception as db_error:
+                logger.error(f"Error saving report failure for candidate {candidate_id}: {str(db_error)}")
+            return False
+
+        finally:
+            with self.lock:
+                self.in_flight.discard(candidate_id)
+
+    def request_top_reports(self, job):
+        """Coloca na fila os relatórios dos N maiores scores da vaga que ainda não têm relatório"""
+        if not job.tiered_processing or not job.report_top_n:
+            return 0
+
+        top_candidates = Candidate.query.filter(
+            Candidate.job_id == job.id,
+            Candidate.analysis_status == 'completed',
+            Candidate.ai_score.isnot(None)
+        ).order_by(Candidate.ai_score.desc()).limit(job.report_top_n).all()
+
+        requested = 0
+        for candidate in top_candidates:
+            if candidate.report_status == 'pending' and self.request_report(candidate.id):
+                requested += 1
+
+        if requested:
+            print(f"📝 {requested} relatórios completos na fila para os maiores scores da vaga '{job.title}'")
+
+        return requested
+
+# Global report processor instance
+report_processor = ReportProcessor(max_workers=2)
+
+def request_full_report(candidate_id):
+    """
+    Request the full report for a candidate scored in tiered mode
+    """
+    return report_processor.request_report(candidate_id)
+
+def request_top_reports(job):
+    """
+    Request the full reports for the top-N candidates of a job
+    """
+    return report_processor.request_top_reports(job)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Retry Scheduler - executa as novas tentativas agendadas por services/retry_service.py
+Uma thread em segundo plano verifica periodicamente os candidatos com nova tentativa vencida
+e os envia ao processador otimizado quando ele está livre
+"""
+import threading
+import time
+import logging
+from datetime import datetime
+
+from app import app, db
+from models.models import Candidate
+
+logger = logging.getLogger(__name__)
+
+class RetryScheduler:
+    """
+    Despacha as novas tentativas vencidas sem competir com o processamento em andamento
+    """
+    def __init__(self, check_interval=30, max_per_tick=10):
+        self.check_interval = check_interval
+        self.max_per_tick = max_per_tick
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """Inicia a thread do agendador (uma vez por processo)"""
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return False
+            self.thread = threading.Thread(target=self._run, name='retry-scheduler', daemon=True)
+            self.thread.start()
+        print(f"🔁 Agendador de novas tentativas iniciado (a cada {self.check_interval}s)")
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                with app.app_context():
+                    self.dispatch_due_retries()
+            except Exception as e:
+                logger.error(f"Error dispatching scheduled retries: {str(e)}", exc_info=True)
+
+    def claim_due_retries(self):
+        """
+        Seleciona as tentativas vencidas e as marca como pendentes
+        O UPDATE condicional garante que cada candidato seja despachado por um único worker
+        """
+        now = datetime.utcnow()
+        due_candidates = Candidate.query.filter(
+            Candidate.analysis_status == 'failed',
+            Candidate.retry_state == 'scheduled',
+            Candidate.next_retry_at <= now
+        ).order_by(Candidate.next_retry_at).limit(self.max_per_tick).all()
+
+        claimed_ids = []
+        for candidate in due_candidates:
+            claimed = Candidate.query.filter(
+                Candidate.id == candidate.id,
+                Candidate.analysis_status == 'failed',
+                Candidate.retry_state == 'scheduled'
+            ).update({'analysis_status': 'pending', 'retry_state': None, 'next_retry_at': None}, synchronize_session=False)
+            if claimed:
+                claimed_ids.append(candidate.id)
+        db.session.commit()
+
+        return claimed_ids
+
+    def release_claimed_retries(self, candidate_ids):
+        """Devolve à fila de novas tentativas (vencidas agora) candidatos reservados mas não processados"""
+        if not candidate_ids:
+            return
+        Candidate.query.filter(
+            Candidate.id.in_(candidate_ids),
+            Candidate.analysis_status == 'pending'
+        ).update({'analysis_status': 'failed', 'retry_state': 'scheduled', 'next_retry_at': datetime.utcnow()},
+                 synchronize_session=False)
+        db.session.commit()
+
+    def dispatch_due_retries(self):
+        """
+        Envia as novas tentativas vencidas ao processador otimizado
+        O processador é reservado antes de reservar os candidatos: um processamento iniciado
+        entre as duas etapas não faz os candidatos reservados saírem da fila
+        """
+        from processors.optimized_processor import optimized_processor, start_optimized_analysis
+
+        # O processador ignora novos pedidos enquanto processa; tenta no próximo ciclo
+        if not optimized_processor.try_start_processing():
+            return []
+
+        try:
+            candidate_ids = self.claim_due_retries()
+        except Exception:
+            optimized_processor.is_processing = False
+            raise
+
+        if not candidate_ids:
+            optimized_processor.is_processing = False
+            return []
+
+        print(f"🔁 Executando {len(candidate_ids)} novas tentativas agendadas: {candidate_ids}")
+        if not start_optimized_analysis(candidate_ids, skip_prescreen=True, started=True):
+            optimized_processor.is_processing = False
+            self.release_claimed_retries(candidate_ids)
+            return []
+
+        return candidate_ids
+
+# Global retry scheduler instance
+retry_scheduler = RetryScheduler(check_interval=30, max_per_tick=10)
+
+def start_retry_scheduler():
+    """
+    Start the background thread that runs scheduled retries
+    """
+    return retry_scheduler.start()
@@ -49,6 +49,7 @@ def process_candidate_simple(candidate_id):
                 candidate.extracted_skills = result.get('skills', '[]')
                 candidate.analysis_status = 'completed'
                 candidate.analyzed_at = datetime.utcnow()
+                candidate.render_analysis_html()
                 db.session.commit()
                 
                 logger.info(f"✅ Completed: {candidate.name} - Score: {result.get('score', 0)}")
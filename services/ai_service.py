@@ -1,35 +1,35 @@
 import json
-import os
 import logging
 import time
 import hashlib
 from services.file_processor import extract_text_from_file
-from services.cache_service import analysis_cache
+from services.cache_service import (analysis_cache, cache_namespace, file_content_hash, resume_content_hash,
+                                    LocalLRUCache)
+from services.resume_profile_service import get_scoring_text
+from services.singleflight_service import analysis_singleflight
+from services.llm_client import (get_openai_client, chat_completion, stream_chat_completion, llm_call_context,
+                                 LLM_CALL_TIME_BUDGET, LLM_MIN_ATTEMPT_SECONDS)
+from services.retry_service import classify_error
 
-# the newest OpenAI model is "gpt-4o" which was released May 13, 2024.
-# do not change this unless explicitly requested by the user
-from openai import OpenAI
-
-def get_openai_client():
-    """Get OpenAI client with proper API key loading"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    deepseek_api_key = os.environ.get("DEEPSEEK_API_KEY")
-    if not deepseek_api_key:
-        deepseek_api_key = os.environ.get("OPENAI_API_KEY")
-    
-    if not deepseek_api_key:
-        raise ValueError("DEEPSEEK_API_KEY ou OPENAI_API_KEY não encontrada")
+def format_job_for_prompt(job, description_chars, requirements_chars):
+    """
+    Job block used in the candidate prompts
+    Uses the canonical digest saved on the job (see services/job_digest_service.py) and falls
+    back to the truncated description/requirements when the digest is missing or outdated
+    """
+    if job.is_digest_current():
+        return f"REQUISITOS DA VAGA (resumo canônico da descrição e dos requisitos):\n{job.requirements_digest}"
     
-    return OpenAI(
-        api_key=deepseek_api_key,
-        base_url="https://api.deepseek.com/v1"
+    return (
+        f"DESCRIÇÃO: {job.description[:description_chars] if job.description else 'Não especificado'}\n"
+        f"REQUISITOS: {job.requirements[:requirements_chars] if job.requirements else 'Não especificado'}"
     )
 
 def generate_score_only(cv_text, job):
     """
     Generate only the score for faster processing as a professional recruiter
+    API errors propagate (the caller classifies them for the retry policy); returns None
+    when the response has no score, never a default score
     """
     prompt = f"""
 Você é um recrutador sênior especializado em avaliação de candidatos.
@@ -37,8 +37,7 @@ Você é um recrutador sênior especializado em avaliação de candidatos.
 Avalie o currículo abaixo para a vaga '{job.title}' e atribua uma nota de 0 a 10.
 
 VAGA: {job.title}
-DESCRIÇÃO: {job.description[:300] if job.description else 'Não especificado'}
-REQUISITOS: {job.requirements[:500] if job.requirements else 'Não especificado'}
+{format_job_for_prompt(job, 300, 500)}
 
 CRITÉRIOS DE AVALIAÇÃO:
 1. Experiência relevante na área (peso 4)
@@ -59,30 +58,20 @@ INSTRUÇÕES:
 Nota: [sua avaliação]
 """
     
-    try:
-        openai = get_openai_client()
-        response = openai.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=50,  # Increased slightly for better responses
-            temperature=0.1,  # Lower temperature for faster, more consistent responses
-            timeout=45  # 45 second timeout
-        )
-    except Exception as api_error:
-        logging.error(f"Score API call failed: {api_error}")
-        # Return a default score instead of failing
-        return 5.0
+    response = chat_completion(
+        'score',
+        job=job,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.1  # Lower temperature for faster, more consistent responses
+    )
     
-    result = response.choices[0].message.content
+    result = response.choices[0].message.content or ''
     # Extract score using regex - more precise
     import re
     match = re.search(r"(\d{1,2}(?:\.\d{1,2})?)", result)
     if match:
-        raw_score = float(match.group(1))
-        # Ensure score is between 0 and 10 with proper scaling
-        if raw_score > 10:
-            raw_score = raw_score / 10  # Handle cases like 85/100
-        return round(min(max(raw_score, 0), 10), 2)
+        # Ensure score is between 0 and 10 with proper scaling (handles cases like 85/100)
+        return normalize_score(match.group(1))
     
     # If no score found, try to extract from different patterns
     if "excelente" in result.lower() or "muito bom" in result.lower():
@@ -94,20 +83,184 @@ Nota: [sua avaliação]
     elif "fraco" in result.lower() or "inadequado" in result.lower():
         return 3.0
     
-    return 5.0
+    logging.warning(f"No score found in the score response: {result[:100]}")
+    return None
 
-def generate_summary_and_analysis(cv_text, job):
+# Batched scoring: K resume digests for the same job in a single request
+SCORE_BATCH_MAX_SIZE = 8
+SCORE_BATCH_TOKEN_BUDGET = 6000  # Input tokens per request (job preamble + digests)
+SCORE_DIGEST_CHARS = 1500  # Resume characters sent per candidate in batched mode
+
+def estimate_tokens(text):
+    """Rough token estimate for Portuguese text (about 3 characters per token)"""
+    return len(text or '') // 3 + 1
+
+def build_score_preamble(job):
+    """Job block shared by every resume in a batched scoring request"""
+    return f"""
+Você é um recrutador sênior especializado em avaliação de candidatos.
+
+Avalie cada um dos currículos abaixo para a vaga '{job.title}' e atribua a cada um uma nota de 0 a 10.
+
+VAGA: {job.title}
+{format_job_for_prompt(job, 300, 500)}
+
+CRITÉRIOS DE AVALIAÇÃO:
+1. Experiência relevante na área (peso 4)
+2. Habilidades técnicas que atendem aos requisitos (peso 3)
+3. Formação acadêmica adequada (peso 2)
+4. Qualidade e clareza do currículo (peso 1)
+
+INSTRUÇÕES:
+- Avalie cada currículo de forma independente, sem compará-los entre si
+- Atribua notas de 0 a 10 com até duas casas decimais
+- Responda APENAS com JSON no formato {{"notas": [{{"id": 1, "nota": 7.91}}, {{"id": 2, "nota": 6.25}}]}}
+- Inclua uma nota para cada id, sem comentários
+"""
+
+def plan_score_batches(digests, preamble_tokens):
     """
-    Generate detailed summary and analysis in structured format as a professional recruiter
+    Split the resume digests into batches that fit the token budget
+    Returns a list of lists of indices (K adapts to the size of each digest)
     """
-    prompt = f"""
+    batches = []
+    current = []
+    current_tokens = preamble_tokens
+    
+    for index, digest in enumerate(digests):
+        digest_tokens = estimate_tokens(digest) + 10  # Separator and id of each resume
+        if current and (len(current) >= SCORE_BATCH_MAX_SIZE or current_tokens + digest_tokens > SCORE_BATCH_TOKEN_BUDGET):
+            batches.append(current)
+            current = []
+            current_tokens = preamble_tokens
+        current.append(index)
+        current_tokens += digest_tokens
+    
+    if current:
+        batches.append(current)
+    
+    return batches
+
+def normalize_score(raw_score):
+    """Scale scores like 85/100 down and clamp to the 0-10 range"""
+    raw_score = float(raw_score)
+    if raw_score > 10:
+        raw_score = raw_score / 10
+    return round(min(max(raw_score, 0), 10), 2)
+
+def parse_batch_scores(result, expected_count):
+    """
+    Parse the structured batched scoring response
+    Returns a dict {position: score} (positions start at 1); missing entries are left out
+    """
+    import re
+    scores = {}
+    
+    match = re.search(r"\{.*\}", result or '', re.DOTALL)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            for item in data.get('notas', []):
+                position = int(item.get('id'))
+                if 1 <= position <= expected_count and item.get('nota') is not None:
+                    scores[position] = normalize_score(item['nota'])
+            return scores
+        except (ValueError, TypeError, AttributeError):
+            pass
+    
+    # Fallback: lines like "1: 7.5" or "id 2 - nota 6"
+    for position, raw_score in re.findall(r"(?:id\s*)?(\d{1,2})\s*[:\-=]\s*(?:nota\s*)?(\d{1,3}(?:[.,]\d{1,2})?)", result or '', re.IGNORECASE):
+        position = int(position)
+        if 1 <= position <= expected_count and position not in scores:
+            scores[position] = normalize_score(raw_score.replace(',', '.'))
+    
+    return scores
+
+def score_or_error(cv_text, job, errors, index):
+    """generate_score_only for one resume; on failure returns None and records the error class in errors"""
+    try:
+        score = generate_score_only(cv_text, job)
+    except Exception as api_error:
+        logging.error(f"Score API call failed: {api_error}")
+        errors[index] = classify_error(api_error)
+        return None
+    if score is None:
+        errors[index] = 'incomplete'
+    return score
+
+def generate_batch_scores(cv_texts, job, errors=None):
+    """
+    Score several resumes for the same job with as few requests as possible
+    Resumes whose score cannot be parsed from the batched response fall back to generate_score_only
+    An API error is not retried resume by resume: that batch and the remaining ones are tagged with
+    its class (rate limits would only get worse) and left to the retry policy
+    Returns a list of scores in the same order as cv_texts; failed resumes get None and,
+    when errors (dict) is given, errors[index] gets the error class
+    """
+    errors = {} if errors is None else errors
+    preamble = build_score_preamble(job)
+    digests = [(text or '')[:SCORE_DIGEST_CHARS] for text in cv_texts]
+    scores = [None] * len(cv_texts)
+    
+    api_error_class = None
+    
+    def score_single(index):
+        nonlocal api_error_class
+        if api_error_class:
+            errors[index] = api_error_class
+            return None
+        score = score_or_error(cv_texts[index], job, errors, index)
+        if errors.get(index, 'incomplete') != 'incomplete':
+            api_error_class = errors[index]
+        return score
+    
+    for batch in plan_score_batches(digests, estimate_tokens(preamble)):
+        if len(batch) == 1 or api_error_class:
+            for index in batch:
+                scores[index] = score_single(index)
+            continue
+        
+        resumes_block = "\n".join(
+            f"=== CURRÍCULO id {position} ===\n{digests[index]}\n"
+            for position, index in enumerate(batch, start=1)
+        )
+        prompt = f"{preamble}\nCURRÍCULOS:\n{resumes_block}\nJSON:"
+        
+        try:
+            response = chat_completion(
+                'score_batch',
+                job=job,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=30 + 20 * len(batch),
+                temperature=0.1
+            )
+        except Exception as api_error:
+            logging.error(f"Batched score API call failed ({len(batch)} resumes): {api_error}")
+            api_error_class = classify_error(api_error)
+            for index in batch:
+                errors[index] = api_error_class
+            continue
+        
+        parsed = parse_batch_scores(response.choices[0].message.content, len(batch))
+        if len(parsed) < len(batch):
+            logging.warning(f"Batched scoring parsed {len(parsed)}/{len(batch)} scores, falling back to single scoring")
+        
+        for position, index in enumerate(batch, start=1):
+            scores[index] = parsed[position] if position in parsed else score_single(index)
+    
+    return scores
+
+def build_analysis_prompt(cv_text, job):
+    """
+    Full report prompt (shared by the regular and the streaming analysis)
+    """
+    return f"""
 Você é um recrutador sênior especializado em análise de currículos. 
 
 ANALISE APENAS O CURRÍCULO REAL FORNECIDO ABAIXO. NÃO INVENTE INFORMAÇÕES.
 
 VAGA: {job.title}
-DESCRIÇÃO: {job.description[:500] if job.description else 'Não especificado'}
-REQUISITOS: {job.requirements[:1000] if job.requirements else 'Não especificado'}
+{format_job_for_prompt(job, 500, 1000)}
 
 CURRÍCULO REAL DO CANDIDATO:
 {cv_text[:4000]}
@@ -201,119 +354,409 @@ IMPORTANTE:
 - Evite frases genéricas, seja específico sobre o candidato real
 - Se o currículo não contiver informações suficientes, indique claramente
 """
-    
-    try:
-        openai = get_openai_client()
-        response = openai.chat.completions.create(
-            model="deepseek-chat",
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=1500,  # Increased for complete analysis
-            temperature=0.2,  # Lower temperature for more consistent responses
-            timeout=90  # 90 second timeout for better reliability
-        )
-    except Exception as api_error:
-        logging.error(f"Analysis API call failed: {api_error}")
-        # Return a basic analysis instead of failing completely
-        return f"""
-RESUMO DO CURRÍCULO
 
-📋 **INFORMAÇÕES PESSOAIS**
-Nome Completo: {extracted_name or '[Nome não identificado]'}
+def generate_summary_and_analysis(cv_text, job):
+    """
+    Generate detailed summary and analysis in structured format as a professional recruiter
+    API errors propagate; a response too short to be a report returns '' (incomplete analysis)
+    """
+    prompt = build_analysis_prompt(cv_text, job)
+    
+    response = chat_completion(
+        'analysis',
+        job=job,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.2  # Lower temperature for more consistent responses
+    )
+    
+    result = response.choices[0].message.content
+    
+    # Report cut by max_tokens: fetch only the missing sections instead of regenerating
+    if result and response.choices[0].finish_reason == 'length':
+        result = continue_truncated_report(prompt, result, job)
+    
+    # Validate that we got a meaningful response
+    if not result or len(result.strip()) < 100:
+        logging.warning(f"API returned very short response: {len(result or '')} characters")
+        return ''
+    
+    return result
 
-📞 **INFORMAÇÕES DE CONTATO**
-Email: {extracted_email or '[Email não disponível]'}
-Telefone: {extracted_phone or '[Telefone não disponível]'}
-{f'Endereço: {extracted_address}' if extracted_address else ''}
-{f'Data de Nascimento: {extracted_birth_date}' if extracted_birth_date else ''}
+# Section headers of the full report, in order (see the prompt in generate_summary_and_analysis)
+REPORT_SECTIONS = [
+    "INFORMAÇÕES PESSOAIS",
+    "INFORMAÇÕES DE CONTATO",
+    "EXPERIÊNCIA PROFISSIONAL",
+    "HABILIDADES TÉCNICAS",
+    "FORMAÇÃO ACADÊMICA",
+    "IDIOMAS",
+    "ANÁLISE DO RECRUTADOR",
+    "1. ALINHAMENTO TÉCNICO",
+    "2. GAPS IDENTIFICADOS",
+    "3. RECOMENDAÇÃO FINAL",
+]
+REPORT_MAX_CONTINUATIONS = 2
 
-💼 **EXPERIÊNCIA PROFISSIONAL**
-• [Experiência não detalhada no currículo]
+# Tempo total da análise em streaming (relatório, continuação e score), abaixo do --timeout 120 do gunicorn
+STREAM_ANALYSIS_MAX_SECONDS = 100
 
-🔧 **HABILIDADES TÉCNICAS**
-[Habilidades não especificadas]
+def find_missing_sections(report):
+    """
+    Sections still to be written in a truncated report
+    The last section present was cut mid-way, so it is written again
+    Returns (missing sections, position where the kept text ends)
+    """
+    last_index, last_position = None, None
+    for index, section in enumerate(REPORT_SECTIONS):
+        position = report.find(section)
+        if position >= 0:
+            last_index, last_position = index, position
+    
+    if last_index is None:
+        return REPORT_SECTIONS[:], 0
+    
+    # Cut at the start of the header line (keeps emojis and markdown out of the kept text)
+    return REPORT_SECTIONS[last_index:], report.rfind('\n', 0, last_position) + 1
 
-🎓 **FORMAÇÃO ACADÊMICA**
-[Formação não informada]
+def continue_truncated_report(prompt, partial_report, job, deadline=None):
+    """
+    Continue a report cut by max_tokens, asking only for the missing sections
+    The continuation telemetry records the output tokens not regenerated (tokens_saved)
+    deadline (time.time()) bounds the continuations; the report so far is returned when it is reached
+    """
+    report = partial_report
+    
+    for attempt in range(1, REPORT_MAX_CONTINUATIONS + 1):
+        call_options = {}
+        if deadline:
+            remaining = deadline - time.time()
+            if remaining < LLM_MIN_ATTEMPT_SECONDS:
+                logging.warning("No time left to continue the truncated report")
+                return report
+            # Retries inside chat_completion may take up to LLM_CALL_TIME_BUDGET times the timeout
+            call_options['timeout'] = remaining / LLM_CALL_TIME_BUDGET
 
-🌍 **IDIOMAS**
-[Idiomas não informados]
+        missing, kept_until = find_missing_sections(report)
+        kept = report[:kept_until].rstrip()
+        
+        continuation_prompt = (
+            f"A resposta anterior foi interrompida pelo limite de tamanho. Continue o relatório a partir da seção "
+            f"\"{missing[0]}\", no mesmo formato, escrevendo APENAS as seções que faltam: {', '.join(missing)}. "
+            f"Não repita as seções anteriores."
+        )
+        
+        try:
+            with llm_call_context(tokens_saved=estimate_tokens(kept)):
+                response = chat_completion(
+                    'analysis_continuation',
+                    job=job,
+                    messages=[
+                        {"role": "user", "content": prompt},
+                        {"role": "assistant", "content": kept},
+                        {"role": "user", "content": continuation_prompt}
+                    ],
+                    temperature=0.2,
+                    **call_options
+                )
+        except Exception as api_error:
+            logging.error(f"Analysis continuation failed: {api_error}")
+            return report
+        
+        continuation = (response.choices[0].message.content or '').strip()
+        if not continuation:
+            return report
+        
+        report = f"{kept}\n\n{continuation}"
+        print(f"✂️ Relatório cortado em '{missing[0]}': {len(missing)} seções buscadas na continuação {attempt}")
+        
+        if response.choices[0].finish_reason != 'length':
+            break
+    
+    return report
 
-📊 **ANÁLISE DO RECRUTADOR**
+def split_summary_and_analysis(full_analysis):
+    """
+    Separate the executive summary from the recruiter analysis in the full report
+    Returns a tuple (executive_summary, detailed_analysis)
+    """
+    executive_summary = ""
+    detailed_analysis = ""
+    
+    if full_analysis:
+        # Try to separate summary from detailed analysis
+        if "RESUMO DO CURRÍCULO" in full_analysis and "ANÁLISE DO RECRUTADOR" in full_analysis:
+            parts = full_analysis.split("ANÁLISE DO RECRUTADOR")
+            if len(parts) >= 2:
+                # Extract summary (remove the "RESUMO DO CURRÍCULO" header)
+                summary_part = parts[0].replace("RESUMO DO CURRÍCULO", "").strip()
+                if summary_part:
+                    executive_summary = summary_part
+                # Keep only the detailed analysis
+                detailed_analysis = parts[1].strip()
+            else:
+                executive_summary = full_analysis
+                detailed_analysis = ""
+        elif "RESUMO EXECUTIVO" in full_analysis and "ANÁLISE DO RECRUTADOR" in full_analysis:
+            # Handle old format
+            parts = full_analysis.split("ANÁLISE DO RECRUTADOR")
+            if len(parts) >= 2:
+                summary_part = parts[0].replace("RESUMO EXECUTIVO", "").strip()
+                if summary_part:
+                    executive_summary = summary_part
+                detailed_analysis = parts[1].strip()
+            else:
+                executive_summary = full_analysis
+                detailed_analysis = ""
+        else:
+            # If format is not as expected, use the full analysis as summary only
+            executive_summary = full_analysis
+            detailed_analysis = ""
+    
+    # Clean up any remaining separators and analysis content from summary
+    if executive_summary:
+        executive_summary = executive_summary.replace("---", "").strip()
+        # Remove any analysis content that might have leaked into summary
+        analysis_indicators = [
+            "ANÁLISE DO RECRUTADOR", "1. ALINHAMENTO TÉCNICO", "2. GAPS IDENTIFICADOS", 
+            "3. RECOMENDAÇÃO FINAL", "OBSERVAÇÃO FINAL", "Pontos fortes:", "Limitações:", 
+            "Justificativa:", "Lacunas técnicas:", "Conhecimentos em falta:", 
+            "Áreas de desenvolvimento:", "Competências alinhadas:", "Adequação à vaga:", 
+            "Experiência relevante:", "PARCIAL", "ADEQUADO", "INADEQUADO"
+        ]
+        for indicator in analysis_indicators:
+            if indicator in executive_summary:
+                executive_summary = executive_summary.split(indicator)[0].strip()
+    
+    if detailed_analysis:
+        detailed_analysis = detailed_analysis.replace("---", "").strip()
+    
+    return executive_summary, detailed_analysis
 
-🎯 **1. ALINHAMENTO TÉCNICO**
-• Experiência relevante: [Não foi possível analisar devido a erro técnico]
-• Competências alinhadas: [Análise não disponível]
-• Adequação à vaga: [Avaliação não possível]
+def analysis_flight_key(resume_text, job, kind='analysis'):
+    """
+    Single-flight key of the full analysis of a (resume, job) pair
+    Same inputs as the cache key (normalized resume content + job content version + PROMPT_VERSION)
+    """
+    namespace, _, _ = cache_namespace(job, kind)
+    return hashlib.sha256(f"flight:{resume_content_hash(resume_text)}|{namespace}".encode('utf-8')).hexdigest()
 
-⚠️ **2. GAPS IDENTIFICADOS**
-• Lacunas técnicas: [Não foi possível identificar]
-• Conhecimentos em falta: [Análise não disponível]
-• Áreas de desenvolvimento: [Não especificado]
-
-🏆 **3. RECOMENDAÇÃO FINAL: PARCIAL**
-• Pontos fortes: [Não foi possível identificar]
-• Limitações: [Análise técnica não disponível]
-• Justificativa: Erro técnico na análise. Recomenda-se reprocessar o currículo.
-"""
+def _generate_resume_analysis(resume_text, job):
+    """
+    Run the score and full analysis prompts for an extracted resume (cache miss path of analyze_resume)
+    A score API error propagates (analyze_resume classifies it); a report API error is kept in the
+    result's error_class. Only complete results are cached.
+    """
+    # Cache entries are keyed by the full extracted text (same key analyze_resume looks up)
+    full_text = resume_text
     
-    result = response.choices[0].message.content
+    # Check if API key is available
+    try:
+        openai = get_openai_client()
+    except Exception as api_key_error:
+        logging.error(f"DeepSeek API key not found: {api_key_error}")
+        raise Exception("API key not configured")
     
-    # Validate that we got a meaningful response
-    if not result or len(result.strip()) < 100:
-        logging.warning(f"API returned very short response: {len(result)} characters")
-        return f"""
-RESUMO DO CURRÍCULO
-
-📋 **INFORMAÇÕES PESSOAIS**
-Nome Completo: [Nome não identificado]
+    # Score prompt uses the compact job-independent profile when the resume was already seen for another job
+    scoring_text = get_scoring_text(resume_text, job.id)
+    
+    # Limit resume text to avoid token limits (increased for better analysis)
+    if len(resume_text) > 4000:
+        resume_text = resume_text[:4000] + "..."
+    
+    # Verify that we have meaningful text
+    if not resume_text or len(resume_text.strip()) < 100:
+        logging.error(f"Resume text is too short for analysis: {len(resume_text)} characters")
+        return {
+            'score': 0.0,
+            'summary': 'Erro: Currículo não contém texto suficiente para análise',
+            'analysis': 'FALHA NA ANÁLISE: O arquivo não contém texto suficiente para análise. Verifique se o arquivo está legível.',
+            'skills': [],
+            'experience_years': 0,
+            'education_level': 'Não informado',
+            'match_reasons': [],
+            'recommendations': [],
+            'error_class': 'extraction'
+        }
+    
+    # Step 1: Generate score quickly (most important); without a score the report is not generated
+    logging.info(f"Generating score for job {job.id}: {job.title}")
+    score = generate_score_only(scoring_text, job)
+    if score is None:
+        return build_analysis_result(full_text, resume_text, job, None, '', 'incomplete')
+    logging.info(f"Score generated successfully: {score}")
+    
+    # Step 2: Generate summary and analysis (optimized)
+    analysis_error_class = None
+    try:
+        logging.info(f"Generating detailed analysis for job {job.id}: {job.title}")
+        full_analysis = generate_summary_and_analysis(resume_text, job)
+        logging.info(f"Detailed analysis generated successfully for job {job.id}")
+    except Exception as analysis_error:
+        logging.error(f"Error generating analysis for job {job.id}: {analysis_error}", exc_info=True)
+        print(f"❌ ERRO ao gerar análise detalhada para vaga {job.id}: {analysis_error}")
+        full_analysis = ''
+        analysis_error_class = classify_error(analysis_error)
+    
+    return build_analysis_result(full_text, resume_text, job, score, full_analysis, analysis_error_class)
 
-📞 **INFORMAÇÕES DE CONTATO**
-Email: [Email não disponível]
-Telefone: [Telefone não disponível]
+def build_analysis_result(full_text, resume_text, job, score, full_analysis, analysis_error_class=None):
+    """
+    Validate the generated report and build the analysis result
+    Complete results are cached under the full extracted text; incomplete ones carry an error_class
+    """
+    # Process analysis and separate summary from detailed analysis
+    executive_summary, detailed_analysis = split_summary_and_analysis(full_analysis)
+    
+    # Extract skills quickly
+    skills = extract_skills_from_text(resume_text)
+    
+    # Validate analysis completeness with more tolerance
+    has_score = score is not None and score > 0
+    has_summary = executive_summary and len(executive_summary.strip()) > 30
+    has_analysis = detailed_analysis and len(detailed_analysis.strip()) > 50
+    
+    # More flexible validation - if we have at least score and some content, consider it valid
+    # (a report that failed is never complete, whatever text it carries)
+    is_analysis_complete = has_score and (has_summary or has_analysis) and not analysis_error_class
+    
+    if not is_analysis_complete:
+        logging.warning(f"Incomplete analysis detected for candidate. Score: {score}, Summary length: {len(executive_summary)}, Analysis length: {len(detailed_analysis)}")
+        
+        # Try to provide partial results if possible
+        if has_score:
+            return {
+                'score': score,
+                'summary': executive_summary if has_summary else 'Análise parcial - Resumo não disponível',
+                'analysis': detailed_analysis if has_analysis else 'Análise parcial - Detalhes não disponíveis. Recomenda-se reprocessar para análise completa.',
+                'skills': skills,
+                'experience_years': 1,
+                'education_level': 'Não informado',
+                'match_reasons': [f"Score: {score}/10"],
+                'recommendations': ['Recomenda-se reprocessar para análise completa'],
+                'error_class': analysis_error_class or 'incomplete'
+            }
+        else:
+            return {
+                'score': 0.0,
+                'summary': 'Análise incompleta - Falha na geração do resumo',
+                'analysis': 'FALHA NA ANÁLISE: A análise foi marcada como concluída mas não gerou conteúdo completo. Possíveis causas: erro na API, timeout, ou texto insuficiente.',
+                'skills': [],
+                'experience_years': 0,
+                'education_level': 'Não informado',
+                'match_reasons': [],
+                'recommendations': ['Recomenda-se reprocessar o currículo'],
+                'error_class': analysis_error_class or 'incomplete'
+            }
+    
+    # Create result
+    analysis_result = {
+        'score': score,
+        'summary': executive_summary,
+        'analysis': detailed_analysis,
+        'skills': skills,
+        'experience_years': 1,  # Default for speed
+        'education_level': 'Não informado',
+        'match_reasons': [f"Score: {score}/10"],
+        'recommendations': ["Avaliação baseada em experiência e habilidades técnicas"]
+    }
+    
+    # Cache the result for future use
+    analysis_cache.cache_analysis(full_text, job, analysis_result)
+    
+    return analysis_result
 
-💼 **EXPERIÊNCIA PROFISSIONAL**
-• [Experiência não detalhada]
+def get_file_hash(file_path):
+    """File content hash for the cache fast path (None if the file cannot be read)"""
+    try:
+        return file_content_hash(file_path)
+    except OSError as e:
+        logging.warning(f"Could not hash {file_path}: {e}")
+        return None
 
-🔧 **HABILIDADES TÉCNICAS**
-[Habilidades não especificadas]
+def known_failure_result(failure):
+    """Failure result for a file found in the negative cache (see get_known_failure)"""
+    return {
+        'score': 0.0,
+        'summary': 'Erro: Falha conhecida deste arquivo',
+        'analysis': f"FALHA NA ANÁLISE: {failure['reason']}",
+        'skills': [],
+        'error_class': failure['error_class'],
+        'known_failure': failure
+    }
 
-🎓 **FORMAÇÃO ACADÊMICA**
-[Formação não informada]
+def get_known_failure(file_path, file_hash=None):
+    """
+    Failure result when the file is in the negative cache (it failed the same way before),
+    so it can be skipped without parsing. Returns None for unknown files.
+    """
+    file_hash = file_hash or get_file_hash(file_path)
+    failure = file_hash and analysis_cache.get_cached_failure(file_hash)
+    return known_failure_result(failure) if failure else None
 
-🌍 **IDIOMAS**
-[Idiomas não informados]
+def forget_known_failure(file_path):
+    """Forced retry: removes the file from the negative cache"""
+    file_hash = get_file_hash(file_path)
+    if file_hash:
+        analysis_cache.forget_failure(file_hash)
 
-📊 **ANÁLISE DO RECRUTADOR**
+def remember_extraction_failure(file_hash, reason):
+    """Extraction failures depend only on the file bytes: cache them by file hash"""
+    if file_hash and analysis_cache.cache_failure(file_hash, 'extraction', reason):
+        print(f"🚫 Falha de extração registrada para o arquivo: {reason}")
 
-🎯 **1. ALINHAMENTO TÉCNICO**
-• Experiência relevante: [Análise não disponível]
-• Competências alinhadas: [Não foi possível identificar]
-• Adequação à vaga: [Avaliação não possível]
+# Recently extracted texts by file hash: the local prescreen and the analysis right after it parse each file once
+extracted_texts = LocalLRUCache(max_entries=64, ttl_seconds=600)
 
-⚠️ **2. GAPS IDENTIFICADOS**
-• Lacunas técnicas: [Não foi possível identificar]
-• Conhecimentos em falta: [Análise não disponível]
-• Áreas de desenvolvimento: [Não especificado]
-
-🏆 **3. RECOMENDAÇÃO FINAL: PARCIAL**
-• Pontos fortes: [Não foi possível identificar]
-• Limitações: [Análise técnica não disponível]
-• Justificativa: Resposta da API muito curta. Recomenda-se reprocessar o currículo.
-"""
+def extract_resume_text(file_path, file_type, file_hash=None):
+    """
+    extract_text_from_file recording parse failures in the negative cache
+    Missing or unreadable files (OSError) are not cached: they may be fixed without changing the bytes
+    With file_hash, the text is kept for a few minutes (extracted_texts)
+    """
+    if file_hash:
+        resume_text = extracted_texts.get(file_hash)
+        if resume_text is not None:
+            return resume_text
     
-    return result
+    try:
+        resume_text = extract_text_from_file(file_path, file_type)
+    except (OSError, MemoryError):
+        raise
+    except Exception as e:
+        remember_extraction_failure(file_hash, f"Não foi possível extrair o texto do arquivo ({str(e)})")
+        raise ValueError(f"Could not extract text: {str(e)}") from e
+    
+    if file_hash and resume_text:
+        extracted_texts.set(file_hash, resume_text)
+    return resume_text
 
-def analyze_resume(file_path, file_type, job):
+def analyze_resume(file_path, file_type, job, refresh=False):
     """
     Fast optimized resume analysis with parallel processing
     Returns a dictionary with score, summary, analysis, and skills
+    A stale cached analysis is returned with 'cache_stale': True (the caller schedules
+    the refresh); refresh=True skips the cache and generates a new analysis
     """
     try:
         logging.info(f"Starting resume analysis for job {job.id}: {job.title}")
         print(f"🔄 Iniciando análise de currículo para vaga: {job.title}")
         
+        # Fast path: same file already analysed for this job version, no parsing needed
+        file_hash = get_file_hash(file_path)
+        if file_hash and not refresh:
+            cached_result = analysis_cache.get_cached_analysis_by_file(file_hash, job, allow_stale=True)
+            if cached_result:
+                print("⚡ Análise em cache pelo hash do arquivo (sem extração)")
+                return cached_result
+        
+        # Negative cache: a file that failed extraction before fails the same way
+        known_failure = file_hash and get_known_failure(file_path, file_hash)
+        if known_failure:
+            print(f"🚫 Arquivo com falha conhecida, extração ignorada: {known_failure['known_failure']['reason']}")
+            return known_failure
+        
         # Extract text from the resume
-        resume_text = extract_text_from_file(file_path, file_type)
+        resume_text = extract_resume_text(file_path, file_type, file_hash)
         
         # Log the extracted text for debugging
         logging.info(f"Extracted text length: {len(resume_text)}")
@@ -322,6 +765,7 @@ def analyze_resume(file_path, file_type, job):
         
         if not resume_text or len(resume_text.strip()) < 50:
             logging.error(f"Resume text is too short or empty: {len(resume_text)} characters")
+            remember_extraction_failure(file_hash, 'O arquivo não contém texto legível ou está corrompido.')
             return {
                 'score': 0.0,
                 'summary': 'Erro: Não foi possível extrair texto do currículo',
@@ -330,7 +774,8 @@ def analyze_resume(file_path, file_type, job):
                 'experience_years': 0,
                 'education_level': 'Não informado',
                 'match_reasons': [],
-                'recommendations': []
+                'recommendations': [],
+                'error_class': 'extraction'
             }
         
         # Extract basic information first
@@ -343,161 +788,20 @@ def analyze_resume(file_path, file_type, job):
         extracted_birth_date = extract_birth_date(resume_text)
         
         # Check cache first to avoid redundant API calls
-        cached_result = analysis_cache.get_cached_analysis(resume_text, job.id)
-        if cached_result:
-            return cached_result
+        cached_result = None if refresh else analysis_cache.get_cached_analysis(resume_text, job, allow_stale=True)
+        if not cached_result:
+            # Single-flight: concurrent requests for the same (resume, job) share a single AI call
+            cached_result = analysis_singleflight.do(
+                analysis_flight_key(resume_text, job),
+                lambda: _generate_resume_analysis(resume_text, job),
+                lookup=lambda: analysis_cache.get_cached_analysis(resume_text, job)
+            )
         
-        # Check if API key is available
-        try:
-            openai = get_openai_client()
-        except Exception as api_key_error:
-            logging.error(f"DeepSeek API key not found: {api_key_error}")
-            raise Exception("API key not configured")
-        
-        # Limit resume text to avoid token limits (increased for better analysis)
-        if len(resume_text) > 4000:
-            resume_text = resume_text[:4000] + "..."
-        
-        # Verify that we have meaningful text
-        if not resume_text or len(resume_text.strip()) < 100:
-            logging.error(f"Resume text is too short for analysis: {len(resume_text)} characters")
-            return {
-                'score': 0.0,
-                'summary': 'Erro: Currículo não contém texto suficiente para análise',
-                'analysis': 'FALHA NA ANÁLISE: O arquivo não contém texto suficiente para análise. Verifique se o arquivo está legível.',
-                'skills': [],
-                'experience_years': 0,
-                'education_level': 'Não informado',
-                'match_reasons': [],
-                'recommendations': []
-            }
+        # Complete results are cached: index them by file hash for the next lookup
+        if file_hash and cached_result and 'error_class' not in cached_result:
+            analysis_cache.index_file(file_hash, resume_text, job)
         
-        # Step 1: Generate score quickly (most important)
-        try:
-            logging.info(f"Generating score for job {job.id}: {job.title}")
-            score = generate_score_only(resume_text, job)
-            logging.info(f"Score generated successfully: {score}")
-        except Exception as score_error:
-            logging.error(f"Error generating score for job {job.id}: {score_error}", exc_info=True)
-            print(f"❌ ERRO ao gerar score para vaga {job.id}: {score_error}")
-            score = 5.0  # Default score
-        
-        # Step 2: Generate summary and analysis (optimized)
-        try:
-            logging.info(f"Generating detailed analysis for job {job.id}: {job.title}")
-            full_analysis = generate_summary_and_analysis(resume_text, job)
-            logging.info(f"Detailed analysis generated successfully for job {job.id}")
-        except Exception as analysis_error:
-            logging.error(f"Error generating analysis for job {job.id}: {analysis_error}", exc_info=True)
-            print(f"❌ ERRO ao gerar análise detalhada para vaga {job.id}: {analysis_error}")
-            full_analysis = f"ANÁLISE FALHOU: Erro técnico - {str(analysis_error)}"
-        
-        # Step 3: Process analysis and separate summary from detailed analysis
-        executive_summary = ""
-        detailed_analysis = ""
-        
-        if full_analysis:
-            # Try to separate summary from detailed analysis
-            if "RESUMO DO CURRÍCULO" in full_analysis and "ANÁLISE DO RECRUTADOR" in full_analysis:
-                parts = full_analysis.split("ANÁLISE DO RECRUTADOR")
-                if len(parts) >= 2:
-                    # Extract summary (remove the "RESUMO DO CURRÍCULO" header)
-                    summary_part = parts[0].replace("RESUMO DO CURRÍCULO", "").strip()
-                    if summary_part:
-                        executive_summary = summary_part
-                    # Keep only the detailed analysis
-                    detailed_analysis = parts[1].strip()
-                else:
-                    executive_summary = full_analysis
-                    detailed_analysis = ""
-            elif "RESUMO EXECUTIVO" in full_analysis and "ANÁLISE DO RECRUTADOR" in full_analysis:
-                # Handle old format
-                parts = full_analysis.split("ANÁLISE DO RECRUTADOR")
-                if len(parts) >= 2:
-                    summary_part = parts[0].replace("RESUMO EXECUTIVO", "").strip()
-                    if summary_part:
-                        executive_summary = summary_part
-                    detailed_analysis = parts[1].strip()
-                else:
-                    executive_summary = full_analysis
-                    detailed_analysis = ""
-            else:
-                # If format is not as expected, use the full analysis as summary only
-                executive_summary = full_analysis
-                detailed_analysis = ""
-        
-        # Clean up any remaining separators and analysis content from summary
-        if executive_summary:
-            executive_summary = executive_summary.replace("---", "").strip()
-            # Remove any analysis content that might have leaked into summary
-            analysis_indicators = [
-                "ANÁLISE DO RECRUTADOR", "1. ALINHAMENTO TÉCNICO", "2. GAPS IDENTIFICADOS", 
-                "3. RECOMENDAÇÃO FINAL", "OBSERVAÇÃO FINAL", "Pontos fortes:", "Limitações:", 
-                "Justificativa:", "Lacunas técnicas:", "Conhecimentos em falta:", 
-                "Áreas de desenvolvimento:", "Competências alinhadas:", "Adequação à vaga:", 
-                "Experiência relevante:", "PARCIAL", "ADEQUADO", "INADEQUADO"
-            ]
-            for indicator in analysis_indicators:
-                if indicator in executive_summary:
-                    executive_summary = executive_summary.split(indicator)[0].strip()
-        
-        if detailed_analysis:
-            detailed_analysis = detailed_analysis.replace("---", "").strip()
-        
-        # Extract skills quickly
-        skills = extract_skills_from_text(resume_text)
-        
-        # Validate analysis completeness with more tolerance
-        has_score = score is not None and score > 0
-        has_summary = executive_summary and len(executive_summary.strip()) > 30
-        has_analysis = detailed_analysis and len(detailed_analysis.strip()) > 50
-        
-        # More flexible validation - if we have at least score and some content, consider it valid
-        is_analysis_complete = has_score and (has_summary or has_analysis)
-        
-        if not is_analysis_complete:
-            logging.warning(f"Incomplete analysis detected for candidate. Score: {score}, Summary length: {len(executive_summary)}, Analysis length: {len(detailed_analysis)}")
-            
-            # Try to provide partial results if possible
-            if has_score:
-                return {
-                    'score': score,
-                    'summary': executive_summary if has_summary else 'Análise parcial - Resumo não disponível',
-                    'analysis': detailed_analysis if has_analysis else 'Análise parcial - Detalhes não disponíveis. Recomenda-se reprocessar para análise completa.',
-                    'skills': skills,
-                    'experience_years': 1,
-                    'education_level': 'Não informado',
-                    'match_reasons': [f"Score: {score}/10"],
-                    'recommendations': ['Recomenda-se reprocessar para análise completa']
-                }
-            else:
-                return {
-                    'score': 0.0,
-                    'summary': 'Análise incompleta - Falha na geração do resumo',
-                    'analysis': 'FALHA NA ANÁLISE: A análise foi marcada como concluída mas não gerou conteúdo completo. Possíveis causas: erro na API, timeout, ou texto insuficiente.',
-                    'skills': [],
-                    'experience_years': 0,
-                    'education_level': 'Não informado',
-                    'match_reasons': [],
-                    'recommendations': ['Recomenda-se reprocessar o currículo']
-                }
-        
-        # Create result
-        analysis_result = {
-            'score': score,
-            'summary': executive_summary,
-            'analysis': detailed_analysis,
-            'skills': skills,
-            'experience_years': 1,  # Default for speed
-            'education_level': 'Não informado',
-            'match_reasons': [f"Score: {score}/10"],
-            'recommendations': ["Avaliação baseada em experiência e habilidades técnicas"]
-        }
-        
-        # Cache the result for future use
-        analysis_cache.cache_analysis(resume_text, job.id, analysis_result)
-        
-        return analysis_result
+        return cached_result
         
     except Exception as e:
         # Quick error handling
@@ -512,8 +816,302 @@ def analyze_resume(file_path, file_type, job):
             'experience_years': 0,
             'education_level': 'Não informado',
             'match_reasons': [],
-            'recommendations': []
+            'recommendations': [],
+            'error_class': classify_error(e)
+        }
+
+def stream_resume_analysis(file_path, file_type, job):
+    """
+    Streaming version of analyze_resume for the candidate page
+    Yields ('chunk', text) while the report is generated, ('replace', text) when a truncated
+    report is completed by a continuation, and finally ('result', analysis result)
+    The score prompt runs in parallel with the streamed report. It shares the single-flight key of
+    analyze_resume: when the same analysis is already running, its result is awaited instead
+    """
+    file_hash = get_file_hash(file_path)
+    cached_result = file_hash and analysis_cache.get_cached_analysis_by_file(file_hash, job, allow_stale=True)
+    if cached_result:
+        yield 'result', cached_result
+        return
+    
+    known_failure = file_hash and get_known_failure(file_path, file_hash)
+    if known_failure:
+        yield 'result', known_failure
+        return
+    
+    resume_text = extract_resume_text(file_path, file_type, file_hash)
+    if not resume_text or len(resume_text.strip()) < 50:
+        remember_extraction_failure(file_hash, 'O arquivo não contém texto legível ou está corrompido.')
+        yield 'result', {
+            'score': 0.0,
+            'summary': 'Erro: Não foi possível extrair texto do currículo',
+            'analysis': 'FALHA NA ANÁLISE: O arquivo não contém texto legível ou está corrompido.',
+            'skills': [],
+            'error_class': 'extraction'
+        }
+        return
+    
+    cached_result = analysis_cache.get_cached_analysis(resume_text, job, allow_stale=True)
+    if cached_result:
+        if file_hash:
+            analysis_cache.index_file(file_hash, resume_text, job)
+        yield 'result', cached_result
+        return
+    
+    flight_key = analysis_flight_key(resume_text, job)
+    with analysis_singleflight.leading(flight_key) as flight:
+        if flight is None:
+            # Same analysis already running (background processing, other thread or worker): wait for it
+            print("⏳ Análise deste currículo já em andamento, aguardando o resultado")
+            result = analysis_singleflight.do(
+                flight_key,
+                lambda: _generate_resume_analysis(resume_text, job),
+                lookup=lambda: analysis_cache.get_cached_analysis(resume_text, job)
+            )
+            if file_hash and result and 'error_class' not in result:
+                analysis_cache.index_file(file_hash, resume_text, job)
+            yield 'result', result
+            return
+        
+        for event in _stream_resume_analysis(resume_text, job, file_hash, flight):
+            yield event
+
+def _stream_resume_analysis(resume_text, job, file_hash, flight):
+    """
+    Streamed score and report prompts (leader path of stream_resume_analysis)
+    Bounded by STREAM_ANALYSIS_MAX_SECONDS: past it the report stream is closed and the result
+    carries error_class 'timeout' (new attempt scheduled by the retry policy)
+    """
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor
+    
+    deadline = time.time() + STREAM_ANALYSIS_MAX_SECONDS
+    full_text = resume_text
+    scoring_text = get_scoring_text(resume_text, job.id)
+    if len(resume_text) > 4000:
+        resume_text = resume_text[:4000] + "..."
+    
+    executor = ThreadPoolExecutor(max_workers=1)
+    # copy_context keeps the telemetry context (job, candidate) in the score thread
+    score_future = executor.submit(contextvars.copy_context().run, generate_score_only, scoring_text, job)
+    try:
+        prompt = build_analysis_prompt(resume_text, job)
+        stream = stream_chat_completion(
+            'analysis',
+            job=job,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=0.2
+        )
+        analysis_error_class = None
+        chunks = iter(stream)
+        try:
+            for text in chunks:
+                if time.time() > deadline:
+                    raise TimeoutError(f"Streaming analysis exceeded {STREAM_ANALYSIS_MAX_SECONDS}s")
+                yield 'chunk', text
+            full_analysis = stream.text
+            print(f"⚡ Primeiro trecho da análise em {stream.first_token_ms}ms")
+            
+            if full_analysis and stream.finish_reason == 'length':
+                full_analysis = continue_truncated_report(prompt, full_analysis, job, deadline=deadline)
+                yield 'replace', full_analysis
+        except Exception as analysis_error:
+            logging.error(f"Streaming analysis failed for job {job.id}: {analysis_error}", exc_info=True)
+            full_analysis = ''
+            analysis_error_class = classify_error(analysis_error)
+        finally:
+            # Fecha a conexão com a IA quando o relatório foi interrompido (prazo ou cliente desconectado)
+            chunks.close()
+        
+        try:
+            score = score_future.result(timeout=max(deadline - time.time(), 0))
+            if score is None:
+                analysis_error_class = analysis_error_class or 'incomplete'
+        except Exception as score_error:
+            logging.error(f"Error generating score for job {job.id}: {score_error}")
+            score = None
+            analysis_error_class = analysis_error_class or classify_error(score_error)
+        
+        result = build_analysis_result(full_text, resume_text, job, score, full_analysis, analysis_error_class)
+        if file_hash and 'error_class' not in result:
+            analysis_cache.index_file(file_hash, full_text, job)
+        flight.result = result
+        yield 'result', result
+    finally:
+        executor.shutdown(wait=False)
+
+def score_resume(file_path, file_type, job, refresh=False):
+    """
+    Score-first analysis for tiered processing: runs only the fast score prompt.
+    The full report is generated later by generate_full_report (on demand or for the top-N).
+    Returns the cached full analysis when one is already available.
+    """
+    return score_resumes_batch([(file_path, file_type)], job, refresh=refresh)[0]
+
+def score_resumes_batch(resumes, job, refresh=False):
+    """
+    Score-first analysis of several resumes for the same job (tiered processing)
+    resumes is a list of (file_path, file_type); uncached resumes are scored with
+    batched prompts (generate_batch_scores). Returns one result per resume, in order.
+    Stale cached results are marked like in analyze_resume; refresh=True skips the cache.
+    """
+    results = [None] * len(resumes)
+    texts_to_score = {}
+    file_hashes = {}
+    
+    for index, (file_path, file_type) in enumerate(resumes):
+        try:
+            # Fast path by file hash: a known file is not parsed again
+            file_hash = get_file_hash(file_path)
+            if file_hash and not refresh:
+                results[index] = (
+                    analysis_cache.get_cached_analysis_by_file(file_hash, job, allow_stale=True) or
+                    analysis_cache.get_cached_analysis_by_file(file_hash, job, kind='score', allow_stale=True)
+                )
+                if results[index] is not None:
+                    continue
+            if file_hash:
+                file_hashes[index] = file_hash
+                results[index] = get_known_failure(file_path, file_hash)
+                if results[index] is not None:
+                    continue
+            
+            resume_text = extract_resume_text(file_path, file_type, file_hash)
+            
+            if not resume_text or len(resume_text.strip()) < 100:
+                logging.error(f"Resume text is too short for scoring: {len(resume_text or '')} characters")
+                remember_extraction_failure(file_hash, 'O arquivo não contém texto suficiente para análise.')
+                results[index] = {
+                    'score': 0.0,
+                    'summary': 'Erro: Currículo não contém texto suficiente para análise',
+                    'analysis': 'FALHA NA ANÁLISE: O arquivo não contém texto suficiente para análise. Verifique se o arquivo está legível.',
+                    'skills': [],
+                    'error_class': 'extraction'
+                }
+                continue
+            
+            # A full report already cached is better than a new score-only result
+            cached_kinds = () if refresh else ('analysis', 'score')
+            for kind in cached_kinds:
+                results[index] = analysis_cache.get_cached_analysis(resume_text, job, kind=kind, allow_stale=True)
+                if results[index] is not None:
+                    if file_hash:
+                        analysis_cache.index_file(file_hash, resume_text, job, kind=kind)
+                    break
+            else:
+                texts_to_score[index] = resume_text
+                
+        except Exception as e:
+            logging.error(f"Error in score-only analysis: {str(e)}")
+            results[index] = {
+                'score': 0.0,
+                'summary': 'Erro na análise do currículo',
+                'analysis': f'FALHA NA ANÁLISE: {str(e)}',
+                'skills': [],
+                'error_class': classify_error(e)
+            }
+    
+    if not texts_to_score:
+        return results
+    
+    indices = list(texts_to_score.keys())
+    truncated_texts = [
+        texts_to_score[index][:4000] + "..." if len(texts_to_score[index]) > 4000 else texts_to_score[index]
+        for index in indices
+    ]
+    
+    logging.info(f"Generating {len(indices)} scores (tiered mode) for job {job.id}: {job.title}")
+    score_errors = {}
+    try:
+        scoring_texts = [get_scoring_text(texts_to_score[index], job.id) for index in indices]
+        scores = generate_batch_scores(scoring_texts, job, errors=score_errors)
+    except Exception as e:
+        logging.error(f"Error in batched score analysis: {str(e)}")
+        scores = [None] * len(indices)
+        score_errors = {position: classify_error(e) for position in range(len(indices))}
+    
+    # Failed scores are neither cached nor indexed by file hash: the retry must call the AI again
+    for position, (index, truncated_text, score) in enumerate(zip(indices, truncated_texts, scores)):
+        if score is None:
+            results[index] = {
+                'score': 0.0,
+                'summary': 'Erro na análise do currículo',
+                'analysis': 'FALHA NA ANÁLISE: Score não gerado',
+                'skills': [],
+                'error_class': score_errors.get(position, 'api')
+            }
+            continue
+        
+        results[index] = {
+            'score': score,
+            'summary': None,
+            'analysis': None,
+            'skills': extract_skills_from_text(truncated_text),
+            'report_pending': True
         }
+        analysis_cache.cache_analysis(texts_to_score[index], job, results[index], kind='score')
+        if index in file_hashes:
+            analysis_cache.index_file(file_hashes[index], texts_to_score[index], job, kind='score')
+    
+    return results
+
+def generate_full_report(file_path, file_type, job, score):
+    """
+    Generate the full summary/analysis report for a candidate already scored in tiered mode
+    Returns the same dictionary as analyze_resume, or None if the report could not be generated
+    """
+    file_hash = get_file_hash(file_path)
+    cached_result = file_hash and analysis_cache.get_cached_analysis_by_file(file_hash, job)
+    if cached_result:
+        return cached_result
+    
+    resume_text = extract_resume_text(file_path, file_type, file_hash)
+    if not resume_text or len(resume_text.strip()) < 100:
+        return None
+    
+    cached_result = analysis_cache.get_cached_analysis(resume_text, job)
+    if not cached_result:
+        # Single-flight: a report already being generated (other thread or worker) is awaited, not repeated
+        cached_result = analysis_singleflight.do(
+            analysis_flight_key(resume_text, job),
+            lambda: _generate_full_report(resume_text, job, score),
+            lookup=lambda: analysis_cache.get_cached_analysis(resume_text, job)
+        )
+    
+    if file_hash and cached_result:
+        analysis_cache.index_file(file_hash, resume_text, job)
+    
+    return cached_result
+
+def _generate_full_report(resume_text, job, score):
+    """Run the full report prompt (cache miss path of generate_full_report)"""
+    truncated_text = resume_text[:4000] + "..." if len(resume_text) > 4000 else resume_text
+    
+    logging.info(f"Generating full report (tiered mode) for job {job.id}: {job.title}")
+    full_analysis = generate_summary_and_analysis(truncated_text, job)
+    executive_summary, detailed_analysis = split_summary_and_analysis(full_analysis)
+    
+    has_summary = executive_summary and len(executive_summary.strip()) > 30
+    has_analysis = detailed_analysis and len(detailed_analysis.strip()) > 50
+    if not (has_summary or has_analysis):
+        logging.warning(f"Incomplete full report for job {job.id}: summary {len(executive_summary)}, analysis {len(detailed_analysis)}")
+        return None
+    
+    report_result = {
+        'score': score,
+        'summary': executive_summary,
+        'analysis': detailed_analysis,
+        'skills': extract_skills_from_text(truncated_text),
+        'experience_years': 1,
+        'education_level': 'Não informado',
+        'match_reasons': [f"Score: {score}/10"],
+        'recommendations': ["Avaliação baseada em experiência e habilidades técnicas"]
+    }
+    
+    # Same cache entry as analyze_resume - a later full reprocess reuses this report
+    analysis_cache.cache_analysis(resume_text, job, report_result)
+    
+    return report_result
 
 def extract_skills_from_text(text):
     """
@@ -579,70 +1177,181 @@ def determine_education_level(text):
 def get_detailed_error_description(error, file_path):
     """
     Generate detailed error description based on error type
+    A classe do erro (classify_error) também decide a política de novas tentativas
     """
     error_type = type(error).__name__
     error_msg = str(error)
     
-    # File-related errors
-    if "No such file or directory" in error_msg:
-        return f"Arquivo não encontrado: {file_path} - O arquivo foi removido ou movido durante o processamento."
-    
-    # Permission errors
-    if "Permission denied" in error_msg:
-        return f"Erro de permissão: Não foi possível acessar o arquivo {file_path}. Verifique as permissões do arquivo."
-    
-    # OpenAI/API errors
-    if "OpenAI" in error_type or "API" in error_type:
-        if "timeout" in error_msg.lower():
-            return f"Timeout na API: A análise demorou muito para responder. Isso pode ocorrer quando o serviço de IA está sobrecarregado."
-        elif "rate limit" in error_msg.lower():
-            return f"Limite de taxa excedido: Muitas requisições à API. Aguarde alguns minutos antes de tentar novamente."
-        elif "invalid" in error_msg.lower():
-            return f"Erro de API: Chave de API inválida ou problema na configuração do serviço de IA."
-        elif "connection" in error_msg.lower():
-            return f"Erro de conexão: Não foi possível conectar ao serviço de IA. Verifique a conexão com a internet."
-        else:
-            return f"Erro na API de IA: {error_msg}"
+    descriptions = {
+        'file_not_found': f"Arquivo não encontrado: {file_path} - O arquivo foi removido ou movido durante o processamento.",
+        'permission': f"Erro de permissão: Não foi possível acessar o arquivo {file_path}. Verifique as permissões do arquivo.",
+        'timeout': "Timeout na API: A análise demorou muito para responder. Isso pode ocorrer quando o serviço de IA está sobrecarregado.",
+        'rate_limit': "Limite de taxa excedido: Muitas requisições à API. Aguarde alguns minutos antes de tentar novamente.",
+        'invalid_key': "Erro de API: Chave de API inválida ou problema na configuração do serviço de IA.",
+        'connection': "Erro de conexão: Não foi possível conectar ao serviço de IA. Verifique a conexão com a internet.",
+        'api': f"Erro na API de IA: {error_msg}",
+        'database': f"Erro de banco de dados: {error_msg} - Problema ao salvar ou recuperar dados do candidato.",
+        'extraction': f"Erro na extração de texto: Não foi possível extrair o conteúdo do arquivo {file_path}. O arquivo pode estar corrompido ou em formato não suportado.",
+        'memory': f"Erro de memória: O arquivo {file_path} é muito grande ou complexo para processamento.",
+        'network': "Erro de rede: Problema de conectividade. Verifique a conexão com a internet.",
+    }
+    
+    # Generic errors
+    return descriptions.get(classify_error(error), f"Erro inesperado ({error_type}): {error_msg}")
+
+# Map-reduce batch report: fixed-size chunks summarized in parallel and cached by content hash
+BATCH_REPORT_VERSION = 1
+BATCH_REPORT_CHUNK_SIZE = 25  # Candidates per map prompt
+BATCH_REPORT_REDUCE_FAN_IN = 12  # Partial summaries per reduce prompt
+BATCH_REPORT_MAX_WORKERS = 4
+BATCH_REPORT_CACHE_HOURS = 24 * 7
+
+BATCH_REPORT_SYSTEM_PROMPT = "Você é um consultor sênior de RH especializado em análise de candidatos."
+
+def _request_json(purpose, prompt, max_tokens):
+    """Call the model for a JSON response (used by the batch report steps)"""
+    response = chat_completion(
+        purpose,
+        messages=[
+            {"role": "system", "content": BATCH_REPORT_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={"type": "json_object"},
+        max_tokens=max_tokens,
+        temperature=0.3
+    )
+    return json.loads(response.choices[0].message.content)
+
+def _cached_partial(kind, payload, build_prompt):
+    """
+    Map/reduce step cached by the content hash of its input
+    An unchanged chunk is never sent to the model again
+    """
+    payload_json = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    cache_key = f"batch_report_{kind}:v{BATCH_REPORT_VERSION}"
     
-    # Database errors
-    if "database" in error_msg.lower() or "sql" in error_msg.lower():
-        return f"Erro de banco de dados: {error_msg} - Problema ao salvar ou recuperar dados do candidato."
+    cached = analysis_cache.get_cached_analysis(payload_json, cache_key, max_age_hours=BATCH_REPORT_CACHE_HOURS)
+    if cached:
+        return cached
     
-    # Text extraction errors
-    if "extract" in error_msg.lower() or "decode" in error_msg.lower():
-        return f"Erro na extração de texto: Não foi possível extrair o conteúdo do arquivo {file_path}. O arquivo pode estar corrompido ou em formato não suportado."
+    partial = _request_json(f"batch_report_{kind}", build_prompt(payload_json), max_tokens=700)
+    analysis_cache.cache_analysis(payload_json, cache_key, partial, ttl_hours=BATCH_REPORT_CACHE_HOURS)
+    return partial
+
+def _map_prompt(chunk_json):
+    return f"""
+Resuma o grupo de candidatos abaixo para um relatório executivo de recrutamento.
+
+CANDIDATOS:
+{chunk_json}
+
+Responda em JSON com:
+{{
+    "summary": "[resumo do perfil do grupo em até 5 frases]",
+    "top_candidates": [{{"name": "...", "score": 0.0, "reason": "[motivo em uma frase]"}}],
+    "common_skills": ["habilidades", "mais", "frequentes"],
+    "gaps": ["lacunas", "recorrentes"]
+}}
+Inclua no máximo 3 candidatos em top_candidates.
+"""
+
+def _reduce_prompt(partials_json):
+    return f"""
+Combine os resumos parciais de grupos de candidatos abaixo em um único resumo.
+
+RESUMOS PARCIAIS:
+{partials_json}
+
+Responda em JSON com:
+{{
+    "summary": "[resumo combinado em até 6 frases]",
+    "top_candidates": [{{"name": "...", "score": 0.0, "reason": "[motivo em uma frase]"}}],
+    "common_skills": ["habilidades", "mais", "frequentes"],
+    "gaps": ["lacunas", "recorrentes"]
+}}
+Inclua no máximo 5 candidatos em top_candidates.
+"""
+
+def _local_partial(candidates_data):
+    """Fallback partial built without the model (used when a chunk request fails)"""
+    ranked = sorted(candidates_data, key=lambda c: c.get('score') or 0, reverse=True)
+    return {
+        'summary': '',
+        'top_candidates': [{'name': c['name'], 'score': c.get('score'), 'reason': ''} for c in ranked[:3]],
+        'common_skills': [],
+        'gaps': []
+    }
+
+def _run_parallel(kind, payloads, build_prompt, fallback):
+    """Run one map-reduce level in parallel, keeping the order of the payloads"""
+    from concurrent.futures import ThreadPoolExecutor
     
-    # Memory/processing errors
-    if "memory" in error_msg.lower() or "out of" in error_msg.lower():
-        return f"Erro de memória: O arquivo {file_path} é muito grande ou complexo para processamento."
+    def run(payload):
+        try:
+            return _cached_partial(kind, payload, build_prompt)
+        except Exception as e:
+            logging.error(f"Batch report {kind} step failed: {e}")
+            return fallback(payload)
     
-    # Network errors
-    if "network" in error_msg.lower() or "dns" in error_msg.lower():
-        return f"Erro de rede: Problema de conectividade. Verifique a conexão com a internet."
+    with ThreadPoolExecutor(max_workers=BATCH_REPORT_MAX_WORKERS) as executor:
+        return list(executor.map(run, payloads))
+
+def _score_distribution(candidates_data):
+    """Score distribution computed locally (no need to send every score to the model)"""
+    scores = [c['score'] for c in candidates_data if c.get('score') is not None]
+    if not scores:
+        return 'Nenhum candidato com pontuação'
     
-    # Generic errors
-    return f"Erro inesperado ({error_type}): {error_msg}"
+    ranges = [('8-10', 8, 10.01), ('6-8', 6, 8), ('4-6', 4, 6), ('0-4', 0, 4)]
+    counts = ', '.join(f"{label}: {sum(1 for score in scores if low <= score < high)}" for label, low, high in ranges)
+    return f"{len(scores)} candidatos pontuados, média {sum(scores) / len(scores):.2f} (mín {min(scores):.2f}, máx {max(scores):.2f}). Faixas: {counts}"
 
 def generate_batch_analysis_report(candidates):
     """
     Generate a comprehensive report for multiple candidates
+    Map-reduce: candidates are split into fixed-size chunks (ordered by ID, so new candidates
+    only change the last chunk), each chunk is summarized in parallel and cached by content hash,
+    then the partial summaries are reduced into the final report
     """
     try:
         candidates_data = []
-        for candidate in candidates:
+        for candidate in sorted(candidates, key=lambda c: c.id or 0):
             candidates_data.append({
+                'id': candidate.id,
                 'name': candidate.name,
                 'score': candidate.ai_score,
-                'summary': candidate.ai_summary,
-                'skills': candidate.get_skills_list(),
+                'summary': (candidate.ai_summary or '')[:600],
+                'skills': candidate.get_skills_list()[:15],
                 'status': candidate.status
             })
         
+        if not candidates_data:
+            raise ValueError("Nenhum candidato para o relatório")
+        
+        # Map: fixed-size chunks summarized in parallel
+        chunks = [candidates_data[i:i + BATCH_REPORT_CHUNK_SIZE] for i in range(0, len(candidates_data), BATCH_REPORT_CHUNK_SIZE)]
+        partials = _run_parallel('map', chunks, _map_prompt, _local_partial)
+        
+        # Reduce: combine partials in groups until they fit in the final prompt
+        while len(partials) > BATCH_REPORT_REDUCE_FAN_IN:
+            groups = [partials[i:i + BATCH_REPORT_REDUCE_FAN_IN] for i in range(0, len(partials), BATCH_REPORT_REDUCE_FAN_IN)]
+            partials = _run_parallel('reduce', groups, _reduce_prompt, lambda group: {
+                'summary': ' '.join(p.get('summary', '') for p in group)[:1000],
+                'top_candidates': [c for p in group for c in p.get('top_candidates', [])][:5],
+                'common_skills': [s for p in group for s in p.get('common_skills', [])][:15],
+                'gaps': [g for p in group for g in p.get('gaps', [])][:10]
+            })
+        
+        score_distribution = _score_distribution(candidates_data)
+        
         prompt = f"""
-        Analise os seguintes candidatos e gere um relatório executivo de recrutamento:
+        Gere um relatório executivo de recrutamento a partir dos resumos parciais de {len(candidates_data)} candidatos:
         
-        CANDIDATOS:
-        {json.dumps(candidates_data, indent=2, ensure_ascii=False)}
+        RESUMOS PARCIAIS:
+        {json.dumps(partials, indent=2, ensure_ascii=False)}
+        
+        DISTRIBUIÇÃO DE PONTUAÇÕES:
+        {score_distribution}
         
         Forneça um relatório no formato JSON com:
         {{
@@ -654,18 +1363,16 @@ def generate_batch_analysis_report(candidates):
         }}
         """
         
-        openai = get_openai_client()
-        response = openai.chat.completions.create(
-            model="deepseek-chat",
+        response = chat_completion(
+            'batch_report',
             messages=[
                 {
                     "role": "system",
-                    "content": "Você é um consultor sênior de RH especializado em análise de candidatos."
+                    "content": BATCH_REPORT_SYSTEM_PROMPT
                 },
                 {"role": "user", "content": prompt}
             ],
             response_format={"type": "json_object"},
-            max_tokens=1500,
             temperature=0.3
         )
         
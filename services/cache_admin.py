@@ -0,0 +1,149 @@
+"""
+Administração do cache de análises: conteúdo por vaga, limpeza e pré-aquecimento
+
+O pré-aquecimento importa as análises já salvas na tabela de candidatos, para que um nó novo
+(ou um cache esvaziado) comece com acertos em vez de chamar a IA de novo. Apenas o texto dos
+currículos é extraído; nenhuma chamada à IA é feita.
+
+Uso:
+    python -m services.cache_admin stats
+    python -m services.cache_admin purge-job <job_id>
+    python -m services.cache_admin purge-prompt <versão> | --outdated
+    python -m services.cache_admin warm [job_id]
+"""
+import json
+import logging
+import sys
+from datetime import datetime
+
+import pytz
+
+from services.cache_service import analysis_cache, cache_policy, file_content_hash
+
+logger = logging.getLogger(__name__)
+
+# Candidatos em camadas sem relatório completo: apenas o score é importado
+SCORE_ONLY_REPORT_STATUSES = ('pending', 'generating', 'failed')
+
+def is_importable(candidate):
+    """Análise concluída e válida, feita depois da última alteração da vaga"""
+    if candidate.analysis_status != 'completed' or not (candidate.ai_score or 0) > 0:
+        return False
+    if candidate.report_status not in SCORE_ONLY_REPORT_STATUSES:
+        if not candidate.ai_summary or not candidate.ai_analysis or candidate.ai_analysis.startswith('FALHA'):
+            return False
+        if candidate.is_analysis_outdated():
+            return False
+    # Vaga alterada depois da análise: o resultado pode não corresponder à versão atual
+    return not (candidate.analyzed_at and candidate.job.updated_at and
+                candidate.analyzed_at.replace(tzinfo=None) < candidate.job.updated_at.replace(tzinfo=None))
+
+def candidate_cache_entry(candidate):
+    """(kind, resultado) no mesmo formato gravado por ai_service para a análise do candidato"""
+    score = candidate.ai_score
+    if candidate.report_status in SCORE_ONLY_REPORT_STATUSES:
+        return 'score', {
+            'score': score,
+            'summary': None,
+            'analysis': None,
+            'skills': candidate.get_skills_list(),
+            'report_pending': True
+        }
+    return 'analysis', {
+        'score': score,
+        'summary': candidate.ai_summary,
+        'analysis': candidate.ai_analysis,
+        'skills': candidate.get_skills_list(),
+        'experience_years': 1,
+        'education_level': 'Não informado',
+        'match_reasons': [f"Score: {score}/10"],
+        'recommendations': ["Avaliação baseada em experiência e habilidades técnicas"]
+    }
+
+def analyzed_at_local(candidate):
+    """Data da análise (horário de Brasília no banco) no horário local do servidor, sem timezone"""
+    if not candidate.analyzed_at:
+        return None
+    analyzed_at = candidate.analyzed_at
+    if analyzed_at.tzinfo is None:
+        analyzed_at = pytz.timezone('America/Sao_Paulo').localize(analyzed_at)
+    return analyzed_at.astimezone().replace(tzinfo=None)
+
+def warm_cache(job_id=None, limit=None):
+    """
+    Importa as análises da tabela de candidatos para o cache (precisa do contexto da aplicação)
+    As entradas mantêm a data da análise original, então a política de expiração da vaga continua valendo
+    Retorna a contagem de importadas, já em cache, ignoradas e com erro
+    """
+    from models.models import Candidate
+    from services.file_processor import extract_text_from_file
+
+    query = Candidate.query.filter(Candidate.analysis_status == 'completed', Candidate.ai_score > 0)
+    if job_id:
+        query = query.filter(Candidate.job_id == job_id)
+    candidates = query.order_by(Candidate.analyzed_at.desc()).limit(limit).all() if limit else query.all()
+
+    counts = {'imported': 0, 'cached': 0, 'skipped': 0, 'expired': 0, 'errors': 0}
+    for candidate in candidates:
+        if not is_importable(candidate):
+            counts['skipped'] += 1
+            continue
+
+        kind, result = candidate_cache_entry(candidate)
+        analyzed_at = analyzed_at_local(candidate)
+        ttl_hours, stale_hours = cache_policy(candidate.job)
+        if analyzed_at and (datetime.now() - analyzed_at).total_seconds() > (ttl_hours + stale_hours) * 3600:
+            counts['expired'] += 1
+            continue
+
+        try:
+            file_hash = file_content_hash(candidate.file_path)
+            if analysis_cache.get_cached_analysis_by_file(file_hash, candidate.job, kind=kind, allow_stale=True):
+                counts['cached'] += 1
+                continue
+
+            resume_text = extract_text_from_file(candidate.file_path, candidate.file_type)
+            # Entrada pela chave do texto sem índice do arquivo: não é substituída, apenas indexada
+            if analysis_cache.get_cached_analysis(resume_text, candidate.job, kind=kind, allow_stale=True):
+                counts['cached'] += 1
+            else:
+                analysis_cache.cache_analysis(resume_text, candidate.job, result, kind=kind, timestamp=analyzed_at)
+                counts['imported'] += 1
+            analysis_cache.index_file(file_hash, resume_text, candidate.job, kind=kind)
+
+        except Exception as e:
+            logger.warning(f"Could not warm cache for candidate {candidate.id}: {str(e)}")
+            counts['errors'] += 1
+
+    print(f"🔥 Pré-aquecimento do cache: {counts['imported']} importadas, {counts['cached']} já em cache, "
+          f"{counts['skipped']} ignoradas, {counts['expired']} vencidas, {counts['errors']} com erro")
+    return counts
+
+def cache_overview():
+    """Estatísticas, taxa de acertos e conteúdo do cache por vaga"""
+    return {'stats': analysis_cache.get_cache_stats(), **analysis_cache.describe()}
+
+if __name__ == '__main__':
+    commands = ('stats', 'purge-job', 'purge-prompt', 'warm')
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__.split('Uso:')[1].rstrip())
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == 'stats':
+        print(json.dumps(cache_overview(), indent=2, ensure_ascii=False))
+    elif command == 'purge-job' and len(sys.argv) > 2:
+        print(f"🗑️ {analysis_cache.purge_job(sys.argv[2])} entradas removidas da vaga {sys.argv[2]}")
+    elif command == 'purge-prompt' and len(sys.argv) > 2:
+        if sys.argv[2] == '--outdated':
+            purged = analysis_cache.purge_outdated_prompts()
+        else:
+            purged = analysis_cache.purge_prompt_version(int(sys.argv[2]))
+        print(f"🗑️ {purged} entradas removidas")
+    elif command == 'warm':
+        from app import app
+        with app.app_context():
+            warm_cache(job_id=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        print(__doc__.split('Uso:')[1].rstrip())
+        sys.exit(1)
@@ -1,125 +1,643 @@
 """
 Cache service for AI analysis results to prevent redundant processing
+
+Two tiers with the same get_cached_analysis/cache_analysis API:
+- local: in-process LRU with TTL (one per gunicorn worker), answers repeated lookups without I/O
+- shared: Redis when REDIS_URL is set, shared by every worker and node; without Redis, a
+  single SQLite file in cache/ (services/cache_store.py) shared by the workers of the node
+
+Removals (purge_*, clear_cache, forget_failure) bump an invalidation epoch stored in the shared
+tier; every worker compares it at most every epoch_check_seconds and clears its local tier when it
+changed, so other workers stop serving removed entries within that interval (not the local TTL).
+
+Each entry carries its own expiry policy (see cache_policy): fresh for ttl_hours, then
+served as stale for stale_hours more while a background refresh replaces it
+(stale-while-revalidate), and only then removed.
 """
 
+import copy
 import json
 import hashlib
 import os
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
+from services.cache_store import SQLiteCacheBackend, compress_entry, decompress_entry
+
+class LocalLRUCache:
+    """Bounded in-process tier: least recently used entries are dropped first"""
+    def __init__(self, max_entries=512, ttl_seconds=300):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            stored_at, cached_data = item
+            if time.time() - stored_at > self.ttl_seconds:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return cached_data
+
+    def set(self, key, cached_data):
+        with self.lock:
+            self.entries[key] = (time.time(), cached_data)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+class RedisCacheBackend:
+    """
+    Shared tier on Redis: entries expire by themselves with the TTL given on write
+    Payloads are zlib-compressed; the size budget and LRU eviction are Redis' own
+    (maxmemory with maxmemory-policy allkeys-lru, see docker-compose.yml)
+    """
+    name = 'redis'
+
+    def __init__(self, client, prefix='analysis_cache:'):
+        self.client = client
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {'bytes_written': 0, 'raw_bytes_written': 0}
+
+    def _decode(self, value):
+        if not value:
+            return None
+        try:
+            return decompress_entry(value)
+        except zlib.error:
+            # Entrada gravada antes da compressão (JSON puro)
+            return json.loads(value)
+
+    def get(self, cache_key):
+        return self._decode(self.client.get(self.prefix + cache_key))
+
+    def set(self, cache_key, cached_data, ttl_seconds=None):
+        payload = compress_entry(cached_data)
+        self.client.set(self.prefix + cache_key, payload, ex=ttl_seconds)
+        with self.lock:
+            self.counters['bytes_written'] += len(payload)
+            self.counters['raw_bytes_written'] += len(json.dumps(cached_data, ensure_ascii=False).encode('utf-8'))
+
+    def delete(self, cache_key):
+        self.client.delete(self.prefix + cache_key)
+
+    def clear_older_than(self, cutoff_time):
+        cleared_count = 0
+        for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+            cached_data = self._decode(self.client.get(key))
+            if cached_data and datetime.fromisoformat(cached_data['timestamp']) < cutoff_time:
+                self.client.delete(key)
+                cleared_count += 1
+        return cleared_count
+
+    def purge_job(self, job_id):
+        purged_count = 0
+        for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+            cached_data = self._decode(self.client.get(key))
+            if cached_data and str(cached_data.get('job_id')) == str(job_id):
+                self.client.delete(key)
+                purged_count += 1
+        return purged_count
+
+    def purge_prompt_version(self, prompt_version):
+        purged_count = 0
+        for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+            cached_data = self._decode(self.client.get(key))
+            if cached_data and cached_data.get('prompt_version') == prompt_version:
+                self.client.delete(key)
+                purged_count += 1
+        return purged_count
+
+    def iter_metadata(self):
+        for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+            value = self.client.get(key)
+            cached_data = self._decode(value)
+            if not cached_data:
+                continue
+            yield {
+                'job_id': None if cached_data.get('job_id') is None else str(cached_data['job_id']),
+                'job_version': cached_data.get('job_version'),
+                'kind': cached_data.get('kind'),
+                'prompt_version': cached_data.get('prompt_version'),
+                'created_at': datetime.fromisoformat(cached_data['timestamp']).timestamp(),
+                'last_accessed': None,  # Redis controla o último acesso internamente (OBJECT IDLETIME)
+                'size': len(value)
+            }
+
+    def stats(self):
+        total_files = 0
+        total_size = 0
+        for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+            total_files += 1
+            total_size += self.client.strlen(key)
+        memory = self.client.info('memory')
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            'total_files': total_files,
+            'total_size': total_size,
+            'max_entries': None,
+            'max_size': memory.get('maxmemory') or None,
+            'evictions': self.client.info('stats').get('evicted_keys', 0),
+            **counters
+        }
+
+def create_shared_backend(cache_dir='cache'):
+    """Redis when REDIS_URL is set and reachable, otherwise the SQLite file in cache/"""
+    redis_url = os.environ.get('REDIS_URL')
+    if redis_url:
+        try:
+            import redis
+            client = redis.Redis.from_url(redis_url, socket_timeout=2, socket_connect_timeout=2)
+            client.ping()
+            print(f"🗄️ Cache compartilhado no Redis: {redis_url}")
+            return RedisCacheBackend(client)
+        except Exception as e:
+            print(f"⚠️ Redis indisponível para o cache ({e}), usando cache em disco")
+
+    if os.path.isdir(cache_dir) and any(filename.endswith('.json') for filename in os.listdir(cache_dir)):
+        print(f"ℹ️ Cache antigo em arquivos JSON encontrado em {cache_dir}/: não é lido pelo cache atual; para repovoar o cache use 'python -m services.cache_admin warm'")
+    return SQLiteCacheBackend(os.path.join(cache_dir, 'analysis_cache.db'))
+
+# Versão dos prompts de score e análise: alterar invalida as entradas de todas as vagas
+PROMPT_VERSION = 1
+
+# Política padrão de expiração (vagas podem sobrescrever, ver Job.get_cache_policy)
+DEFAULT_CACHE_TTL_HOURS = int(os.environ.get('ANALYSIS_CACHE_TTL_HOURS', 24))
+DEFAULT_CACHE_STALE_HOURS = int(os.environ.get('ANALYSIS_CACHE_STALE_HOURS', 24 * 6))
+
+def normalize_resume_text(text):
+    """Espaços e quebras de linha extras (variam entre extrações) não mudam o currículo"""
+    return ' '.join((text or '').split())
+
+def resume_content_hash(text):
+    return hashlib.sha256(normalize_resume_text(text).encode('utf-8')).hexdigest()
+
+def file_content_hash(file_path):
+    """SHA-256 of the uploaded file bytes (fast-path key, computed before any parsing)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_namespace(job, kind):
+    """
+    Retorna (namespace, job_id, job_version) da entrada
+    Para vagas, o namespace é a versão do conteúdo que entra nos prompts (não o ID): vagas
+    idênticas compartilham entradas e uma vaga editada deixa de encontrar as antigas.
+    Outros namespaces (ex: 'resume_profile:v1') são usados como estão.
+    """
+    if hasattr(job, 'get_content_version'):
+        job_version = job.get_content_version()
+        return f"job:{job_version}:{kind}:p{PROMPT_VERSION}", job.id, job_version
+    return f"{job}:{kind}", job, None
+
+# Cache negativo: falhas que se repetem sempre para o mesmo arquivo (por classe de erro, em horas)
+NEGATIVE_CACHE_TTL_HOURS = {
+    'extraction': int(os.environ.get('NEGATIVE_CACHE_TTL_HOURS', 24 * 7)),
+}
+
+# Faixas de idade das entradas (horas) usadas em AnalysisCache.describe
+AGE_BUCKETS = [('< 1h', 1), ('1h - 24h', 24), ('1 - 7 dias', 24 * 7), ('7 - 30 dias', 24 * 30), ('> 30 dias', None)]
+
+def cache_policy(job):
+    """(ttl_hours, stale_hours) das entradas da vaga, ou a política padrão"""
+    if hasattr(job, 'get_cache_policy'):
+        return job.get_cache_policy()
+    return DEFAULT_CACHE_TTL_HOURS, DEFAULT_CACHE_STALE_HOURS
+
+# Textos dos relatórios de fallback gravados antes das falhas de API serem propagadas
+FALLBACK_REPORT_MARKERS = ('ANÁLISE FALHOU: Erro técnico', 'Erro técnico na análise. Recomenda-se reprocessar',
+                           'Resposta da API muito curta')
+
+def is_cacheable_result(result):
+    """
+    Resultados com erro (error_class), sem score ou montados de um relatório de fallback nunca
+    entram no cache nem são servidos dele; resultados sem score (sugestões, perfis) não são afetados
+    """
+    if not isinstance(result, dict):
+        return result is not None
+    if result.get('error_class'):
+        return False
+    if 'score' not in result:
+        return True
+    if not (result['score'] or 0) > 0:
+        return False
+    report = f"{result.get('summary') or ''}\n{result.get('analysis') or ''}"
+    return not any(marker in report for marker in FALLBACK_REPORT_MARKERS)
+
+# Entrada do cache compartilhado com a época de invalidação (ver AnalysisCache._sync_epoch)
+EPOCH_CACHE_KEY = hashlib.sha256(b'analysis_cache:epoch').hexdigest()
+
 class AnalysisCache:
-    def __init__(self, cache_dir='cache'):
+    def __init__(self, cache_dir='cache', shared=None, local_max_entries=512, local_ttl_seconds=300,
+                 epoch_check_seconds=5):
         self.cache_dir = cache_dir
-        if not os.path.exists(cache_dir):
-            os.makedirs(cache_dir)
-    
-    def _get_cache_key(self, resume_text, job_id):
-        """Generate cache key from resume content and job ID"""
-        content = f"{resume_text}_{job_id}"
-        return hashlib.md5(content.encode()).hexdigest()
-    
-    def _get_cache_path(self, cache_key):
-        """Get file path for cache key"""
-        return os.path.join(self.cache_dir, f"{cache_key}.json")
-    
-    def get_cached_analysis(self, resume_text, job_id, max_age_hours=24):
+        self.local = LocalLRUCache(max_entries=local_max_entries, ttl_seconds=local_ttl_seconds)
+        self.shared = shared or create_shared_backend(cache_dir)
+        self.lock = threading.Lock()
+        self.epoch_check_seconds = epoch_check_seconds
+        self.epoch = None
+        self.epoch_checked_at = 0
+        self.counters = {'local_hits': 0, 'local_misses': 0, 'shared_hits': 0, 'shared_misses': 0, 'stale_hits': 0,
+                         'failures_cached': 0, 'local_invalidations': 0}
+
+    def _sync_epoch(self):
+        """Clear the local tier when another process bumped the shared epoch (checked every epoch_check_seconds)"""
+        now = time.time()
+        with self.lock:
+            if now - self.epoch_checked_at < self.epoch_check_seconds:
+                return
+            self.epoch_checked_at = now
+
+        try:
+            cached_data = self.shared.get(EPOCH_CACHE_KEY)
+        except Exception as e:
+            print(f"Cache epoch read error: {e}")
+            return
+        epoch = cached_data['analysis']['epoch'] if cached_data else None
+
+        with self.lock:
+            changed = epoch != self.epoch
+            self.epoch = epoch
+        if changed:
+            self.local.clear()
+            self._count('local_invalidations')
+
+    def _bump_epoch(self):
+        """Removal done: clear the local tier and make the other workers clear theirs"""
+        self.local.clear()
+        epoch = uuid.uuid4().hex
+        try:
+            self.shared.set(EPOCH_CACHE_KEY, {
+                'timestamp': datetime.now().isoformat(),
+                'analysis': {'epoch': epoch},
+                'job_id': None,
+                'job_version': None,
+                'kind': 'cache_epoch',
+                'cache_key': EPOCH_CACHE_KEY
+            })
+            with self.lock:
+                self.epoch = epoch
+        except Exception as e:
+            print(f"Cache epoch write error: {e}")
+
+    def _get_cache_key(self, resume_text, namespace):
+        """Generate cache key from the normalized resume content and the namespace (see cache_namespace)"""
+        content = f"{resume_content_hash(resume_text)}|{namespace}"
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _count(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def _lookup(self, cache_key):
+        """Local tier first, then the shared tier (promoting the entry to the local tier)"""
+        self._sync_epoch()
+        cached_data = self.local.get(cache_key)
+        if cached_data is not None:
+            self._count('local_hits')
+            return cached_data
+        self._count('local_misses')
+
+        cached_data = self.shared.get(cache_key)
+        if cached_data is None:
+            self._count('shared_misses')
+            return None
+        self._count('shared_hits')
+        self.local.set(cache_key, cached_data)
+        return cached_data
+
+    def _file_index_key(self, file_hash, namespace):
+        return hashlib.sha256(f"file:{file_hash}|{namespace}".encode('utf-8')).hexdigest()
+
+    def _read_entry(self, cache_key, max_age_hours=None, allow_stale=False):
+        """
+        Cached result for the key, or None if missing or expired
+        max_age_hours overrides the entry policy (hard expiry, no stale window)
+        With allow_stale, an entry past its TTL but inside the stale window is returned
+        with 'cache_stale': True so the caller can schedule a refresh
+        """
+        cached_data = self._lookup(cache_key)
+        if cached_data is None:
+            return None
+
+        # Falha gravada por versões anteriores: removida em vez de servida até o fim da janela stale
+        if cached_data.get('kind') != 'failure' and not is_cacheable_result(cached_data['analysis']):
+            self.local.delete(cache_key)
+            self.shared.delete(cache_key)
+            return None
+
+        if max_age_hours is not None:
+            ttl_hours, stale_hours = max_age_hours, 0
+        else:
+            ttl_hours = cached_data.get('ttl_hours', DEFAULT_CACHE_TTL_HOURS)
+            stale_hours = cached_data.get('stale_hours', DEFAULT_CACHE_STALE_HOURS)
+
+        # Check if cache is still valid
+        age = datetime.now() - datetime.fromisoformat(cached_data['timestamp'])
+        if age > timedelta(hours=ttl_hours + stale_hours):
+            # Cache expired, remove from both tiers
+            self.local.delete(cache_key)
+            self.shared.delete(cache_key)
+            return None
+
+        is_stale = age > timedelta(hours=ttl_hours)
+        if is_stale and not allow_stale:
+            return None
+
+        # Copy: entries in the local tier are shared by every caller in the process
+        result = copy.deepcopy(cached_data['analysis'])
+        if is_stale:
+            self._count('stale_hits')
+            result['cache_stale'] = True
+        return result
+
+    def _store(self, cache_key, cached_data, ttl_hours):
+        self.shared.set(cache_key, cached_data, ttl_seconds=int(ttl_hours * 3600))
+        self.local.set(cache_key, cached_data)
+
+    def get_cached_analysis(self, resume_text, job, max_age_hours=None, kind='analysis', allow_stale=False):
         """
         Get cached analysis if available and not expired
-        Returns None if cache miss or expired
+        job is a Job (key follows its prompt content) or a namespace string
+        Returns None if cache miss or expired (see _read_entry for stale entries)
         """
         try:
-            cache_key = self._get_cache_key(resume_text, job_id)
-            cache_path = self._get_cache_path(cache_key)
-            
-            if not os.path.exists(cache_path):
-                return None
-            
-            with open(cache_path, 'r', encoding='utf-8') as f:
-                cached_data = json.load(f)
-            
-            # Check if cache is still valid
-            cached_time = datetime.fromisoformat(cached_data['timestamp'])
-            if datetime.now() - cached_time > timedelta(hours=max_age_hours):
-                # Cache expired, remove file
-                os.remove(cache_path)
+            namespace, _, _ = cache_namespace(job, kind)
+            return self._read_entry(self._get_cache_key(resume_text, namespace), max_age_hours, allow_stale)
+
+        except Exception as e:
+            print(f"Cache read error: {e}")
+            return None
+
+    def get_cached_analysis_by_file(self, file_hash, job, max_age_hours=None, kind='analysis', allow_stale=False):
+        """
+        Fast path checked before text extraction: (file hash, job version) points to the
+        entry keyed by the extracted text (see index_file)
+        """
+        try:
+            namespace, _, _ = cache_namespace(job, kind)
+            index = self._lookup(self._file_index_key(file_hash, namespace))
+            if index is None:
                 return None
-            
-            return cached_data['analysis']
-            
+            return self._read_entry(index['analysis']['cache_key'], max_age_hours, allow_stale)
+
         except Exception as e:
             print(f"Cache read error: {e}")
             return None
-    
-    def cache_analysis(self, resume_text, job_id, analysis_result):
-        """Cache analysis result"""
+
+    def index_file(self, file_hash, resume_text, job, kind='analysis'):
+        """
+        Point (file hash, job version) to the entry cached for the extracted text
+        Only an existing valid entry is indexed (see is_cacheable_result)
+        """
         try:
-            cache_key = self._get_cache_key(resume_text, job_id)
-            cache_path = self._get_cache_path(cache_key)
-            
-            cached_data = {
+            namespace, job_id, job_version = cache_namespace(job, kind)
+            ttl_hours, stale_hours = cache_policy(job)
+            cache_key = self._get_cache_key(resume_text, namespace)
+            if self._read_entry(cache_key, allow_stale=True) is None:
+                return False
+            index_key = self._file_index_key(file_hash, namespace)
+            self._store(index_key, {
                 'timestamp': datetime.now().isoformat(),
+                'analysis': {'cache_key': cache_key},
+                'job_id': job_id,
+                'job_version': job_version,
+                'kind': f'{kind}_file_index',
+                'cache_key': index_key
+            }, ttl_hours + stale_hours)
+            return True
+
+        except Exception as e:
+            print(f"Cache write error: {e}")
+            return False
+
+    def _failure_key(self, file_hash):
+        return hashlib.sha256(f"failure:{file_hash}".encode('utf-8')).hexdigest()
+
+    def get_cached_failure(self, file_hash):
+        """
+        Known failure of the file (negative cache), independent of the job
+        Returns {'error_class', 'reason', 'failed_at'} or None
+        """
+        try:
+            return self._read_entry(self._failure_key(file_hash))
+
+        except Exception as e:
+            print(f"Cache read error: {e}")
+            return None
+
+    def cache_failure(self, file_hash, error_class, reason):
+        """Record a failure of the file; only classes in NEGATIVE_CACHE_TTL_HOURS are cached"""
+        ttl_hours = NEGATIVE_CACHE_TTL_HOURS.get(error_class)
+        if not ttl_hours:
+            return False
+
+        try:
+            cache_key = self._failure_key(file_hash)
+            now = datetime.now().isoformat()
+            self._store(cache_key, {
+                'timestamp': now,
+                'analysis': {'error_class': error_class, 'reason': reason, 'failed_at': now},
+                'job_id': None,
+                'job_version': None,
+                'kind': 'failure',
+                'ttl_hours': ttl_hours,
+                'stale_hours': 0,
+                'cache_key': cache_key
+            }, ttl_hours)
+            self._count('failures_cached')
+            return True
+
+        except Exception as e:
+            print(f"Cache write error: {e}")
+            return False
+
+    def forget_failure(self, file_hash):
+        """Remove the known failure of the file (forced retry)"""
+        cache_key = self._failure_key(file_hash)
+        self.shared.delete(cache_key)
+        self._bump_epoch()
+
+    def cache_analysis(self, resume_text, job, analysis_result, kind='analysis', timestamp=None, ttl_hours=None):
+        """
+        Cache analysis result with the job expiry policy (cache_policy)
+        The shared tier keeps the entry until the end of the stale window
+        timestamp (naive local datetime) backdates imported analyses (see cache_admin.warm_cache)
+        ttl_hours overrides the policy (no stale window), for namespaces read with a fixed max_age_hours
+        Failed results are not cached (see is_cacheable_result)
+        """
+        if not is_cacheable_result(analysis_result):
+            print(f"Cache write skipped: failed {kind} result")
+            return False
+
+        try:
+            namespace, job_id, job_version = cache_namespace(job, kind)
+            cache_key = self._get_cache_key(resume_text, namespace)
+            ttl_hours, stale_hours = (ttl_hours, 0) if ttl_hours else cache_policy(job)
+
+            cached_data = {
+                'timestamp': (timestamp or datetime.now()).isoformat(),
                 'analysis': analysis_result,
                 'job_id': job_id,
+                'job_version': job_version,
+                'kind': kind,
+                'prompt_version': PROMPT_VERSION if job_version else None,
+                'ttl_hours': ttl_hours,
+                'stale_hours': stale_hours,
                 'cache_key': cache_key
             }
-            
-            with open(cache_path, 'w', encoding='utf-8') as f:
-                json.dump(cached_data, f, indent=2, ensure_ascii=False)
-            
+
+            self._store(cache_key, cached_data, ttl_hours + stale_hours)
+
             return True
-            
+
         except Exception as e:
             print(f"Cache write error: {e}")
             return False
-    
+
     def clear_cache(self, older_than_hours=24):
-        """Clear cache files older than specified hours"""
+        """
+        Clear cache entries older than specified hours
+        Routine cleanup is automatic (entry expiry and the size budget of the shared tier)
+        """
         try:
             cutoff_time = datetime.now() - timedelta(hours=older_than_hours)
-            cleared_count = 0
-            
-            for filename in os.listdir(self.cache_dir):
-                if filename.endswith('.json'):
-                    filepath = os.path.join(self.cache_dir, filename)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            cached_data = json.load(f)
-                        
-                        cached_time = datetime.fromisoformat(cached_data['timestamp'])
-                        if cached_time < cutoff_time:
-                            os.remove(filepath)
-                            cleared_count += 1
-                            
-                    except Exception:
-                        # If file is corrupted, remove it
-                        os.remove(filepath)
-                        cleared_count += 1
-            
+            cleared_count = self.shared.clear_older_than(cutoff_time)
+            self._bump_epoch()
             return cleared_count
-            
+
         except Exception as e:
             print(f"Cache clear error: {e}")
             return 0
-    
+
+    def purge_job(self, job_id):
+        """Remove all cached entries of a job"""
+        try:
+            purged_count = self.shared.purge_job(job_id)
+            self._bump_epoch()
+            return purged_count
+
+        except Exception as e:
+            print(f"Cache purge error: {e}")
+            return 0
+
+    def purge_prompt_version(self, prompt_version):
+        """Remove all cached entries generated with a prompt version"""
+        try:
+            purged_count = self.shared.purge_prompt_version(prompt_version)
+            self._bump_epoch()
+            return purged_count
+
+        except Exception as e:
+            print(f"Cache purge error: {e}")
+            return 0
+
+    def purge_outdated_prompts(self):
+        """Remove entries of every prompt version other than PROMPT_VERSION (unreachable anyway)"""
+        versions = {entry['prompt_version'] for entry in self.shared.iter_metadata()}
+        return sum(self.purge_prompt_version(version) for version in versions
+                   if version is not None and version != PROMPT_VERSION)
+
+    def describe(self):
+        """
+        Conteúdo do cache compartilhado: entradas por vaga (e tipo), por versão do prompt
+        e distribuição de idade
+        """
+        now = time.time()
+        by_job = {}
+        by_prompt_version = {}
+        age_distribution = OrderedDict((label, 0) for label, _ in AGE_BUCKETS)
+
+        for entry in self.shared.iter_metadata():
+            if entry['kind'] == 'cache_epoch':
+                continue
+            job = by_job.setdefault(entry['job_id'], {
+                'job_id': entry['job_id'], 'entries': 0, 'size': 0, 'kinds': {}, 'versions': set(),
+                'oldest': None, 'newest': None, 'last_accessed': None
+            })
+            job['entries'] += 1
+            job['size'] += entry['size']
+            job['kinds'][entry['kind'] or 'unknown'] = job['kinds'].get(entry['kind'] or 'unknown', 0) + 1
+            if entry['job_version']:
+                job['versions'].add(entry['job_version'])
+            job['oldest'] = min(job['oldest'] or entry['created_at'], entry['created_at'])
+            job['newest'] = max(job['newest'] or entry['created_at'], entry['created_at'])
+            job['last_accessed'] = max(job['last_accessed'] or 0, entry['last_accessed'] or 0) or None
+
+            version_key = str(entry['prompt_version']) if entry['prompt_version'] is not None else 'none'
+            by_prompt_version[version_key] = by_prompt_version.get(version_key, 0) + 1
+
+            age_hours = (now - entry['created_at']) / 3600
+            label = next(label for label, limit in AGE_BUCKETS if limit is None or age_hours < limit)
+            age_distribution[label] += 1
+
+        jobs = []
+        for job in sorted(by_job.values(), key=lambda item: item['size'], reverse=True):
+            job['versions'] = len(job['versions'])
+            for field in ('oldest', 'newest', 'last_accessed'):
+                job[field] = datetime.fromtimestamp(job[field]).isoformat() if job[field] else None
+            jobs.append(job)
+
+        return {
+            'by_job': jobs,
+            'by_prompt_version': by_prompt_version,
+            'current_prompt_version': PROMPT_VERSION,
+            'age_distribution': age_distribution
+        }
+
     def get_cache_stats(self):
-        """Get cache statistics"""
+        """Get cache statistics (entries per tier and hit/miss counters)"""
+        with self.lock:
+            counters = dict(self.counters)
+
         try:
-            cache_files = [f for f in os.listdir(self.cache_dir) if f.endswith('.json')]
-            total_size = 0
-            
-            for filename in cache_files:
-                filepath = os.path.join(self.cache_dir, filename)
-                total_size += os.path.getsize(filepath)
-            
-            return {
-                'total_files': len(cache_files),
-                'total_size_mb': round(total_size / (1024 * 1024), 2),
-                'cache_dir': self.cache_dir
-            }
-            
+            shared_stats = self.shared.stats()
         except Exception as e:
             print(f"Cache stats error: {e}")
-            return {'total_files': 0, 'total_size_mb': 0, 'cache_dir': self.cache_dir}
+            shared_stats = {'total_files': 0, 'total_size': 0}
+
+        lookups = counters['local_hits'] + counters['local_misses']
+        raw_bytes_written = shared_stats.get('raw_bytes_written', 0)
+        return {
+            'total_files': shared_stats['total_files'],
+            'total_size_mb': round(shared_stats['total_size'] / (1024 * 1024), 2),
+            'max_entries': shared_stats.get('max_entries'),
+            'max_size_mb': round(shared_stats['max_size'] / (1024 * 1024), 2) if shared_stats.get('max_size') else None,
+            'evictions': shared_stats.get('evictions', 0),
+            'expired': shared_stats.get('expired', 0),
+            'bytes_evicted': shared_stats.get('bytes_evicted', 0),
+            'bytes_written': shared_stats.get('bytes_written', 0),
+            'compression_ratio': round(shared_stats['bytes_written'] / raw_bytes_written, 3) if raw_bytes_written else None,
+            'hit_ratio': round((counters['local_hits'] + counters['shared_hits']) / lookups, 3) if lookups else None,
+            'cache_dir': self.cache_dir,
+            'shared_backend': self.shared.name,
+            'local_entries': len(self.local),
+            **counters
+        }
 
 # Global cache instance
-analysis_cache = AnalysisCache()
\ No newline at end of file
+analysis_cache = AnalysisCache()
@@ -0,0 +1,243 @@
+"""
+Armazenamento do cache de análises em um único arquivo SQLite (modo WAL)
+
+Substitui o diretório cache/ com um JSON por entrada: cada entrada é uma linha com chave,
+vaga, versão da vaga, data de criação, tamanho e o conteúdo comprimido (zlib). Expiração,
+estatísticas e limpeza por vaga viram consultas indexadas, sem abrir arquivo por arquivo.
+
+O arquivo tem orçamento de bytes e de entradas (ANALYSIS_CACHE_MAX_MB, ANALYSIS_CACHE_MAX_ENTRIES):
+ao passar do limite, as entradas vencidas são removidas e depois as menos acessadas (LRU pelo
+último acesso, não pela data de criação), até 90% do orçamento.
+
+Os arquivos JSON do cache antigo usam chaves (md5 do texto + ID da vaga) que o formato atual nunca
+consulta e não são importados: para repovoar o cache a partir das análises salvas dos candidatos,
+use python -m services.cache_admin warm [job_id].
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    cache_key TEXT PRIMARY KEY,
+    job_id TEXT,
+    job_version TEXT,
+    created_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    payload BLOB NOT NULL,
+    last_accessed REAL,
+    expires_at REAL,
+    kind TEXT,
+    prompt_version INTEGER
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_created_at ON analysis_cache (created_at);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_job ON analysis_cache (job_id, job_version);
+"""
+
+# Colunas adicionadas depois da primeira versão do arquivo (bancos existentes recebem ALTER TABLE)
+MIGRATIONS = {
+    'last_accessed': 'ALTER TABLE analysis_cache ADD COLUMN last_accessed REAL',
+    'expires_at': 'ALTER TABLE analysis_cache ADD COLUMN expires_at REAL',
+    'kind': 'ALTER TABLE analysis_cache ADD COLUMN kind TEXT',
+    'prompt_version': 'ALTER TABLE analysis_cache ADD COLUMN prompt_version INTEGER',
+}
+
+INDEXES = """
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_last_accessed ON analysis_cache (last_accessed);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_expires_at ON analysis_cache (expires_at);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_prompt_version ON analysis_cache (prompt_version);
+"""
+
+MAX_CACHE_BYTES = int(float(os.environ.get('ANALYSIS_CACHE_MAX_MB', 256)) * 1024 * 1024)
+MAX_CACHE_ENTRIES = int(os.environ.get('ANALYSIS_CACHE_MAX_ENTRIES', 50000))
+
+# Leituras só regravam last_accessed depois desse intervalo (evita uma escrita por acerto)
+ACCESS_RESOLUTION_SECONDS = 60
+
+def compress_entry(cached_data):
+    return zlib.compress(json.dumps(cached_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+def decompress_entry(payload):
+    return json.loads(zlib.decompress(payload).decode('utf-8'))
+
+class SQLiteCacheBackend:
+    """Shared tier on a single SQLite file, shared by the workers of the same node"""
+    name = 'sqlite'
+
+    def __init__(self, db_path='cache/analysis_cache.db', max_bytes=MAX_CACHE_BYTES, max_entries=MAX_CACHE_ENTRIES,
+                 check_every=50):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.check_every = check_every  # Escritas entre verificações do orçamento
+        directory = os.path.dirname(db_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.writes_since_check = 0
+        self.counters = {'evictions': 0, 'expired': 0, 'bytes_evicted': 0, 'bytes_written': 0, 'raw_bytes_written': 0}
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(analysis_cache)')}
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    connection.execute(statement)
+            connection.execute('UPDATE analysis_cache SET last_accessed = created_at WHERE last_accessed IS NULL')
+            connection.executescript(INDEXES)
+            if 'kind' not in columns:
+                self._backfill_metadata(connection)
+        self.enforce_budget()
+
+    def _backfill_metadata(self, connection):
+        """Preenche kind e prompt_version das entradas gravadas antes dessas colunas existirem"""
+        rows = connection.execute('SELECT cache_key, payload FROM analysis_cache WHERE kind IS NULL').fetchall()
+        for cache_key, payload in rows:
+            cached_data = decompress_entry(payload)
+            connection.execute(
+                'UPDATE analysis_cache SET kind = ?, prompt_version = ? WHERE cache_key = ?',
+                (cached_data.get('kind'), cached_data.get('prompt_version'), cache_key)
+            )
+
+    def _connection(self):
+        """One connection per thread (sqlite3 connections are not shared between threads)"""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, cache_key):
+        row = self._connection().execute(
+            'SELECT payload, last_accessed FROM analysis_cache WHERE cache_key = ?', (cache_key,)
+        ).fetchone()
+        if not row:
+            return None
+
+        now = time.time()
+        if (row[1] or 0) < now - ACCESS_RESOLUTION_SECONDS:
+            with self._connection() as connection:
+                connection.execute('UPDATE analysis_cache SET last_accessed = ? WHERE cache_key = ?', (now, cache_key))
+        return decompress_entry(row[0])
+
+    def set(self, cache_key, cached_data, ttl_seconds=None):
+        raw_size = len(json.dumps(cached_data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+        payload = compress_entry(cached_data)
+        created_at = datetime.fromisoformat(cached_data['timestamp']).timestamp()
+        expires_at = created_at + ttl_seconds if ttl_seconds else None
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO analysis_cache '
+                '(cache_key, job_id, job_version, created_at, size, payload, last_accessed, expires_at, kind, prompt_version) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (cache_key, str(cached_data.get('job_id')), cached_data.get('job_version'), created_at,
+                 len(payload), payload, time.time(), expires_at, cached_data.get('kind'), cached_data.get('prompt_version'))
+            )
+
+        with self.lock:
+            self.counters['bytes_written'] += len(payload)
+            self.counters['raw_bytes_written'] += raw_size
+            self.writes_since_check += 1
+            check_budget = self.writes_since_check >= self.check_every
+            if check_budget:
+                self.writes_since_check = 0
+        if check_budget:
+            self.enforce_budget()
+
+    def enforce_budget(self):
+        """
+        Remove as entradas vencidas e, se o arquivo ainda passar do orçamento, as menos acessadas
+        até 90% do limite de bytes e de entradas. Retorna a quantidade removida
+        """
+        connection = self._connection()
+        with connection:
+            expired = connection.execute(
+                'DELETE FROM analysis_cache WHERE expires_at IS NOT NULL AND expires_at < ?', (time.time(),)
+            ).rowcount
+
+        total_entries, total_bytes = connection.execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache'
+        ).fetchone()
+
+        evicted_keys, evicted_bytes = [], 0
+        if total_entries > self.max_entries or total_bytes > self.max_bytes:
+            target_entries = int(self.max_entries * 0.9)
+            target_bytes = int(self.max_bytes * 0.9)
+            for cache_key, size in connection.execute(
+                'SELECT cache_key, size FROM analysis_cache ORDER BY last_accessed'
+            ).fetchall():
+                if total_entries - len(evicted_keys) <= target_entries and total_bytes - evicted_bytes <= target_bytes:
+                    break
+                evicted_keys.append(cache_key)
+                evicted_bytes += size
+
+            with connection:
+                connection.executemany('DELETE FROM analysis_cache WHERE cache_key = ?', [(key,) for key in evicted_keys])
+            print(f"🧹 Cache de análises acima do orçamento: {len(evicted_keys)} entradas menos acessadas removidas "
+                  f"({evicted_bytes / (1024 * 1024):.1f} MB)")
+
+        with self.lock:
+            self.counters['expired'] += expired
+            self.counters['evictions'] += len(evicted_keys)
+            self.counters['bytes_evicted'] += evicted_bytes
+
+        return expired + len(evicted_keys)
+
+    def delete(self, cache_key):
+        with self._connection() as connection:
+            connection.execute('DELETE FROM analysis_cache WHERE cache_key = ?', (cache_key,))
+
+    def clear_older_than(self, cutoff_time):
+        with self._connection() as connection:
+            return connection.execute(
+                'DELETE FROM analysis_cache WHERE created_at < ?', (cutoff_time.timestamp(),)
+            ).rowcount
+
+    def purge_job(self, job_id):
+        """Remove every entry of a job (analyses and scores)"""
+        with self._connection() as connection:
+            return connection.execute('DELETE FROM analysis_cache WHERE job_id = ?', (str(job_id),)).rowcount
+
+    def purge_prompt_version(self, prompt_version):
+        """Remove the entries generated with a prompt version"""
+        with self._connection() as connection:
+            return connection.execute(
+                'DELETE FROM analysis_cache WHERE prompt_version = ?', (prompt_version,)
+            ).rowcount
+
+    def iter_metadata(self):
+        """Metadados de cada entrada, sem ler o conteúdo (administração do cache)"""
+        rows = self._connection().execute(
+            'SELECT job_id, job_version, kind, prompt_version, created_at, last_accessed, size FROM analysis_cache'
+        ).fetchall()
+        for job_id, job_version, kind, prompt_version, created_at, last_accessed, size in rows:
+            yield {
+                'job_id': None if job_id in (None, 'None') else job_id,
+                'job_version': job_version,
+                'kind': kind,
+                'prompt_version': prompt_version,
+                'created_at': created_at,
+                'last_accessed': last_accessed,
+                'size': size
+            }
+
+    def stats(self):
+        total_files, total_size = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis_cache'
+        ).fetchone()
+        with self.lock:
+            counters = dict(self.counters)
+        return {
+            'total_files': total_files,
+            'total_size': total_size,
+            'max_entries': self.max_entries,
+            'max_size': self.max_bytes,
+            **counters
+        }
+
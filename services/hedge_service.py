@@ -0,0 +1,123 @@
+"""
+Hedging das chamadas à IA (controle da latência de cauda)
+
+Quando uma chamada passa do p95 observado para a sua finalidade, uma cópia é enviada e vale
+a resposta que chegar primeiro. A outra é cancelada (ou, se já estiver em andamento, tem o
+resultado descartado) e o seu custo é registrado na telemetria como 'cancelled'.
+
+Um orçamento global limita as cópias a uma fração das chamadas, para que o hedging não
+dobre a carga sobre a API justamente quando ela está lenta.
+Ativado com a variável de ambiente LLM_HEDGING=1.
+"""
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+logger = logging.getLogger(__name__)
+
+LLM_HEDGING_ENABLED = os.environ.get('LLM_HEDGING', '').lower() in ('1', 'true', 'yes')
+
+# Finalidades em que vale duplicar a chamada (respostas curtas e muito frequentes)
+HEDGE_PURPOSES = {'score', 'score_batch', 'analysis'}
+
+class RequestHedger:
+    def __init__(self, enabled=False, purposes=(), window=200, min_samples=20,
+                 budget_ratio=0.05, burst=2, max_in_flight=4, max_workers=16):
+        self.enabled = enabled
+        self.purposes = set(purposes)
+        self.window = window
+        self.min_samples = min_samples
+        self.budget_ratio = budget_ratio  # Cópias permitidas por chamada
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.latencies = {}
+        self.calls = 0
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm-hedge')
+        self.stats = {'hedged': 0, 'hedge_won': 0, 'primary_won': 0, 'denied': 0, 'cancelled': 0}
+
+    def observe(self, purpose, latency_ms):
+        """Registra a latência de uma tentativa concluída com sucesso"""
+        with self.lock:
+            self.latencies.setdefault(purpose, deque(maxlen=self.window)).append(latency_ms)
+
+    def hedge_delay(self, purpose):
+        """p95 observado (s) a partir do qual a chamada é duplicada, ou None sem amostras suficientes"""
+        if not self.enabled or purpose not in self.purposes:
+            return None
+        with self.lock:
+            samples = sorted(self.latencies.get(purpose, ()))
+        if len(samples) < self.min_samples:
+            return None
+        return samples[int(0.95 * (len(samples) - 1))] / 1000
+
+    def _acquire_budget(self):
+        with self.lock:
+            if self.in_flight >= self.max_in_flight or self.stats['hedged'] >= self.budget_ratio * self.calls + self.burst:
+                self.stats['denied'] += 1
+                return False
+            self.in_flight += 1
+            self.stats['hedged'] += 1
+            return True
+
+    def _release_budget(self, _future=None):
+        with self.lock:
+            self.in_flight -= 1
+
+    def run(self, purpose, call, on_cancelled):
+        """
+        Executa call() com hedging
+        on_cancelled(response, error) recebe o resultado da cópia descartada (custo do hedge)
+        Retorna (resposta, se a chamada foi duplicada)
+        """
+        delay = self.hedge_delay(purpose)
+        with self.lock:
+            self.calls += 1
+        if delay is None:
+            return call(), False
+
+        primary = self.executor.submit(call)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._acquire_budget():
+            return primary.result(), False
+
+        hedge = self.executor.submit(call)
+        hedge.add_done_callback(self._release_budget)
+        print(f"🪝 Chamada '{purpose}' passou do p95 ({delay:.1f}s), enviando cópia")
+
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner:
+                loser = hedge if winner is primary else primary
+                with self.lock:
+                    self.stats['hedge_won' if winner is hedge else 'primary_won'] += 1
+                self._cancel(loser, on_cancelled)
+                return winner.result(), True
+            error = error or next(iter(done)).exception()
+
+        raise error
+
+    def _cancel(self, future, on_cancelled):
+        """Cancela a cópia perdedora; se já estiver em andamento, registra o custo quando terminar"""
+        with self.lock:
+            self.stats['cancelled'] += 1
+        if future.cancel():
+            return
+
+        def record(finished):
+            try:
+                error = finished.exception()
+                on_cancelled(None if error else finished.result(), error)
+            except Exception as e:
+                logger.warning(f"Could not record cancelled hedge: {str(e)}")
+
+        future.add_done_callback(record)
+
+# Global hedger for LLM calls
+request_hedger = RequestHedger(enabled=LLM_HEDGING_ENABLED, purposes=HEDGE_PURPOSES)
@@ -0,0 +1,123 @@
+"""
+Resumo canônico (digest) da vaga usado nos prompts de análise
+
+Descrições longas (ex: DCF - Documento de Conteúdo Funcional) eram cortadas em
+300/500/1000 caracteres a cada candidato, e a IA perdia boa parte dos requisitos.
+O digest é gerado uma única vez, em segundo plano depois que a vaga é salva (ou
+pelo processamento, o que vier primeiro): uma lista compacta e sem
+repetições dos requisitos, montada localmente e condensada com uma chamada à IA
+apenas quando ainda for longa demais. Ele fica salvo na vaga junto com o hash do
+conteúdo e só é gerado novamente quando o texto da vaga muda.
+"""
+import hashlib
+import logging
+import re
+import threading
+
+from services.prescreen_service import normalize_text
+
+# Versão do formato do digest - incrementar ao alterar as regras abaixo
+JOB_DIGEST_VERSION = 1
+
+# Tamanho máximo do digest enviado em cada prompt
+JOB_DIGEST_MAX_CHARS = 1800
+
+DIGEST_SPLIT_PATTERN = re.compile(r'[\n•*;]+|(?<=[.!?])\s+(?=[A-ZÁÉÍÓÚÂÊÔÃÕÇ])')
+
+def compute_job_digest_hash(job):
+    """Hash do conteúdo da vaga que entra nos prompts (título, descrição e requisitos)"""
+    content = f"{JOB_DIGEST_VERSION}\x00{job.title or ''}\x00{job.description or ''}\x00{job.requirements or ''}"
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+def build_local_digest(description, requirements):
+    """
+    Monta a lista canônica de requisitos: um item por linha, sem marcadores,
+    espaços repetidos ou itens duplicados (requisitos primeiro, depois a descrição)
+    """
+    lines = []
+    seen = set()
+
+    for source in (requirements, description):
+        for raw_item in DIGEST_SPLIT_PATTERN.split(source or ''):
+            item = ' '.join(raw_item.split()).strip(' -–.')
+            if len(item) < 3:
+                continue
+
+            key = normalize_text(item).rstrip(':')
+            if key in seen:
+                continue
+            seen.add(key)
+
+            # Títulos de seção (ex: "Funções:", "Mínimo Exigido:") viram cabeçalhos
+            if item.endswith(':'):
+                lines.append(item)
+            else:
+                lines.append(f"- {item}")
+
+    return '\n'.join(lines)
+
+def condense_digest_with_ai(job, local_digest):
+    """Condensa com uma chamada à IA um digest local que ainda excede o limite"""
+    from services.llm_client import chat_completion
+
+    prompt = f"""
+Você é um recrutador sênior. Condense os requisitos da vaga '{job.title}' abaixo em uma lista canônica e compacta.
+
+REGRAS:
+- Mantenha TODOS os requisitos técnicos, de formação, experiência e idiomas
+- Indique "(obrigatório)" ou "(desejável)" quando o texto informar
+- Um requisito por linha, começando com "- ", sem repetições nem texto institucional
+- No máximo {JOB_DIGEST_MAX_CHARS} caracteres no total
+
+REQUISITOS DA VAGA:
+{local_digest[:12000]}
+"""
+
+    response = chat_completion(
+        'job_digest',
+        job=job,
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.1
+    )
+    return (response.choices[0].message.content or '').strip()
+
+def build_job_digest(job):
+    """Gera o digest da vaga (local, ou condensado pela IA quando for longo demais)"""
+    digest = build_local_digest(job.description, job.requirements)
+
+    if len(digest) > JOB_DIGEST_MAX_CHARS:
+        try:
+            condensed = condense_digest_with_ai(job, digest)
+            if condensed:
+                digest = condensed
+                print(f"🧾 Digest da vaga '{job.title}' condensado pela IA ({len(digest)} caracteres)")
+        except Exception as e:
+            logging.error(f"Error condensing digest for job {job.id}: {str(e)}")
+
+    return digest[:JOB_DIGEST_MAX_CHARS]
+
+def start_digest_refresh(job_id):
+    """
+    Gera o digest da vaga em segundo plano, depois do commit do formulário (a chamada à IA
+    não segura a requisição e a vaga já tem ID para a telemetria). O processamento também
+    gera o digest que ainda faltar (OptimizedProcessor.refresh_job_digests).
+    """
+    def digest_worker():
+        from app import app, db
+        from models.models import Job
+        from services.llm_client import llm_call_context
+
+        try:
+            with app.app_context():
+                job = db.session.get(Job, job_id)
+                if not job:
+                    return
+                with llm_call_context(job_id=job_id):
+                    updated = job.ensure_digest()
+                if updated:
+                    db.session.commit()
+                    print(f"🧾 Digest gerado para a vaga '{job.title}'")
+        except Exception as e:
+            logging.error(f"Error building digest for job {job_id}: {str(e)}", exc_info=True)
+
+    threading.Thread(target=digest_worker, daemon=True).start()
@@ -1,28 +1,386 @@
 """
 Serviço de sugestão de IA para criação de vagas
+
+As sugestões ficam no cache de análises pelo título normalizado, e o autocompletar de títulos
+responde de um índice de prefixos em memória (títulos das vagas existentes e sugestões já
+geradas); a IA só é chamada para prefixos sem resultados no índice nem no cache.
+
+A descrição e os requisitos também podem ser gerados em streaming (stream_job_suggestions), e um
+pedido mais novo da mesma sessão encerra a geração anterior, mesmo que esteja em outro worker.
 """
-import os
+import bisect
+import hashlib
 import logging
-from openai import OpenAI
-
-def get_openai_client():
-    """Get OpenAI client with proper API key loading"""
-    from dotenv import load_dotenv
-    load_dotenv()
-    
-    deepseek_api_key = os.environ.get("DEEPSEEK_API_KEY")
-    if not deepseek_api_key:
-        deepseek_api_key = os.environ.get("OPENAI_API_KEY")
-    
-    if not deepseek_api_key:
-        raise ValueError("DEEPSEEK_API_KEY ou OPENAI_API_KEY não encontrada")
-    
-    return OpenAI(
-        api_key=deepseek_api_key,
-        base_url="https://api.deepseek.com/v1"
+import threading
+import time
+import unicodedata
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from services.llm_client import chat_completion, stream_chat_completion
+from services.cache_service import analysis_cache
+
+# Versão dos prompts de sugestão: alterar invalida as sugestões em cache
+SUGGESTION_PROMPT_VERSION = 1
+JOB_SUGGESTION_CACHE_KEY = f"job_suggestion:v{SUGGESTION_PROMPT_VERSION}"
+TITLE_SUGGESTION_CACHE_KEY = f"job_title_suggestion:v{SUGGESTION_PROMPT_VERSION}"
+SUGGESTION_CACHE_HOURS = 24 * 30
+
+# Autocompletar: quantidade de títulos retornados e mínimo do índice para dispensar o cache e a IA
+TITLE_SUGGESTION_LIMIT = 5
+TITLE_INDEX_MIN_RESULTS = 3
+
+# Marcadores das seções no texto gerado em streaming (normalizados) -> campo da sugestão
+SUGGESTION_SECTIONS = {'descricao': 'description', 'requisitos': 'requirements'}
+
+def normalize_title(title):
+    """Minúsculas, sem acentos e sem espaços extras: 'Técnico  de TI' -> 'tecnico de ti'"""
+    text = unicodedata.normalize('NFKD', title or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(text.lower().split())
+
+class TitlePrefixIndex:
+    """
+    Índice ordenado de títulos para o autocompletar
+    Cada título entra uma vez por palavra ('auxiliar administrativo' e 'administrativo'),
+    então 'adm' também encontra 'Auxiliar Administrativo'. A busca é uma bisseção na lista
+    ordenada; os títulos das vagas são recarregados do banco a cada refresh_seconds.
+    Títulos de vagas e sugestões da IA ficam em conjuntos separados: a recarga substitui todos
+    os títulos de vagas (vagas excluídas ou renomeadas saem do índice) e mantém as sugestões.
+    """
+    def __init__(self, refresh_seconds=600):
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at = 0
+        self.keys = []  # (sufixo normalizado, título normalizado), ordenado
+        self.titles = {}  # título normalizado -> {'title': exibição, 'weight': vagas com o título (+1 se sugerido)}
+        self.job_titles = {}  # título normalizado -> {'title': exibição, 'weight': vagas com o título}
+        self.suggested_titles = {}  # título normalizado -> exibição (sugestões da IA)
+        self.lock = threading.Lock()
+
+    def add(self, title, weight=1, suggested=False):
+        """Inclui um título: vaga criada ou, com suggested=True, sugestão da IA"""
+        normalized = normalize_title(title)
+        if len(normalized) < 2:
+            return
+        display = ' '.join(title.split())
+        with self.lock:
+            if suggested:
+                self.suggested_titles.setdefault(normalized, display)
+            else:
+                entry = self.job_titles.setdefault(normalized, {'title': display, 'weight': 0})
+                entry['weight'] += weight
+            is_new = normalized not in self.titles
+            self.titles[normalized] = self._merged_entry(normalized)
+            if is_new:
+                words = normalized.split(' ')
+                for position in range(len(words)):
+                    bisect.insort(self.keys, (' '.join(words[position:]), normalized))
+
+    def _merged_entry(self, normalized):
+        job_entry = self.job_titles.get(normalized)
+        suggested = normalized in self.suggested_titles
+        return {
+            'title': job_entry['title'] if job_entry else self.suggested_titles[normalized],
+            'weight': (job_entry['weight'] if job_entry else 0) + (1 if suggested else 0)
+        }
+
+    def ensure_loaded(self):
+        """Carrega os títulos das vagas existentes (precisa do contexto da aplicação)"""
+        if time.time() - self.loaded_at < self.refresh_seconds:
+            return
+        self.loaded_at = time.time()
+        try:
+            from models.models import Job
+            job_titles = [title for (title,) in Job.query.with_entities(Job.title).all()]
+        except Exception as e:
+            logging.warning(f"Não foi possível carregar os títulos das vagas para o autocompletar: {e}")
+            return
+
+        counts = {}
+        for title in job_titles:
+            normalized = normalize_title(title)
+            if len(normalized) < 2:
+                continue
+            entry = counts.setdefault(normalized, {'title': ' '.join(title.split()), 'weight': 0})
+            entry['weight'] += 1
+
+        with self.lock:
+            # Os títulos de vagas são substituídos pelos do banco; as sugestões da IA são mantidas
+            self.job_titles = counts
+            self.titles = {normalized: self._merged_entry(normalized)
+                           for normalized in set(self.job_titles) | set(self.suggested_titles)}
+            self.keys = sorted(
+                (' '.join(words[position:]), normalized)
+                for normalized, words in ((normalized, normalized.split(' ')) for normalized in self.titles)
+                for position in range(len(words))
+            )
+
+    def search(self, prefix, limit=TITLE_SUGGESTION_LIMIT):
+        """Títulos com uma palavra começando por prefix, mais frequentes primeiro"""
+        normalized_prefix = normalize_title(prefix)
+        if not normalized_prefix:
+            return []
+        with self.lock:
+            start = bisect.bisect_left(self.keys, (normalized_prefix, ''))
+            matches = {}
+            for suffix, normalized in self.keys[start:]:
+                if not suffix.startswith(normalized_prefix):
+                    break
+                # Título começando pelo prefixo vem antes de um que só contém a palavra
+                rank = (suffix != normalized, -self.titles[normalized]['weight'], normalized)
+                matches[normalized] = min(rank, matches.get(normalized, rank))
+            ranked = sorted(matches, key=matches.get)[:limit]
+            return [self.titles[normalized]['title'] for normalized in ranked]
+
+# Global title index for autocomplete
+title_index = TitlePrefixIndex()
+
+def get_cached_job_suggestions(job_title):
+    """Sugestão de descrição e requisitos já gerada para o título (normalizado), ou None"""
+    return analysis_cache.get_cached_analysis(
+        normalize_title(job_title), JOB_SUGGESTION_CACHE_KEY, max_age_hours=SUGGESTION_CACHE_HOURS
+    )
+
+def cache_job_suggestions(job_title, suggestions):
+    """Guarda uma sugestão completa pelo título normalizado e inclui o título no índice"""
+    if not suggestions.get('success') or not suggestions.get('description') or not suggestions.get('requirements'):
+        return
+    analysis_cache.cache_analysis(
+        normalize_title(job_title), JOB_SUGGESTION_CACHE_KEY, suggestions, ttl_hours=SUGGESTION_CACHE_HOURS
     )
+    title_index.add(job_title, suggested=True)
 
 def generate_job_suggestions(job_title):
+    """
+    Sugestões de descrição e requisitos para o título, do cache quando o título já foi sugerido
+    """
+    cached = get_cached_job_suggestions(job_title)
+    if cached:
+        return cached
+
+    suggestions = _generate_job_suggestions(job_title)
+    cache_job_suggestions(job_title, suggestions)
+    return suggestions
+
+class SuggestionGeneration:
+    """Geração de sugestões em andamento de uma sessão; cancelled() indica se um pedido mais novo a substituiu"""
+    def __init__(self, registry, session_key, token):
+        self.registry = registry
+        self.session_key = session_key
+        self.token = token
+        self.event = threading.Event()
+        self.checked_at = time.time()
+
+    def cancelled(self):
+        if self.event.is_set():
+            return True
+        # A linha compartilhada é consultada no máximo a cada check_interval
+        if time.time() - self.checked_at >= self.registry.check_interval:
+            self.checked_at = time.time()
+            if self.registry.superseded_elsewhere(self):
+                self.event.set()
+        return self.event.is_set()
+
+    def finish(self):
+        self.registry.finish(self)
+
+class SuggestionStreamRegistry:
+    """
+    Uma geração de sugestões por sessão: um pedido novo da mesma sessão encerra o anterior
+    - Mesmo processo: o Event da geração anterior é sinalizado na hora
+    - Entre workers do gunicorn: a linha da sessão na tabela analysis_lock guarda o token da geração
+      mais recente; a geração que encontra outro token ali se encerra
+    """
+    def __init__(self, check_interval=0.5, lock_ttl_seconds=120):
+        self.check_interval = check_interval
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.lock = threading.Lock()
+        self.generations = {}
+        self.stats = {'started': 0, 'superseded': 0}
+
+    def start(self, session_key):
+        """Registra a geração mais recente da sessão e cancela a anterior"""
+        lock_key = 'job_suggestion:' + hashlib.sha1(session_key.encode('utf-8')).hexdigest()[:40]
+        generation = SuggestionGeneration(self, lock_key, uuid.uuid4().hex)
+        with self.lock:
+            previous = self.generations.get(lock_key)
+            self.generations[lock_key] = generation
+            self.stats['started'] += 1
+            if previous:
+                self.stats['superseded'] += 1
+        if previous:
+            previous.event.set()
+        self._claim_shared(generation)
+        return generation
+
+    def finish(self, generation):
+        with self.lock:
+            if self.generations.get(generation.session_key) is generation:
+                del self.generations[generation.session_key]
+        self._release_shared(generation)
+
+    def _claim_shared(self, generation):
+        """Grava o token da geração na linha da sessão; sem banco, o cancelamento fica restrito ao processo"""
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            now = datetime.utcnow()
+            for attempt in range(2):
+                try:
+                    with db.engine.begin() as connection:
+                        connection.execute(table.delete().where(table.c.lock_key == generation.session_key))
+                        connection.execute(table.insert().values(
+                            lock_key=generation.session_key,
+                            owner=generation.token,
+                            acquired_at=now,
+                            expires_at=now + timedelta(seconds=self.lock_ttl_seconds)
+                        ))
+                    return
+                except IntegrityError:
+                    # Pedido simultâneo da mesma sessão gravou entre a remoção e a inserção
+                    continue
+        except Exception as e:
+            logging.warning(f"Shared suggestion lock unavailable, cancelling in-process only: {str(e)}")
+
+    def superseded_elsewhere(self, generation):
+        """True quando outro worker registrou uma geração mais nova para a sessão"""
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            with db.engine.connect() as connection:
+                owner = connection.execute(
+                    select(table.c.owner).where(table.c.lock_key == generation.session_key)
+                ).scalar()
+            return owner is not None and owner != generation.token
+        except Exception as e:
+            logging.warning(f"Error checking shared suggestion lock: {str(e)}")
+            return False
+
+    def _release_shared(self, generation):
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.lock_key == generation.session_key)
+                                   .where(table.c.owner == generation.token))
+        except Exception as e:
+            logging.warning(f"Error releasing shared suggestion lock: {str(e)}")
+
+# Global registry of in-flight streamed suggestions
+suggestion_streams = SuggestionStreamRegistry()
+
+def split_suggestion_sections(text, partial=False):
+    """
+    Separa o texto gerado em streaming nas seções [DESCRICAO] e [REQUISITOS]
+    Com partial=True a última linha fica de fora enquanto ainda pode ser o início de um marcador,
+    então o texto de cada seção só cresce de uma chamada para a seguinte
+    """
+    lines = text.split('\n')
+    if partial and lines and any(name.startswith(section_marker(lines[-1])) for name in SUGGESTION_SECTIONS):
+        lines = lines[:-1]
+
+    sections = {field: [] for field in SUGGESTION_SECTIONS.values()}
+    current_section = None
+    for line in lines:
+        marker = section_marker(line)
+        if marker in SUGGESTION_SECTIONS:
+            current_section = SUGGESTION_SECTIONS[marker]
+        elif current_section:
+            sections[current_section].append(line)
+    return {field: '\n'.join(section_lines) for field, section_lines in sections.items()}
+
+def section_marker(line):
+    """'[Descrição]' -> 'descricao'"""
+    return normalize_title(line).strip('[]#*: ')
+
+def stream_job_suggestions(job_title, generation=None):
+    """
+    Streaming version of generate_job_suggestions
+    Yields ('chunk', {field, text}) as the description and requirements are generated,
+    ('replace', {field, text}) if text already sent changed, and finally ('result', suggestions)
+    When generation is superseded by a newer request of the same session, the AI stream is
+    closed and ('cancelled', None) is the last event
+    """
+    cached = get_cached_job_suggestions(job_title)
+    if cached:
+        yield 'result', {**cached, 'source': 'cache'}
+        return
+
+    if generation and generation.cancelled():
+        yield 'cancelled', None
+        return
+
+    prompt = f"""
+RH especialista. Vaga: "{job_title}"
+
+Responda exatamente neste formato, sem JSON nem markdown:
+[DESCRICAO]
+Descrição da vaga, responsabilidades e benefícios
+[REQUISITOS]
+MÍNIMO EXIGIDO:
+• Formação
+• Experiência
+• Conhecimentos técnicos
+• Habilidades
+
+DESEJÁVEL:
+• Formação extra
+• Experiência adicional
+• Soft skills
+• Certificações
+
+Seja direto, específico e profissional.
+"""
+    stream = stream_chat_completion(
+        'job_suggestion',
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.1
+    )
+    sent = {field: '' for field in SUGGESTION_SECTIONS.values()}
+    chunks = iter(stream)
+    try:
+        for _ in chunks:
+            if generation and generation.cancelled():
+                print(f"⏹️ Sugestões para '{job_title}' canceladas: a sessão fez um pedido mais novo")
+                yield 'cancelled', None
+                return
+
+            for field, text in split_suggestion_sections(stream.text, partial=True).items():
+                if text == sent[field]:
+                    continue
+                if text.startswith(sent[field]):
+                    yield 'chunk', {'field': field, 'text': text[len(sent[field]):]}
+                else:
+                    yield 'replace', {'field': field, 'text': text}
+                sent[field] = text
+    finally:
+        # Fecha a conexão com a IA: uma geração abandonada para de consumir tokens
+        chunks.close()
+
+    sections = split_suggestion_sections(stream.text)
+    if sections['description'].strip() and sections['requirements'].strip():
+        suggestions = {
+            'success': True,
+            'description': sections['description'].strip(),
+            'requirements': sections['requirements'].strip()
+        }
+    else:
+        logging.error(f"Resposta da IA fora do formato de seções: {stream.text}")
+        suggestions = extract_suggestions_manually(stream.text)
+
+    cache_job_suggestions(job_title, suggestions)
+    yield 'result', {**suggestions, 'source': 'llm'}
+
+def _generate_job_suggestions(job_title):
     """
     Gera sugestões de descrição e requisitos para uma vaga baseado no título
     """
@@ -39,13 +397,10 @@ Gere JSON rápido e completo:
 Seja direto, específico e profissional.
 """
 
-        openai = get_openai_client()
-        response = openai.chat.completions.create(
-            model="deepseek-chat",
+        response = chat_completion(
+            'job_suggestion',
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=600,
-            temperature=0.1,
-            timeout=25
+            temperature=0.1
         )
         
         result = response.choices[0].message.content.strip()
@@ -130,6 +485,46 @@ def extract_suggestions_manually(text):
         }
 
 def get_job_title_suggestions(partial_title):
+    """
+    Sugestões de títulos para o texto parcial: índice de prefixos primeiro (milissegundos),
+    depois as sugestões em cache para o prefixo e, por último, a IA
+    """
+    title_index.ensure_loaded()
+    indexed = title_index.search(partial_title)
+    if len(indexed) >= TITLE_INDEX_MIN_RESULTS:
+        return {'success': True, 'suggestions': indexed, 'source': 'index'}
+
+    normalized_prefix = normalize_title(partial_title)
+    cached = analysis_cache.get_cached_analysis(
+        normalized_prefix, TITLE_SUGGESTION_CACHE_KEY, max_age_hours=SUGGESTION_CACHE_HOURS
+    )
+    if cached:
+        return {'success': True, 'suggestions': merge_titles(indexed, cached['suggestions']), 'source': 'cache'}
+
+    suggestions = _get_job_title_suggestions(partial_title)
+    if suggestions['success'] and suggestions['suggestions']:
+        analysis_cache.cache_analysis(
+            normalized_prefix, TITLE_SUGGESTION_CACHE_KEY, {'suggestions': suggestions['suggestions']},
+            ttl_hours=SUGGESTION_CACHE_HOURS
+        )
+        for title in suggestions['suggestions']:
+            title_index.add(title, suggested=True)
+        suggestions['suggestions'] = merge_titles(indexed, suggestions['suggestions'])
+        suggestions['source'] = 'llm'
+    elif indexed:
+        # IA indisponível: o que o índice encontrou ainda ajuda
+        return {'success': True, 'suggestions': indexed, 'source': 'index'}
+    return suggestions
+
+def merge_titles(first, second, limit=TITLE_SUGGESTION_LIMIT):
+    """Junta duas listas de títulos sem repetir (comparando normalizados)"""
+    merged = {}
+    for title in list(first) + list(second):
+        if isinstance(title, str):
+            merged.setdefault(normalize_title(title), title)
+    return list(merged.values())[:limit]
+
+def _get_job_title_suggestions(partial_title):
     """
     Gera sugestões de títulos de vaga baseado em texto parcial
     """
@@ -149,13 +544,10 @@ Retorne APENAS uma lista JSON:
 ["Título 1", "Título 2", "Título 3", "Título 4", "Título 5"]
 """
 
-        openai = get_openai_client()
-        response = openai.chat.completions.create(
-            model="deepseek-chat",
+        response = chat_completion(
+            'job_title_suggestion',
             messages=[{"role": "user", "content": prompt}],
-            max_tokens=300,
-            temperature=0.4,
-            timeout=30
+            temperature=0.4
         )
         
         result = response.choices[0].message.content.strip()
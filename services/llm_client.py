@@ -0,0 +1,305 @@
+"""
+Cliente central das chamadas à IA (DeepSeek via SDK da OpenAI)
+
+Todas as chamadas passam por chat_completion, que mede latência, tokens, retentativas e
+resultado de cada requisição e os registra na telemetria (services/telemetry_service.py)
+sem bloquear a análise. O contexto (vaga e candidato) é definido uma vez por quem processa
+o candidato, com llm_call_context, e vale para todas as chamadas feitas dentro dele.
+Chamadas lentas podem ser duplicadas (hedging, ver services/hedge_service.py).
+
+O modelo, o limite de tokens e o timeout de cada finalidade vêm da tabela de rotas
+(DEFAULT_MODEL_ROUTES), que pode ser sobrescrita por implantação (variável de ambiente
+LLM_MODEL_ROUTES, em JSON) e por vaga (Job.model_routes).
+"""
+import contextvars
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from openai import OpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+
+from services.telemetry_service import telemetry_buffer
+from services.hedge_service import request_hedger
+
+DEFAULT_MODEL = "deepseek-chat"
+
+# Rota de cada finalidade; max_tokens ausente fica a cargo de quem chama (ex: lotes de tamanho variável)
+DEFAULT_MODEL_ROUTES = {
+    'score': {'model': DEFAULT_MODEL, 'max_tokens': 50, 'timeout': 45},
+    'score_batch': {'model': DEFAULT_MODEL, 'timeout': 60},
+    'analysis': {'model': DEFAULT_MODEL, 'max_tokens': 1500, 'timeout': 90},
+    'analysis_continuation': {'model': DEFAULT_MODEL, 'max_tokens': 1500, 'timeout': 90},
+    'batch_report': {'model': DEFAULT_MODEL, 'max_tokens': 1500, 'timeout': 90},
+    'batch_report_map': {'model': DEFAULT_MODEL, 'timeout': 60},
+    'batch_report_reduce': {'model': DEFAULT_MODEL, 'timeout': 60},
+    'resume_profile': {'model': DEFAULT_MODEL, 'max_tokens': 900, 'timeout': 45},
+    'job_digest': {'model': DEFAULT_MODEL, 'max_tokens': 800, 'timeout': 45},
+    'job_suggestion': {'model': DEFAULT_MODEL, 'max_tokens': 600, 'timeout': 25},
+    'job_title_suggestion': {'model': DEFAULT_MODEL, 'max_tokens': 300, 'timeout': 30},
+}
+ROUTE_FIELDS = ('model', 'max_tokens', 'timeout')
+
+# Retentativas feitas aqui (e não no SDK) para que sejam contabilizadas na telemetria
+# Timeouts não são repetidos aqui: APITimeoutError herda de APIConnectionError, mas uma nova tentativa
+# dobraria a espera do worker; o agendador de novas tentativas (retry_service) e o hedging cobrem esse caso
+LLM_MAX_RETRIES = 2
+RETRYABLE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+# Tempo total de uma chamada com retentativas: no máximo 1,5x o timeout da rota
+LLM_CALL_TIME_BUDGET = 1.5
+LLM_MIN_ATTEMPT_SECONDS = 5
+
+_call_context = contextvars.ContextVar('llm_call_context', default={})
+
+def get_openai_client():
+    """Get OpenAI client with proper API key loading"""
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    deepseek_api_key = os.environ.get("DEEPSEEK_API_KEY")
+    if not deepseek_api_key:
+        deepseek_api_key = os.environ.get("OPENAI_API_KEY")
+
+    if not deepseek_api_key:
+        raise ValueError("DEEPSEEK_API_KEY ou OPENAI_API_KEY não encontrada")
+
+    return OpenAI(
+        api_key=deepseek_api_key,
+        base_url="https://api.deepseek.com/v1",
+        max_retries=0
+    )
+
+def parse_model_routes(value):
+    """
+    Valida rotas em JSON, ex: {"score": {"model": "deepseek-chat", "timeout": 20}}
+    Retorna o dicionário normalizado ({} se vazio) ou levanta ValueError
+    """
+    if not value:
+        return {}
+    routes = json.loads(value) if isinstance(value, str) else value
+    if not isinstance(routes, dict):
+        raise ValueError("As rotas devem ser um objeto JSON por finalidade")
+
+    normalized = {}
+    for purpose, route in routes.items():
+        if purpose not in DEFAULT_MODEL_ROUTES:
+            raise ValueError(f"Finalidade desconhecida: {purpose}")
+        if not isinstance(route, dict) or set(route) - set(ROUTE_FIELDS):
+            raise ValueError(f"Rota inválida para '{purpose}': use apenas {', '.join(ROUTE_FIELDS)}")
+        try:
+            normalized[purpose] = {
+                field: str(route[field]) if field == 'model' else int(route[field])
+                for field in ROUTE_FIELDS if route.get(field) not in (None, '')
+            }
+        except TypeError:
+            raise ValueError(f"Rota inválida para '{purpose}': max_tokens e timeout devem ser números")
+    return normalized
+
+def _deployment_routes():
+    try:
+        return parse_model_routes(os.environ.get('LLM_MODEL_ROUTES'))
+    except ValueError as e:
+        logging.warning(f"Ignoring invalid LLM_MODEL_ROUTES: {str(e)}")
+        return {}
+
+DEPLOYMENT_MODEL_ROUTES = _deployment_routes()
+
+def resolve_route(purpose, job=None):
+    """
+    Rota efetiva da finalidade: padrão < implantação < vaga
+    Retorna (rota, origem) com origem 'default', 'deployment' ou 'job'
+    """
+    route = dict(DEFAULT_MODEL_ROUTES.get(purpose, {'model': DEFAULT_MODEL}))
+    source = 'default'
+
+    if purpose in DEPLOYMENT_MODEL_ROUTES:
+        route.update(DEPLOYMENT_MODEL_ROUTES[purpose])
+        source = 'deployment'
+
+    job_routes = job.get_model_routes() if job is not None else {}
+    if purpose in job_routes:
+        route.update(job_routes[purpose])
+        source = 'job'
+
+    return route, source
+
+def _apply_route(purpose, job, kwargs):
+    """Aplica a rota da finalidade aos argumentos da chamada e retorna o contexto da telemetria"""
+    route, route_source = resolve_route(purpose, job)
+    for field in ROUTE_FIELDS:
+        if field in route and (route_source != 'default' or field not in kwargs):
+            kwargs[field] = route[field]
+    return {**_call_context.get(), 'route': f"{route_source}:{purpose}"}
+
+@contextmanager
+def llm_call_context(**fields):
+    """Associa job_id/candidate_id às chamadas feitas dentro do bloco (telemetria)"""
+    token = _call_context.set({**_call_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+def _usage_fields(response):
+    """Tokens de entrada, saída e de cache (DeepSeek: prompt_cache_hit_tokens)"""
+    usage = getattr(response, 'usage', None)
+    if not usage:
+        return {}
+
+    cached_tokens = getattr(usage, 'prompt_cache_hit_tokens', None)
+    if cached_tokens is None:
+        details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(details, 'cached_tokens', None) if details else None
+
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+        'completion_tokens': getattr(usage, 'completion_tokens', None),
+        'cached_tokens': cached_tokens
+    }
+
+def chat_completion(purpose, max_retries=LLM_MAX_RETRIES, job=None, **kwargs):
+    """
+    chat.completions.create com retentativas e telemetria
+    purpose identifica o tipo de chamada no monitor (ex: 'score', 'analysis', 'job_suggestion')
+    e escolhe a rota (modelo, max_tokens, timeout); job aplica as rotas configuradas na vaga
+    """
+    context = _apply_route(purpose, job, kwargs)
+    client = get_openai_client()
+    start_time = time.time()
+    retries = 0
+    route_timeout = kwargs.get('timeout')
+    deadline = start_time + route_timeout * LLM_CALL_TIME_BUDGET if route_timeout else None
+
+    def create():
+        attempt_start = time.time()
+        response = client.chat.completions.create(**kwargs)
+        request_hedger.observe(purpose, (time.time() - attempt_start) * 1000)
+        return response
+
+    def record_cancelled(response, error):
+        # Custo da cópia descartada pelo hedging
+        telemetry_buffer.record(
+            purpose=purpose,
+            model=kwargs['model'],
+            retries=retries,
+            outcome='cancelled',
+            error_type=type(error).__name__ if error else None,
+            hedged=True,
+            **_usage_fields(response),
+            **context
+        )
+
+    while True:
+        try:
+            response, hedged = request_hedger.run(purpose, create, record_cancelled)
+            telemetry_buffer.record(
+                purpose=purpose,
+                model=kwargs['model'],
+                latency_ms=int((time.time() - start_time) * 1000),
+                retries=retries,
+                outcome='success',
+                hedged=hedged,
+                **_usage_fields(response),
+                **context
+            )
+            return response
+        except RETRYABLE_ERRORS as e:
+            delay = 0.5 * 2 ** retries
+            remaining = deadline - time.time() - delay if deadline else None
+            if (retries < max_retries and not isinstance(e, APITimeoutError)
+                    and (remaining is None or remaining >= LLM_MIN_ATTEMPT_SECONDS)):
+                retries += 1
+                logging.warning(f"LLM call '{purpose}' failed ({type(e).__name__}), retry {retries}/{max_retries}")
+                time.sleep(delay)
+                if remaining is not None:
+                    # A nova tentativa só usa o que resta do orçamento da chamada
+                    kwargs['timeout'] = min(route_timeout, remaining)
+                continue
+            telemetry_buffer.record(
+                purpose=purpose,
+                model=kwargs['model'],
+                latency_ms=int((time.time() - start_time) * 1000),
+                retries=retries,
+                outcome='timeout' if isinstance(e, APITimeoutError) else 'error',
+                error_type=type(e).__name__,
+                **context
+            )
+            raise
+        except Exception as e:
+            telemetry_buffer.record(
+                purpose=purpose,
+                model=kwargs['model'],
+                latency_ms=int((time.time() - start_time) * 1000),
+                retries=retries,
+                outcome='error',
+                error_type=type(e).__name__,
+                **context
+            )
+            raise
+
+class ChatStream:
+    """
+    Resposta em streaming (stream=True): iterar produz os trechos de texto conforme chegam
+    Ao final, text tem a resposta completa e finish_reason o motivo do término
+    """
+    def __init__(self, purpose, kwargs, context):
+        self.purpose = purpose
+        self.kwargs = kwargs
+        self.context = context
+        self.text = ''
+        self.finish_reason = None
+        self.first_token_ms = None
+
+    def __iter__(self):
+        start_time = time.time()
+        usage = {}
+        outcome, error_type = 'success', None
+        stream = None
+        try:
+            stream = get_openai_client().chat.completions.create(
+                stream=True,
+                stream_options={"include_usage": True},
+                **self.kwargs
+            )
+            for chunk in stream:
+                if getattr(chunk, 'usage', None):
+                    usage = _usage_fields(chunk)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    self.finish_reason = choice.finish_reason
+                delta = choice.delta.content if choice.delta else None
+                if delta:
+                    if self.first_token_ms is None:
+                        self.first_token_ms = int((time.time() - start_time) * 1000)
+                    self.text += delta
+                    yield delta
+        except Exception as e:
+            outcome = 'timeout' if isinstance(e, APITimeoutError) else 'error'
+            error_type = type(e).__name__
+            raise
+        finally:
+            # Interrompido antes do fim: fechar a resposta HTTP encerra a geração no provedor
+            if stream is not None and not self.finish_reason:
+                stream.close()
+            # Stream interrompido pelo cliente (GeneratorExit) também é registrado
+            telemetry_buffer.record(
+                purpose=self.purpose,
+                model=self.kwargs['model'],
+                latency_ms=int((time.time() - start_time) * 1000),
+                retries=0,
+                outcome=outcome if self.finish_reason or error_type else 'cancelled',
+                error_type=error_type,
+                **usage,
+                **self.context
+            )
+
+def stream_chat_completion(purpose, job=None, **kwargs):
+    """
+    chat.completions.create com stream=True, mesma rota e telemetria de chat_completion
+    Sem retentativas: o texto já enviado ao usuário não pode ser refeito
+    """
+    context = _apply_route(purpose, job, kwargs)
+    return ChatStream(purpose, kwargs, context)
@@ -0,0 +1,98 @@
+"""
+Triagem local de currículos antes da análise com IA
+
+Calcula um score de aderência (0 a 10) entre os requisitos da vaga e o texto de
+cada currículo: a fração das palavras dos requisitos encontradas no currículo,
+ponderada pelo IDF sobre o lote inteiro. 10 = o currículo cita todas as palavras
+dos requisitos; 5 = metade do peso delas. Vagas com limite mínimo ou top-K
+configurado enviam para a IA apenas os candidatos promissores; os demais são
+marcados como triados localmente.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9][a-z0-9+#.]*[a-z0-9+#]|[a-z0-9]')
+
+STOPWORDS = {
+    'a', 'ao', 'aos', 'as', 'com', 'como', 'da', 'das', 'de', 'do', 'dos', 'e', 'em', 'entre', 'na', 'nas',
+    'no', 'nos', 'o', 'os', 'ou', 'para', 'pela', 'pelas', 'pelo', 'pelos', 'por', 'que', 'se', 'sem', 'sua',
+    'suas', 'seu', 'seus', 'um', 'uma', 'uns', 'umas', 'ser', 'ter', 'sobre', 'mais', 'muito', 'bem', 'boa',
+    'bom', 'nao', 'sim', 'ate', 'apos', 'cada', 'todo', 'toda', 'todos', 'todas', 'outro', 'outros', 'outra',
+    'outras', 'esta', 'este', 'isso', 'isto', 'ja', 'tambem', 'etc', 'ex', 'area', 'areas',
+    # Termos estruturais dos requisitos que não diferenciam candidatos
+    'minimo', 'exigido', 'desejavel', 'requisitos', 'requisito', 'funcoes', 'formacao', 'conhecimentos',
+    'conhecimento', 'habilidades', 'habilidade', 'experiencia', 'experiencias', 'anos', 'ano', 'nivel',
+    'completo', 'completa', 'cursando', 'vaga', 'empresa', 'atividades'
+}
+
+SCREENED_OUT_SUMMARY = 'Triado localmente: baixa aderência aos requisitos da vaga'
+
+def normalize_text(text):
+    """Converte para minúsculas e remove acentos"""
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+def extract_terms(text):
+    """Extrai os termos (palavras e pares de palavras) relevantes de um texto"""
+    tokens = [
+        token for token in TOKEN_PATTERN.findall(normalize_text(text))
+        if token not in STOPWORDS and (len(token) > 2 or not token.isalpha())
+    ]
+    bigrams = [f'{first} {second}' for first, second in zip(tokens, tokens[1:])]
+    return tokens + bigrams
+
+def prescore_batch(requirements, resume_texts):
+    """
+    Calcula o score de aderência (0 a 10) de cada currículo do lote
+
+    Os pesos IDF são calculados sobre todos os currículos do lote de uma vez:
+    termos dos requisitos presentes em poucos currículos pesam mais do que
+    termos que todos os candidatos possuem.
+
+    Uma menção basta para o termo contar seu peso inteiro (repetir não aumenta o
+    score). O total atingível é o peso das palavras dos requisitos; pares de palavras
+    encontrados somam como bônus, limitado a 10.
+    """
+    requirement_terms = set(extract_terms(requirements))
+    if not requirement_terms or not resume_texts:
+        return [0.0 for _ in resume_texts]
+
+    # Frequência de cada termo dos requisitos em cada currículo
+    documents = []
+    document_frequency = Counter()
+    for text in resume_texts:
+        counts = Counter(term for term in extract_terms(text) if term in requirement_terms)
+        documents.append(counts)
+        document_frequency.update(counts.keys())
+
+    total_documents = len(resume_texts)
+    idf = {
+        term: math.log((1 + total_documents) / (1 + document_frequency[term])) + 1
+        for term in requirement_terms
+    }
+    achievable_weight = sum(weight for term, weight in idf.items() if ' ' not in term)
+
+    scores = []
+    for counts in documents:
+        weight = sum(idf[term] for term in counts)
+        coverage = min(weight / achievable_weight, 1.0) if achievable_weight else 0.0
+        scores.append(round(coverage * 10, 2))
+
+    return scores
+
+def select_for_analysis(scores, threshold=None, top_k=None):
+    """
+    Retorna os índices dos currículos que seguem para a análise com IA
+    Sem limite mínimo nem top-K configurado, todos seguem
+    """
+    ranked = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
+
+    if threshold is not None:
+        ranked = [index for index in ranked if scores[index] >= threshold]
+
+    if top_k is not None and top_k > 0:
+        ranked = ranked[:top_k]
+
+    return set(ranked)
@@ -0,0 +1,178 @@
+"""
+Serviço de renderização de HTML para análises da IA e requisitos das vagas
+
+O texto da análise (e dos requisitos) não muda depois de salvo, então o HTML é gerado uma única vez
+quando o resultado é gravado (e não a cada visualização da página). Sempre que a
+formatação mudar, incremente a versão correspondente para que os registros antigos
+sejam renderizados novamente sob demanda.
+"""
+import re
+
+# Versão do formato de renderização - incrementar ao alterar qualquer regra abaixo
+RENDER_FORMAT_VERSION = 1
+
+# Versão do formato dos requisitos da vaga - incrementar ao alterar render_requirements_html
+REQUIREMENTS_FORMAT_VERSION = 1
+
+REQUIREMENTS_SECTIONS = {
+    'Funções': 'fas fa-cogs',
+    'Formação': 'fas fa-graduation-cap',
+    'Conhecimentos': 'fas fa-brain',
+    'Habilidades': 'fas fa-star'
+}
+
+REQUIREMENTS_HIGHLIGHT_PATTERN = re.compile(r'(Mínimo Exigido|Desejável)\s*([^•\n]*)')
+
+SUMMARY_HEADERS = ['RESUMO DO CURRÍCULO', 'RESUMO EXECUTIVO']
+
+# Conteúdo de análise que pode vazar para o resumo e deve ser removido
+SUMMARY_REMOVALS = [
+    '---', '### ANÁLISE DO RECRUTADOR', '#### 1. ALINHAMENTO TÉCNICO:', '#### 2. GAPS IDENTIFICADOS:',
+    '#### 3. RECOMENDAÇÃO FINAL:', 'OBSERVAÇÃO FINAL:',
+    '1. ALINHAMENTO TÉCNICO', '2. GAPS IDENTIFICADOS', '3. RECOMENDAÇÃO FINAL', 'PARCIAL', 'ADEQUADO', 'INADEQUADO',
+    'Pontos fortes:', 'Limitações:', 'Justificativa:', 'Lacunas técnicas:', 'Conhecimentos em falta:',
+    'Áreas de desenvolvimento:', 'Competências alinhadas:', 'Adequação à vaga:', 'Experiência relevante:'
+]
+
+SUMMARY_CUTS = ['ANÁLISE DO RECRUTADOR', '### ANÁLISE DO RECRUTADOR', '#### 1. ALINHAMENTO TÉCNICO', 'OBSERVAÇÃO FINAL']
+
+ANALYSIS_REPLACEMENTS = [
+    ('1. ALINHAMENTO TÉCNICO:', '<h5><i class="fas fa-check-circle me-2"></i>1. ALINHAMENTO TÉCNICO</h5><div class="alignment">'),
+    ('🎯 **1. ALINHAMENTO TÉCNICO**', '<h5><i class="fas fa-check-circle me-2"></i>1. ALINHAMENTO TÉCNICO</h5><div class="alignment">'),
+    ('2. GAPS IDENTIFICADOS:', '<h5><i class="fas fa-exclamation-triangle me-2"></i>2. GAPS IDENTIFICADOS</h5><div class="gaps">'),
+    ('⚠️ **2. GAPS IDENTIFICADOS**', '<h5><i class="fas fa-exclamation-triangle me-2"></i>2. GAPS IDENTIFICADOS</h5><div class="gaps">'),
+    ('3. RECOMENDAÇÃO FINAL:', '<h5><i class="fas fa-star me-2"></i>3. RECOMENDAÇÃO FINAL</h5><div class="recommendation">'),
+    ('🏆 **3. RECOMENDAÇÃO FINAL**', '<h5><i class="fas fa-star me-2"></i>3. RECOMENDAÇÃO FINAL</h5><div class="recommendation">'),
+    ('####', '<h5>'),
+    ('---', ''),
+    ('Observação final:', '<strong>Observação final:</strong>'),
+    ('OBSERVAÇÃO FINAL:', '<strong>OBSERVAÇÃO FINAL:</strong>'),
+    ('- ', '<li>'),
+    ('<br>- ', '<br><li>'),
+]
+
+# Indicadores de análises genéricas (não baseadas no currículo real)
+OUTDATED_ANALYSIS_INDICATORS = [
+    "Como o currículo não foi fornecido",
+    "caso você compartilhe o CV",
+    "currículo hipotético",
+    "João Silva",
+    "Empresa XYZ",
+    "Empresa ABC",
+    "Preenchido com base em um currículo hipotético",
+    "modelo estruturado de como seria a avaliação",
+    "Não foi possível extrair texto do currículo",
+    "arquivo não contém texto legível"
+]
+
+def _strip_markdown(text):
+    """Remove marcações de negrito e converte quebras de linha em <br>"""
+    return text.replace('**', '').replace('*', '').replace('\n', '<br>')
+
+def render_summary_html(summary, analysis):
+    """
+    Renderiza o resumo do currículo em HTML
+    Retorna None quando não há resumo disponível
+    """
+    if summary:
+        return _strip_markdown(summary)
+
+    if not analysis:
+        return None
+
+    for header in SUMMARY_HEADERS:
+        if header in analysis:
+            clean_summary = analysis.split(header)[1].split('ANÁLISE DO RECRUTADOR')[0].strip()
+            clean_summary = _strip_markdown(clean_summary)
+            for removal in SUMMARY_REMOVALS:
+                clean_summary = clean_summary.replace(removal, '')
+            for cut in SUMMARY_CUTS:
+                if cut in clean_summary:
+                    clean_summary = clean_summary.split(cut)[0]
+            return clean_summary
+
+    return None
+
+def has_professional_format(analysis):
+    """Verifica se a análise contém os 3 pontos de avaliação técnica"""
+    if not analysis:
+        return False
+    return (
+        ('1. ALINHAMENTO TÉCNICO:' in analysis or '🎯 **1. ALINHAMENTO TÉCNICO**' in analysis) and
+        ('2. GAPS IDENTIFICADOS:' in analysis or '⚠️ **2. GAPS IDENTIFICADOS**' in analysis) and
+        ('3. RECOMENDAÇÃO FINAL:' in analysis or '🏆 **3. RECOMENDAÇÃO FINAL**' in analysis)
+    )
+
+def is_outdated_analysis(analysis):
+    """Verifica se a análise é genérica e não analisa o currículo real"""
+    if not analysis:
+        return False
+    return any(indicator in analysis for indicator in OUTDATED_ANALYSIS_INDICATORS)
+
+def render_analysis_html(analysis):
+    """
+    Renderiza a análise do recrutador em HTML
+    Retorna None quando a análise não está no formato profissional
+    """
+    if not has_professional_format(analysis):
+        return None
+
+    formatted_analysis = _strip_markdown(analysis)
+    for old, new in ANALYSIS_REPLACEMENTS:
+        formatted_analysis = formatted_analysis.replace(old, new)
+    return formatted_analysis
+
+def render_requirements_html(text):
+    """Formata os requisitos da vaga para exibição melhorada"""
+    if not text:
+        return text
+    
+    # Substitui marcadores comuns por HTML formatado
+    formatted = text.replace('*', '•')
+    
+    # Formata cada seção
+    for section, icon in REQUIREMENTS_SECTIONS.items():
+        if section in formatted:
+            formatted = formatted.replace(
+                f'{section}',
+                f'<h6 class="mt-3 mb-2"><i class="{icon} me-2"></i>{section}</h6>'
+            )
+    
+    # Formata "Mínimo Exigido" e "Desejável"
+    formatted = REQUIREMENTS_HIGHLIGHT_PATTERN.sub(r'<strong>\1:</strong> \2', formatted)
+    
+    # Converte quebras de linha em parágrafos
+    formatted_paragraphs = []
+    for para in formatted.split('\n'):
+        para = para.strip()
+        if para:
+            if para.startswith('•'):
+                # Lista com bullets
+                formatted_paragraphs.append(f'<li>{para[1:].strip()}</li>')
+            elif para.startswith('<h6'):
+                # Títulos de seção
+                formatted_paragraphs.append(para)
+            else:
+                # Texto normal ou com formatação especial
+                formatted_paragraphs.append(f'<p class="mb-2">{para}</p>')
+    
+    # Agrupa itens de lista
+    result = []
+    in_list = False
+    
+    for item in formatted_paragraphs:
+        if item.startswith('<li>'):
+            if not in_list:
+                result.append('<ul class="mb-3">')
+                in_list = True
+            result.append(item)
+        else:
+            if in_list:
+                result.append('</ul>')
+                in_list = False
+            result.append(item)
+    
+    if in_list:
+        result.append('</ul>')
+    
+    return ''.join(result)
@@ -0,0 +1,196 @@
+"""
+Perfil estruturado do currículo, independente da vaga
+
+O mesmo currículo pode ser pontuado para várias vagas (ou para vagas clonadas). Em vez de
+reenviar até 4000 caracteres do texto bruto a cada vaga, a IA extrai uma única vez um perfil
+compacto (cargos com datas, habilidades, formação e idiomas), que fica em cache pelo hash do
+conteúdo do currículo e é usado nos prompts de score.
+
+O perfil só é extraído quando o currículo é pontuado para a segunda vaga: currículos
+avaliados para uma única vaga não pagam a chamada extra.
+
+Trade-off: a primeira vaga é pontuada a partir do texto bruto e as seguintes a partir do perfil,
+então scores do mesmo currículo em vagas diferentes podem ter base diferente. A base usada fica
+registrada por vaga em 'scoring_inputs' ('text' ou 'profile') e é mantida nas repontuações da vaga,
+para que o score de uma vaga não mude só porque o currículo passou a ter perfil.
+"""
+import json
+import logging
+import os
+import re
+import threading
+
+from services.cache_service import analysis_cache
+
+# Versão do formato do perfil - incrementar ao alterar o prompt ou os campos
+RESUME_PROFILE_VERSION = 1
+
+# O perfil não depende da vaga: pode ficar em cache por bem mais tempo que as análises
+RESUME_PROFILE_MAX_AGE_HOURS = 24 * 30
+
+# Permite desativar o perfil por deployment (o score volta a usar o texto bruto)
+RESUME_PROFILE_ENABLED = os.environ.get('RESUME_PROFILE_SCORING', 'true').lower() not in ('false', '0', 'no')
+
+# Quantidade de vagas distintas a partir da qual o perfil passa a ser usado
+RESUME_PROFILE_MIN_JOBS = 2
+
+PROFILE_CACHE_KEY = f"resume_profile:v{RESUME_PROFILE_VERSION}"
+
+def extract_resume_profile(resume_text):
+    """Extrai com a IA o perfil estruturado do currículo"""
+    from services.llm_client import chat_completion
+
+    prompt = f"""
+Extraia do currículo abaixo um perfil estruturado. Use APENAS informações presentes no currículo, sem inventar dados.
+
+Responda APENAS com JSON no formato:
+{{"cargos": [{{"cargo": "...", "empresa": "...", "inicio": "MM/AAAA", "fim": "MM/AAAA ou atual"}}],
+ "habilidades": ["..."],
+ "formacao": [{{"curso": "...", "instituicao": "...", "nivel": "...", "conclusao": "AAAA ou cursando"}}],
+ "idiomas": [{{"idioma": "...", "nivel": "..."}}],
+ "certificacoes": ["..."]}}
+
+Use "" para datas ou campos não informados.
+
+CURRÍCULO:
+{resume_text[:6000]}
+"""
+
+    response = chat_completion(
+        'resume_profile',
+        messages=[{"role": "user", "content": prompt}],
+        temperature=0.0
+    )
+
+    match = re.search(r"\{.*\}", response.choices[0].message.content or '', re.DOTALL)
+    if not match:
+        return None
+
+    profile = json.loads(match.group(0))
+    if not isinstance(profile, dict) or not (profile.get('cargos') or profile.get('habilidades') or profile.get('formacao')):
+        return None
+    return profile
+
+# Serializa a leitura-modificação-escrita da entrada do perfil entre as threads do processo
+_profile_lock = threading.Lock()
+
+def _read_profile_entry(resume_text):
+    entry = analysis_cache.get_cached_analysis(resume_text, PROFILE_CACHE_KEY, max_age_hours=RESUME_PROFILE_MAX_AGE_HOURS) or {}
+    return {
+        'jobs': list(entry.get('jobs') or []),
+        'profile': entry.get('profile'),
+        'scoring_inputs': dict(entry.get('scoring_inputs') or {})
+    }
+
+def _update_profile_entry(resume_text, job_id=None, scoring_input=None, profile=None):
+    """
+    Relê a entrada e grava só o que mudou: a lista de vagas e as bases de score são unidas ao
+    que outro worker tenha gravado, em vez de sobrescritas com uma cópia antiga
+    (entre workers a janela de corrida fica restrita ao intervalo entre esta leitura e a escrita)
+    """
+    with _profile_lock:
+        entry = _read_profile_entry(resume_text)
+        changed = False
+
+        if job_id is not None and job_id not in entry['jobs']:
+            entry['jobs'].append(job_id)
+            changed = True
+        if scoring_input and str(job_id) not in entry['scoring_inputs']:
+            entry['scoring_inputs'][str(job_id)] = scoring_input
+            changed = True
+        if profile and not entry['profile']:
+            entry['profile'] = profile
+            changed = True
+
+        if changed:
+            analysis_cache.cache_analysis(resume_text, PROFILE_CACHE_KEY, entry, ttl_hours=RESUME_PROFILE_MAX_AGE_HOURS)
+        return entry
+
+def get_resume_profile(resume_text, job_id):
+    """
+    Registra a vaga para a qual o currículo está sendo pontuado e retorna o perfil
+    (extraído com a IA uma única vez, a partir da segunda vaga; cache por conteúdo)
+    Retorna None enquanto o perfil não for necessário, se estiver desativado ou se a extração falhar
+    """
+    if not RESUME_PROFILE_ENABLED or not resume_text:
+        return None
+
+    entry = _update_profile_entry(resume_text, job_id=job_id)
+    if entry['profile'] or len(entry['jobs']) < RESUME_PROFILE_MIN_JOBS:
+        return entry['profile']
+
+    # A chamada à IA fica fora do lock; o perfil é gravado depois, sobre a entrada relida
+    try:
+        profile = extract_resume_profile(resume_text)
+    except Exception as e:
+        logging.error(f"Error extracting resume profile: {str(e)}")
+        return None
+
+    if not profile:
+        return None
+    return _update_profile_entry(resume_text, profile=profile)['profile']
+
+def format_resume_profile(profile):
+    """Formata o perfil como texto compacto para os prompts"""
+    lines = []
+
+    roles = profile.get('cargos') or []
+    if roles:
+        lines.append("EXPERIÊNCIA:")
+        for role in roles:
+            if not isinstance(role, dict):
+                lines.append(f"- {role}")
+                continue
+            period = ' a '.join(part for part in (role.get('inicio'), role.get('fim')) if part)
+            company = f" - {role['empresa']}" if role.get('empresa') else ''
+            lines.append(f"- {role.get('cargo', '')}{company}{f' ({period})' if period else ''}")
+
+    education = profile.get('formacao') or []
+    if education:
+        lines.append("FORMAÇÃO:")
+        for course in education:
+            if not isinstance(course, dict):
+                lines.append(f"- {course}")
+                continue
+            details = ', '.join(part for part in (course.get('nivel'), course.get('instituicao'), course.get('conclusao')) if part)
+            lines.append(f"- {course.get('curso', '')}{f' ({details})' if details else ''}")
+
+    if profile.get('habilidades'):
+        lines.append(f"HABILIDADES: {', '.join(map(str, profile['habilidades']))}")
+
+    languages = profile.get('idiomas') or []
+    if languages:
+        lines.append("IDIOMAS: " + ', '.join(
+            str(language) if not isinstance(language, dict) else
+            f"{language.get('idioma', '')} ({language['nivel']})" if language.get('nivel') else language.get('idioma', '')
+            for language in languages
+        ))
+
+    if profile.get('certificacoes'):
+        lines.append(f"CERTIFICAÇÕES: {', '.join(map(str, profile['certificacoes']))}")
+
+    return '\n'.join(lines)
+
+def get_scoring_text(resume_text, job_id, max_chars=4000):
+    """
+    Texto do currículo usado nos prompts de score: o perfil compacto quando disponível,
+    senão o texto bruto truncado
+    A vaga mantém a base com que foi pontuada pela primeira vez (registrada em 'scoring_inputs')
+    """
+    truncated_text = resume_text[:max_chars] + "..." if len(resume_text) > max_chars else resume_text
+
+    profile = get_resume_profile(resume_text, job_id)
+    if not RESUME_PROFILE_ENABLED or not resume_text:
+        return truncated_text
+
+    recorded_input = _read_profile_entry(resume_text)['scoring_inputs'].get(str(job_id))
+    scoring_input = recorded_input or ('profile' if profile else 'text')
+    if scoring_input == 'profile' and not profile:
+        # Perfil expirado ou descartado: o texto bruto é a única base disponível
+        scoring_input = 'text'
+    if not recorded_input:
+        _update_profile_entry(resume_text, job_id=job_id, scoring_input=scoring_input)
+
+    if scoring_input == 'profile':
+        return format_resume_profile(profile)
+    return truncated_text
@@ -0,0 +1,110 @@
+"""
+Novas tentativas automáticas para análises que falharam
+
+Cada falha é classificada (mesmas regras de get_detailed_error_description) e a classe decide
+o que acontece com o candidato:
+- erros temporários (limite de taxa, timeout, conexão...) agendam uma nova tentativa com
+  backoff exponencial próprio de cada classe
+- erros permanentes (arquivo ilegível, chave inválida...) vão direto para dead-letter
+- cada candidato tem um orçamento total de tentativas; esgotado, vai para dead-letter
+
+As tentativas agendadas são executadas por processors/retry_scheduler.py.
+"""
+import random
+from datetime import datetime, timedelta
+
+# Orçamento total de novas tentativas automáticas por candidato (todas as classes somadas)
+CANDIDATE_RETRY_BUDGET = 5
+
+# Backoff por classe de erro: espera base (s), espera máxima (s) e limite de tentativas
+# do candidato quando a falha é desta classe
+RETRY_POLICIES = {
+    'rate_limit': {'base_delay': 60, 'max_delay': 900, 'max_attempts': 5},
+    'timeout': {'base_delay': 30, 'max_delay': 600, 'max_attempts': 4},
+    'connection': {'base_delay': 20, 'max_delay': 300, 'max_attempts': 4},
+    'network': {'base_delay': 20, 'max_delay': 300, 'max_attempts': 4},
+    'api': {'base_delay': 30, 'max_delay': 600, 'max_attempts': 3},
+    'database': {'base_delay': 10, 'max_delay': 120, 'max_attempts': 3},
+    'incomplete': {'base_delay': 30, 'max_delay': 300, 'max_attempts': 2},
+    'unknown': {'base_delay': 60, 'max_delay': 600, 'max_attempts': 2},
+}
+
+# Classes que não se resolvem sozinhas: sem nova tentativa automática
+DEAD_LETTER_CLASSES = {'file_not_found', 'permission', 'extraction', 'invalid_key', 'memory'}
+
+def classify_error(error):
+    """Classifica uma exceção da análise (ver RETRY_POLICIES e DEAD_LETTER_CLASSES)"""
+    # Erro repassado de outra chamada (ex: SharedFlightError do single-flight) já traz a classe
+    if getattr(error, 'error_class', None):
+        return error.error_class
+
+    error_type = type(error).__name__
+    error_msg = str(error).lower()
+
+    # File-related errors
+    if isinstance(error, FileNotFoundError) or "no such file or directory" in error_msg:
+        return 'file_not_found'
+    if isinstance(error, PermissionError) or "permission denied" in error_msg:
+        return 'permission'
+
+    # API errors (SDK da OpenAI usado com a DeepSeek)
+    if error_type == 'RateLimitError' or "rate limit" in error_msg or "429" in error_msg:
+        return 'rate_limit'
+    if error_type in ('AuthenticationError', 'PermissionDeniedError') or "api key" in error_msg:
+        return 'invalid_key'
+    if "OpenAI" in error_type or "API" in error_type or error_type == 'InternalServerError':
+        if "timeout" in error_type.lower() or "timeout" in error_msg or "timed out" in error_msg:
+            return 'timeout'
+        if "invalid" in error_msg:
+            return 'invalid_key'
+        if "connection" in error_type.lower() or "connection" in error_msg:
+            return 'connection'
+        return 'api'
+
+    # Erro de programação: nunca é do arquivo, mesmo que a mensagem cite "extract"
+    if isinstance(error, (NameError, AttributeError, TypeError, KeyError)):
+        return 'unknown'
+    if "database" in error_msg or "sql" in error_msg:
+        return 'database'
+    if "extract" in error_msg or "decode" in error_msg:
+        return 'extraction'
+    if isinstance(error, MemoryError) or "memory" in error_msg or "out of" in error_msg:
+        return 'memory'
+    if isinstance(error, TimeoutError) or "timeout" in error_msg:
+        return 'timeout'
+    if "network" in error_msg or "dns" in error_msg:
+        return 'network'
+    return 'unknown'
+
+def compute_retry_delay(error_class, attempt):
+    """Espera (s) antes da tentativa número attempt (1, 2, ...) com jitter de até 20%"""
+    policy = RETRY_POLICIES.get(error_class, RETRY_POLICIES['unknown'])
+    delay = min(policy['base_delay'] * 2 ** (attempt - 1), policy['max_delay'])
+    return delay * random.uniform(0.8, 1.2)
+
+def schedule_retry_or_dead_letter(candidate, error_class):
+    """
+    Registra a falha no candidato e agenda uma nova tentativa ou o envia para dead-letter
+    Não faz commit. Retorna 'scheduled' ou 'dead_letter'
+    """
+    error_class = error_class or 'unknown'
+    candidate.last_error_class = error_class
+    attempts = (candidate.retry_count or 0) + 1
+    policy = RETRY_POLICIES.get(error_class)
+
+    if error_class in DEAD_LETTER_CLASSES or not policy or attempts > min(policy['max_attempts'], CANDIDATE_RETRY_BUDGET):
+        candidate.retry_state = 'dead_letter'
+        candidate.next_retry_at = None
+        return 'dead_letter'
+
+    candidate.retry_count = attempts
+    candidate.retry_state = 'scheduled'
+    candidate.next_retry_at = datetime.utcnow() + timedelta(seconds=compute_retry_delay(error_class, attempts))
+    return 'scheduled'
+
+def reset_retry_state(candidate):
+    """Zera o orçamento de tentativas (reprocessamento manual ou análise concluída)"""
+    candidate.retry_count = 0
+    candidate.retry_state = None
+    candidate.next_retry_at = None
+    candidate.last_error_class = None
@@ -0,0 +1,259 @@
+"""
+Single-flight: agrupa chamadas concorrentes para a mesma análise
+
+Duplo clique em "reprocessar", /api/jobs/<id>/reprocess-all concorrendo com /api/process-pending
+ou o mesmo arquivo enviado duas vezes podiam chamar a IA várias vezes para o mesmo par
+(currículo, vaga). O cache só ajuda depois que o primeiro resultado é gravado.
+
+- Entre threads do mesmo processo: a primeira chamada executa, as demais aguardam e recebem
+  o mesmo resultado
+- Entre workers do gunicorn: a tabela analysis_lock funciona como lock compartilhado; o worker
+  que não obtém o lock aguarda o resultado aparecer no cache (ou o lock ser liberado/expirar)
+- Falha do líder: as chamadas que aguardam recebem o mesmo erro em vez de repetirem a chamada à IA
+  todas ao mesmo tempo. Entre workers, a linha do lock fica marcada como 'failed:<classe>' por
+  failure_ttl_seconds; quem aguarda (ou chega nesse intervalo) recebe SharedFlightError com a classe
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+FAILED_OWNER_PREFIX = 'failed:'
+
+class SharedFlightError(Exception):
+    """Falha da mesma chave em outro worker; error_class é a classe do erro original"""
+    def __init__(self, key, error_class):
+        super().__init__(f"Analysis failed in another worker ({error_class})")
+        self.key = key
+        self.error_class = error_class
+
+class _InFlightCall:
+    """Chamada em andamento e seu resultado, compartilhados com as threads que aguardam"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+class SingleFlight:
+    def __init__(self, lock_ttl_seconds=300, poll_interval=1.0, failure_ttl_seconds=10):
+        self.lock_ttl_seconds = lock_ttl_seconds
+        self.failure_ttl_seconds = failure_ttl_seconds
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.stats = {'executed': 0, 'coalesced_local': 0, 'coalesced_shared': 0, 'shared_failures': 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def do(self, key, fn, lookup=None):
+        """
+        Executa fn uma única vez por chave; chamadas concorrentes recebem o mesmo resultado
+        lookup retorna o resultado já salvo por outro worker (ex: leitura do cache) ou None
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _InFlightCall()
+                self.calls[key] = call
+            else:
+                self.stats['coalesced_local'] += 1
+
+        if not is_leader:
+            call.event.wait()
+            if call.error:
+                raise call.error
+            if call.abandoned:
+                # Líder encerrado sem resultado (ex: streaming interrompido): uma das chamadas assume
+                return self.do(key, fn, lookup)
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn, lookup)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.event.set()
+            with self.lock:
+                self.calls.pop(key, None)
+
+    @contextmanager
+    def leading(self, key):
+        """
+        Para chamadas que não cabem em do() (ex: análise em streaming): entrega a chamada em
+        andamento quando esta é a líder da chave, no processo e entre workers, ou None quando a
+        chave já está em andamento (use do() para aguardar o resultado)
+        O líder grava call.result; as chamadas que aguardam em do() recebem esse resultado
+        """
+        with self.lock:
+            call = None if key in self.calls else _InFlightCall()
+            if call:
+                self.calls[key] = call
+
+        if call and not self._acquire_shared_lock(key):
+            self._finish_local(key, call)
+            call = None
+
+        try:
+            yield call
+        except Exception as e:
+            if call:
+                call.error = e
+                self._mark_shared_failure(key, e)
+            raise
+        finally:
+            if call:
+                call.abandoned = call.result is None and call.error is None
+                if not call.error:
+                    self._release_shared_lock(key)
+                self._finish_local(key, call)
+
+    def _finish_local(self, key, call):
+        call.event.set()
+        with self.lock:
+            self.calls.pop(key, None)
+
+    def _run_shared(self, key, fn, lookup):
+        """Executa fn com o lock compartilhado entre workers ou aguarda o worker que já o detém"""
+        deadline = time.time() + self.lock_ttl_seconds
+        waited = False
+
+        while True:
+            if self._acquire_shared_lock(key):
+                try:
+                    # Outro worker pode ter concluído entre a leitura do cache e o lock
+                    result = lookup() if lookup else None
+                    if result is not None:
+                        self._release_shared_lock(key)
+                        return result
+                    self._count('executed')
+                    result = fn()
+                except Exception as e:
+                    self._mark_shared_failure(key, e)
+                    raise
+                self._release_shared_lock(key)
+                return result
+
+            self._raise_shared_failure(key)
+
+            if not waited:
+                waited = True
+                self._count('coalesced_shared')
+                print(f"⏳ Análise já em andamento em outro worker, aguardando resultado ({key[:12]}...)")
+
+            time.sleep(self.poll_interval)
+
+            result = lookup() if lookup else None
+            if result is not None:
+                return result
+
+            # Segurança: nunca espera além do TTL do lock
+            if time.time() > deadline:
+                logger.warning(f"Single-flight wait timed out for {key}, running locally")
+                self._count('executed')
+                return fn()
+
+    def _owner(self):
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    def _acquire_shared_lock(self, key):
+        """
+        Tenta inserir a linha do lock (remove antes um lock expirado da mesma chave)
+        Sem banco disponível, o single-flight fica restrito ao processo atual
+        """
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            now = datetime.utcnow()
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.lock_key == key).where(table.c.expires_at < now))
+                connection.execute(table.insert().values(
+                    lock_key=key,
+                    owner=self._owner(),
+                    acquired_at=now,
+                    expires_at=now + timedelta(seconds=self.lock_ttl_seconds)
+                ))
+            return True
+        except IntegrityError:
+            return False
+        except Exception as e:
+            logger.warning(f"Shared analysis lock unavailable, using in-process single-flight only: {str(e)}")
+            return True
+
+    def _release_shared_lock(self, key):
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            with db.engine.begin() as connection:
+                connection.execute(table.delete().where(table.c.lock_key == key).where(table.c.owner == self._owner()))
+        except Exception as e:
+            logger.warning(f"Error releasing shared analysis lock {key}: {str(e)}")
+
+    def _mark_shared_failure(self, key, error):
+        """
+        Troca o dono da linha do lock por 'failed:<classe>' com validade curta, para que os workers
+        que aguardam recebam a falha; se não for possível, o lock é apenas liberado
+        """
+        from services.retry_service import classify_error
+
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            with db.engine.begin() as connection:
+                updated = connection.execute(
+                    table.update()
+                    .where(table.c.lock_key == key)
+                    .where(table.c.owner == self._owner())
+                    .values(
+                        owner=FAILED_OWNER_PREFIX + classify_error(error),
+                        expires_at=datetime.utcnow() + timedelta(seconds=self.failure_ttl_seconds)
+                    )
+                ).rowcount
+            if updated:
+                return
+        except Exception as e:
+            logger.warning(f"Error sharing analysis failure for {key}: {str(e)}")
+        self._release_shared_lock(key)
+
+    def _raise_shared_failure(self, key):
+        """Levanta SharedFlightError quando o worker líder da chave falhou há pouco"""
+        try:
+            from database import db
+            from models.models import AnalysisLock
+
+            table = AnalysisLock.__table__
+            with db.engine.connect() as connection:
+                owner = connection.execute(
+                    select(table.c.owner)
+                    .where(table.c.lock_key == key)
+                    .where(table.c.expires_at >= datetime.utcnow())
+                ).scalar()
+        except Exception as e:
+            logger.warning(f"Error checking shared analysis lock {key}: {str(e)}")
+            return
+
+        if owner and owner.startswith(FAILED_OWNER_PREFIX):
+            self._count('shared_failures')
+            raise SharedFlightError(key, owner[len(FAILED_OWNER_PREFIX):])
+
+# Global single-flight instance for AI analyses
+analysis_singleflight = SingleFlight()
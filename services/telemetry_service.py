@@ -0,0 +1,223 @@
+"""
+Telemetria das chamadas à IA
+
+Cada chamada é colocada em um buffer em memória (sem bloquear quem chamou) e gravada em lote
+na tabela llm_call_log por uma thread em segundo plano. O buffer é limitado: se o banco ficar
+indisponível, os registros mais novos são descartados e contabilizados, nunca travam a análise.
+"""
+import logging
+import queue
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_FIELDS = (
+    'purpose', 'model', 'job_id', 'candidate_id', 'prompt_tokens', 'completion_tokens',
+    'cached_tokens', 'latency_ms', 'retries', 'outcome', 'error_type', 'hedged', 'route', 'tokens_saved'
+)
+
+# Limites dos intervalos do histograma de latência (ms)
+LATENCY_BUCKETS_MS = [500, 1000, 2000, 5000, 10000, 20000, 30000, 60000]
+
+class TelemetryBuffer:
+    def __init__(self, max_size=10000, flush_interval=5, batch_size=200):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def record(self, **fields):
+        """Registra uma chamada sem bloquear (descarta se o buffer estiver cheio)"""
+        entry = {field: fields.get(field) for field in TELEMETRY_FIELDS}
+        entry['created_at'] = datetime.utcnow()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self._ensure_worker()
+
+    def _ensure_worker(self):
+        if self.thread and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name='llm-telemetry', daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = []
+            try:
+                batch.append(self.queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            if batch:
+                self.flush(batch)
+
+    def flush(self, batch):
+        """Grava um lote de registros na tabela llm_call_log"""
+        try:
+            from app import app, db
+            from models.models import LLMCallLog
+
+            with app.app_context():
+                with db.engine.begin() as connection:
+                    connection.execute(LLMCallLog.__table__.insert(), batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.warning(f"Could not write {len(batch)} LLM telemetry records: {str(e)}")
+
+# Global telemetry buffer
+telemetry_buffer = TelemetryBuffer()
+
+def _latency_bucket_labels():
+    labels = []
+    lower = 0
+    for upper in LATENCY_BUCKETS_MS:
+        labels.append(f"{lower / 1000:g}-{upper / 1000:g}s")
+        lower = upper
+    labels.append(f">{lower / 1000:g}s")
+    return labels
+
+def get_llm_metrics(hours=24, job_ids=None):
+    """
+    Métricas das chamadas à IA nas últimas horas: percentis e histograma de latência,
+    vazão por hora, tokens por finalidade e por vaga
+    job_ids restringe às chamadas das vagas informadas (usuários não administradores)
+    As agregações são feitas no banco (GROUP BY): o período pode ter centenas de milhares de chamadas
+    """
+    from sqlalchemy import case
+    from database import db
+    from models.models import LLMCallLog
+
+    since = datetime.utcnow() - timedelta(hours=hours)
+
+    def filtered(*columns):
+        query = db.session.query(*columns).filter(LLMCallLog.created_at >= since)
+        if job_ids is not None:
+            query = query.filter(LLMCallLog.job_id.in_(job_ids))
+        return query
+
+    def total(expression):
+        return db.func.coalesce(db.func.sum(expression), 0)
+
+    is_error = case((LLMCallLog.outcome.in_(('success', 'cancelled')), 0), else_=1)
+    is_cancelled = LLMCallLog.outcome == 'cancelled'
+    call_tokens = db.func.coalesce(LLMCallLog.prompt_tokens, 0) + db.func.coalesce(LLMCallLog.completion_tokens, 0)
+
+    totals = filtered(
+        db.func.count(LLMCallLog.id),
+        total(is_error),
+        total(LLMCallLog.retries),
+        total(case((LLMCallLog.purpose == 'analysis_continuation', 1), else_=0)),
+        total(case((LLMCallLog.outcome == 'success', LLMCallLog.tokens_saved), else_=0)),
+        total(case((db.and_(LLMCallLog.hedged.is_(True), ~is_cancelled), 1), else_=0)),
+        total(case((is_cancelled, 1), else_=0)),
+        total(case((is_cancelled, call_tokens), else_=0))
+    ).one()
+    total_calls, errors, retries, continuation_calls, tokens_saved, hedged_calls, cancelled, cancelled_tokens = totals
+
+    # Percentis de latência (percentile_disc ordena as latências no próprio banco)
+    p50, p95, p99 = filtered(*(
+        db.func.percentile_disc(fraction).within_group(LLMCallLog.latency_ms)
+        for fraction in (0.5, 0.95, 0.99)
+    )).filter(LLMCallLog.latency_ms.isnot(None)).one()
+
+    # Histograma de latência
+    labels = _latency_bucket_labels()
+    bucket = case(
+        *((LLMCallLog.latency_ms < upper, index) for index, upper in enumerate(LATENCY_BUCKETS_MS)),
+        else_=len(LATENCY_BUCKETS_MS)
+    )
+    counts = [0] * len(labels)
+    for index, count in filtered(bucket, db.func.count(LLMCallLog.id)).filter(
+            LLMCallLog.latency_ms.isnot(None)).group_by(bucket):
+        counts[index] = count
+
+    # Vazão e latência média por hora
+    hour = db.func.date_trunc('hour', LLMCallLog.created_at)
+    throughput = [
+        {
+            'hour': slot_hour.strftime('%Y-%m-%d %H:00'),
+            'calls': calls,
+            'errors': int(slot_errors),
+            'tokens': int(tokens),
+            'avg_latency_ms': round(latency_total / calls)
+        }
+        for slot_hour, calls, slot_errors, tokens, latency_total in filtered(
+            hour, db.func.count(LLMCallLog.id), total(is_error), total(call_tokens),
+            total(db.func.coalesce(LLMCallLog.latency_ms, 0))
+        ).group_by(hour).order_by(hour)
+    ]
+
+    # Tokens por finalidade e por vaga
+    token_columns = (
+        db.func.count(LLMCallLog.id),
+        total(LLMCallLog.prompt_tokens),
+        total(LLMCallLog.completion_tokens),
+        total(LLMCallLog.cached_tokens)
+    )
+    by_purpose = {}
+    by_job = {}
+    purpose = db.func.coalesce(LLMCallLog.purpose, 'other')
+    for groups, key_column, query in (
+            (by_purpose, purpose, filtered(purpose, *token_columns).group_by(purpose)),
+            (by_job, LLMCallLog.job_id, filtered(LLMCallLog.job_id, *token_columns)
+             .filter(LLMCallLog.job_id.isnot(None)).group_by(LLMCallLog.job_id))):
+        for key, calls, prompt_tokens, completion_tokens, cached_tokens in query:
+            groups[key] = {'calls': calls, 'prompt_tokens': int(prompt_tokens),
+                           'completion_tokens': int(completion_tokens), 'cached_tokens': int(cached_tokens)}
+
+    # Rota (origem e finalidade) e modelo que atenderam cada chamada
+    by_route = {}
+    for route, call_purpose, model, calls, latency_total in filtered(
+            LLMCallLog.route, LLMCallLog.purpose, LLMCallLog.model, db.func.count(LLMCallLog.id),
+            total(db.func.coalesce(LLMCallLog.latency_ms, 0))
+    ).group_by(LLMCallLog.route, LLMCallLog.purpose, LLMCallLog.model):
+        route = route or 'default:' + (call_purpose or 'other')
+        group = by_route.setdefault(f"{route}|{model or '-'}", {'route': route, 'model': model, 'calls': 0, 'latency_total': 0})
+        group['calls'] += calls
+        group['latency_total'] += int(latency_total)
+
+    return {
+        'hours': hours,
+        'total_calls': total_calls,
+        'errors': int(errors),
+        'retries': int(retries),
+        'continuations': {
+            'calls': int(continuation_calls),
+            'tokens_saved': int(tokens_saved)
+        },
+        'hedging': {
+            'hedged_calls': int(hedged_calls),
+            'cancelled': int(cancelled),
+            'cancelled_tokens': int(cancelled_tokens)
+        },
+        'latency': {
+            'p50': p50,
+            'p95': p95,
+            'p99': p99,
+            'histogram': {'labels': labels, 'counts': counts}
+        },
+        'throughput': throughput,
+        'by_purpose': by_purpose,
+        'by_job': by_job,
+        'by_route': [
+            {
+                'route': group['route'],
+                'model': group['model'],
+                'calls': group['calls'],
+                'avg_latency_ms': round(group['latency_total'] / group['calls'])
+            }
+            for group in sorted(by_route.values(), key=lambda group: -group['calls'])
+        ],
+        'dropped_records': telemetry_buffer.dropped
+    }